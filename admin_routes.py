@@ -1,17 +1,32 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, abort
 from flask_login import login_required, login_user, logout_user, current_user
-from app import app, db
+from app import db
 from models import *
-from forms import *
-from utils import process_tags, get_site_settings, update_tag_usage_counts
+from utils import process_tags, get_site_settings
 from whatsapp_api import get_group_info, verify_invite_link
 from werkzeug.security import check_password_hash
+from templating import card_cache
+from slugs import save_with_slug
+from images import image_pipeline
+from jobs import scheduler, registry as job_registry
+import analytics
+import archive
+import readmodels
+from sqlalchemy import or_
+from sqlalchemy.orm import undefer, undefer_group
+from datetime import datetime
 import json
 import functools
 
 # Create admin blueprint
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
+@admin.context_processor
+def inject_ckeditor():
+    """`ckeditor` for the page and post editors, imported by the first admin page rather than at startup"""
+    from flask_ckeditor import _CKEditor
+    return {'ckeditor': _CKEditor()}
+
 def admin_required(f):
     """Decorator to require admin access"""
     @functools.wraps(f)
@@ -27,6 +42,7 @@ def login():
     if current_user.is_authenticated and current_user.is_admin:
         return redirect(url_for('admin.dashboard'))
     
+    from forms import LoginForm
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
@@ -44,7 +60,7 @@ def login():
 def logout():
     logout_user()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('public.index'))
 
 @admin.route('/')
 @admin.route('/dashboard')
@@ -67,6 +83,11 @@ def dashboard():
     recent_groups = WhatsAppGroup.query.order_by(WhatsAppGroup.created_at.desc()).limit(5).all()
     pending_review = WhatsAppGroup.query.filter_by(status='pending').limit(5).all()
     
+    # Popularity over the last 7 days
+    activity = analytics.totals(days=7)
+    top_joined = analytics.top_groups(analytics.JOINS, days=7, limit=5)
+    top_viewed = analytics.top_groups(analytics.VIEWS, days=7, limit=5)
+    
     stats = {
         'total_groups': total_groups,
         'approved_groups': approved_groups,
@@ -77,13 +98,17 @@ def dashboard():
         'total_languages': total_languages,
         'total_tags': total_tags,
         'total_pages': total_pages,
-        'total_posts': total_posts
+        'total_posts': total_posts,
+        'views_7d': activity[analytics.VIEWS],
+        'joins_7d': activity[analytics.JOINS]
     }
     
     return render_template('admin/dashboard.html', 
                          stats=stats, 
                          recent_groups=recent_groups,
-                         pending_review=pending_review)
+                         pending_review=pending_review,
+                         top_joined=top_joined,
+                         top_viewed=top_viewed)
 
 @admin.route('/groups')
 @login_required
@@ -101,19 +126,56 @@ def groups():
     if search:
         query = query.filter(WhatsAppGroup.name.contains(search))
     
-    groups = query.order_by(WhatsAppGroup.created_at.desc())\
-                  .paginate(page=page, per_page=20, error_out=False)
+    groups = readmodels.paginate(query.order_by(WhatsAppGroup.created_at.desc()), page, 20)
     
     return render_template('admin/groups.html', 
                          groups=groups, 
                          status_filter=status_filter,
                          search=search)
 
+@admin.route('/groups/archived')
+@login_required
+@admin_required
+def archived_groups():
+    page = request.args.get('page', 1, type=int)
+    reason = request.args.get('reason', 'all')
+    search = request.args.get('search', '')
+    
+    query = ArchivedGroup.query
+    if reason != 'all':
+        query = query.filter_by(reason=reason)
+    if search:
+        query = query.filter(or_(ArchivedGroup.name.contains(search), ArchivedGroup.invite_code == search))
+    
+    groups = query.order_by(ArchivedGroup.archived_at.desc(), ArchivedGroup.id.desc())\
+                  .paginate(page=page, per_page=50, error_out=False)
+    
+    return render_template('admin/archived_groups.html', groups=groups, reason=reason, search=search,
+                           due=archive.due_count())
+
+@admin.route('/groups/archived/<int:archived_id>/restore', methods=['POST'])
+@login_required
+@admin_required
+def restore_group(archived_id):
+    archived = ArchivedGroup.query.get_or_404(archived_id)
+    try:
+        group = archive.restore(archived)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+        return redirect(url_for('admin.archived_groups'))
+    image_pipeline.enqueue(group.id)
+    
+    flash(f'Group "{group.name}" has been restored ({group.status}).', 'success')
+    return redirect(url_for('admin.edit_group', group_id=group.id))
+
 @admin.route('/groups/<int:group_id>/edit', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def edit_group(group_id):
-    group = WhatsAppGroup.query.get_or_404(group_id)
+    group = WhatsAppGroup.query.options(undefer_group('text')).get_or_404(group_id)
+    from forms import GroupEditForm
     form = GroupEditForm(obj=group)
     
     # Populate form choices
@@ -126,6 +188,8 @@ def edit_group(group_id):
         form.tags.data = ', '.join([tag.name for tag in group.tags])
     
     if form.validate_on_submit():
+        name_changed = form.name.data != group.name
+        link_changed = form.invite_link.data != group.invite_link
         group.name = form.name.data
         group.description = form.description.data
         group.invite_link = form.invite_link.data
@@ -138,9 +202,9 @@ def edit_group(group_id):
         group.meta_title = form.meta_title.data
         group.meta_description = form.meta_description.data
         
-        # Update slug if name changed
-        from slugify import slugify
-        group.slug = slugify(group.name)
+        # Update slug if name changed (the old one keeps redirecting)
+        if name_changed:
+            save_with_slug(group, group.name, allocate=True)
         
         # Process tags
         group.tags.clear()
@@ -151,16 +215,22 @@ def edit_group(group_id):
         # Update invite code
         group.invite_code = group._extract_invite_code(group.invite_link)
         
+        # Tag-only edits don't touch the row, so bump updated_at explicitly
+        # (cached group cards are keyed on it)
+        group.updated_at = datetime.utcnow()
+        
         # Try to update image if link changed
-        if form.invite_link.data != group.invite_link:
+        if link_changed:
             try:
                 group_info = get_group_info(form.invite_link.data)
                 if group_info and group_info.get('image_url'):
                     group.image_url = group_info['image_url']
             except Exception as e:
-                app.logger.warning(f"Could not update group image: {e}")
+                current_app.logger.warning(f"Could not update group image: {e}")
         
         db.session.commit()
+        if link_changed:
+            image_pipeline.enqueue(group.id)
         flash(f'Group "{group.name}" has been updated.', 'success')
         return redirect(url_for('admin.groups'))
     
@@ -227,10 +297,11 @@ def categories():
 @login_required
 @admin_required
 def add_category():
+    from forms import CategoryForm
     form = CategoryForm()
     if form.validate_on_submit():
         category = Category(name=form.name.data, description=form.description.data)
-        db.session.add(category)
+        save_with_slug(category, category.name, allocate=True)
         db.session.commit()
         flash(f'Category "{category.name}" has been created.', 'success')
         return redirect(url_for('admin.categories'))
@@ -242,13 +313,17 @@ def add_category():
 @admin_required
 def edit_category(category_id):
     category = Category.query.get_or_404(category_id)
+    from forms import CategoryForm
     form = CategoryForm(obj=category)
     
     if form.validate_on_submit():
+        name_changed = form.name.data != category.name
         category.name = form.name.data
         category.description = form.description.data
-        category.slug = slugify(category.name)
+        if name_changed:
+            save_with_slug(category, category.name, allocate=True)
         db.session.commit()
+        card_cache.clear()
         flash(f'Category "{category.name}" has been updated.', 'success')
         return redirect(url_for('admin.categories'))
     
@@ -268,6 +343,7 @@ def delete_category(category_id):
     category_name = category.name
     db.session.delete(category)
     db.session.commit()
+    card_cache.clear()
     
     flash(f'Category "{category_name}" has been deleted.', 'success')
     return redirect(url_for('admin.categories'))
@@ -276,13 +352,8 @@ def delete_category(category_id):
 @login_required
 @admin_required
 def update_tag_counts():
-    """Update tag usage counts"""
-    try:
-        update_tag_usage_counts()
-        flash('Tag usage counts updated successfully!', 'success')
-    except Exception as e:
-        flash(f'Error updating tag counts: {str(e)}', 'error')
-    return redirect(url_for('admin.tags'))
+    """Queue a recount of tag usage"""
+    return queue_job('update-tag-counts', 'Tag usage counts are being updated.')
 
 @admin.route('/tags')
 @login_required
@@ -307,8 +378,13 @@ def delete_tag(tag_id):
     tag = Tag.query.get_or_404(tag_id)
     tag_name = tag.name
     
+    # The tag's groups change without their rows being touched; bump updated_at
+    # so pre-rendered pages (and cached cards) are rebuilt
+    WhatsAppGroup.query.filter(WhatsAppGroup.tags.any(Tag.id == tag.id))\
+        .update({'updated_at': datetime.utcnow()}, synchronize_session=False)
     db.session.delete(tag)
     db.session.commit()
+    card_cache.clear()
     
     flash(f'Tag "{tag_name}" has been deleted.', 'success')
     return redirect(url_for('admin.tags'))
@@ -317,19 +393,7 @@ def delete_tag(tag_id):
 @login_required
 @admin_required
 def cleanup_unused_tags():
-    # Find tags that are not associated with any groups
-    unused_tags = Tag.query.filter(~Tag.groups.any()).all()
-    
-    if not unused_tags:
-        flash('No unused tags found.', 'info')
-    else:
-        count = len(unused_tags)
-        for tag in unused_tags:
-            db.session.delete(tag)
-        db.session.commit()
-        flash(f'Successfully deleted {count} unused tags.', 'success')
-    
-    return redirect(url_for('admin.tags'))
+    return queue_job('cleanup-unused-tags', 'Unused tags are being deleted.')
 
 @admin.route('/pages')
 @login_required
@@ -342,6 +406,7 @@ def pages():
 @login_required
 @admin_required
 def add_page():
+    from forms import PageForm
     form = PageForm()
     if form.validate_on_submit():
         page = Page(title=form.title.data, content=form.content.data)
@@ -349,7 +414,7 @@ def add_page():
         page.meta_description = form.meta_description.data
         page.is_published = form.is_published.data
         
-        db.session.add(page)
+        save_with_slug(page, page.title, allocate=True)
         db.session.commit()
         flash(f'Page "{page.title}" has been created.', 'success')
         return redirect(url_for('admin.pages'))
@@ -360,16 +425,19 @@ def add_page():
 @login_required
 @admin_required
 def edit_page(page_id):
-    page = Page.query.get_or_404(page_id)
+    page = Page.query.options(undefer(Page.content)).get_or_404(page_id)
+    from forms import PageForm
     form = PageForm(obj=page)
     
     if form.validate_on_submit():
+        title_changed = form.title.data != page.title
         page.title = form.title.data
         page.content = form.content.data
         page.meta_title = form.meta_title.data
         page.meta_description = form.meta_description.data
         page.is_published = form.is_published.data
-        page.slug = slugify(page.title)
+        if title_changed:
+            save_with_slug(page, page.title, allocate=True)
         
         db.session.commit()
         flash(f'Page "{page.title}" has been updated.', 'success')
@@ -394,13 +462,14 @@ def delete_page(page_id):
 @login_required
 @admin_required
 def posts():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
+    posts = readmodels.load_post_summaries(Post.query.order_by(Post.created_at.desc()))
     return render_template('admin/posts.html', posts=posts)
 
 @admin.route('/posts/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def add_post():
+    from forms import PostForm
     form = PostForm()
     if form.validate_on_submit():
         post = Post(title=form.title.data, content=form.content.data)
@@ -410,7 +479,7 @@ def add_post():
         post.meta_description = form.meta_description.data
         post.is_published = form.is_published.data
         
-        db.session.add(post)
+        save_with_slug(post, post.title, allocate=True)
         db.session.commit()
         flash(f'Post "{post.title}" has been created.', 'success')
         return redirect(url_for('admin.posts'))
@@ -421,10 +490,12 @@ def add_post():
 @login_required
 @admin_required
 def edit_post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(undefer(Post.content)).get_or_404(post_id)
+    from forms import PostForm
     form = PostForm(obj=post)
     
     if form.validate_on_submit():
+        title_changed = form.title.data != post.title
         post.title = form.title.data
         post.content = form.content.data
         post.excerpt = form.excerpt.data
@@ -432,7 +503,8 @@ def edit_post(post_id):
         post.meta_title = form.meta_title.data
         post.meta_description = form.meta_description.data
         post.is_published = form.is_published.data
-        post.slug = slugify(post.title)
+        if title_changed:
+            save_with_slug(post, post.title, allocate=True)
         
         db.session.commit()
         flash(f'Post "{post.title}" has been updated.', 'success')
@@ -458,6 +530,7 @@ def delete_post(post_id):
 @admin_required
 def settings():
     settings = get_site_settings()
+    from forms import SettingsForm
     form = SettingsForm(obj=settings)
     
     if form.validate_on_submit():
@@ -490,13 +563,16 @@ def notifications():
 @login_required
 @admin_required
 def add_notification():
+    from forms import NotificationForm
     form = NotificationForm()
     if form.validate_on_submit():
         notification = Notification(
             title=form.title.data,
             message=form.message.data,
             notification_type=form.notification_type.data,
-            is_active=form.is_active.data
+            is_active=form.is_active.data,
+            start_date=form.start_date.data,
+            end_date=form.end_date.data
         )
         
         db.session.add(notification)
@@ -511,6 +587,7 @@ def add_notification():
 @admin_required
 def edit_notification(notification_id):
     notification = Notification.query.get_or_404(notification_id)
+    from forms import NotificationForm
     form = NotificationForm(obj=notification)
     
     if form.validate_on_submit():
@@ -518,6 +595,8 @@ def edit_notification(notification_id):
         notification.message = form.message.data
         notification.notification_type = form.notification_type.data
         notification.is_active = form.is_active.data
+        notification.start_date = form.start_date.data
+        notification.end_date = form.end_date.data
         
         db.session.commit()
         flash(f'Notification "{notification.title}" has been updated.', 'success')
@@ -544,65 +623,52 @@ def delete_notification(notification_id):
 @admin_required
 def init_data():
     """Initialize default categories, countries, and languages"""
-    
-    # Categories
-    categories_data = [
-        'Adult/18+/Hot', 'Art/Design/Photography', 'Auto/Vehicle', 'Business/Advertising/Marketing',
-        'Comedy/Funny', 'Dating/Flirting/Chatting', 'Education/School', 'Entertainment/Masti',
-        'Family/Relationships', 'Fan Club/Celebrities', 'Fashion/Style/Clothing', 'Film/Animation',
-        'Food/Drinks', 'Gaming/Apps', 'Health/Beauty/Fitness', 'Jobs/Career', 'Money/Earning',
-        'Music/Audio/Songs', 'News/Magazines/Politics', 'Pets/Animals/Nature', 'Roleplay/Comics',
-        'Science/Technology', 'Shopping/Buy/Sell', 'Social/Friendship/Community', 'Spiritual/Devotional',
-        'Sports/Games', 'Thoughts/Quotes/Jokes', 'Travel/Local/Place'
-    ]
-    
-    for cat_name in categories_data:
-        if not Category.query.filter_by(name=cat_name).first():
-            category = Category(name=cat_name)
-            db.session.add(category)
-    
-    # Countries
-    countries_data = [
-        'Algeria', 'Argentina', 'Australia', 'Austria', 'Azerbaijan', 'Bahrain', 'Bangladesh',
-        'Belarus', 'Belgium', 'Bolivia', 'Bosnia and Herzegovina', 'Brazil', 'Bulgaria',
-        'Canada', 'Chile', 'China', 'Colombia', 'Croatia', 'Czechia', 'Denmark', 'Egypt',
-        'Estonia', 'Ethiopia', 'Finland', 'France', 'Georgia', 'Germany', 'Ghana', 'Greece',
-        'Hong Kong', 'Hungary', 'Iceland', 'India', 'Indonesia', 'Iraq', 'Ireland', 'Israel',
-        'Italy', 'Jamaica', 'Japan', 'Jordan', 'Kazakhstan', 'Kenya', 'Kuwait', 'Latvia',
-        'Lebanon', 'Libya', 'Lithuania', 'Luxembourg', 'Macedonia', 'Malawi', 'Malaysia',
-        'Mexico', 'Montenegro', 'Morocco', 'Mozambique', 'Nepal', 'Netherlands', 'New Zealand',
-        'Nigeria', 'Norway', 'Oman', 'Pakistan', 'Panama', 'Peru', 'Philippines', 'Poland',
-        'Portugal', 'Puerto Rico', 'Qatar', 'Romania', 'Russia', 'Saudi Arabia', 'Senegal',
-        'Serbia', 'Singapore', 'Slovakia', 'Slovenia', 'South Africa', 'South Korea', 'Spain',
-        'Sri Lanka', 'Sweden', 'Switzerland', 'Taiwan', 'Tanzania', 'Thailand', 'Togo',
-        'Tunisia', 'Turkey', 'Uganda', 'Ukraine', 'United Arab Emirates', 'United Kingdom',
-        'United States', 'Venezuela', 'Vietnam', 'Yemen', 'Zimbabwe'
-    ]
-    
-    for country_name in countries_data:
-        if not Country.query.filter_by(name=country_name).first():
-            country = Country(name=country_name)
-            db.session.add(country)
-    
-    # Languages
-    languages_data = [
-        'Afrikaans', 'Albanian', 'Amharic', 'Arabic', 'Armenian', 'Azerbaijani', 'Bangla',
-        'Basque', 'Belarusian', 'Bosnian', 'Bulgarian', 'Catalan', 'Chinese', 'Croatian',
-        'Czech', 'Danish', 'Dutch', 'English', 'Estonian', 'Filipino', 'Finnish', 'French',
-        'Galician', 'Georgian', 'German', 'Greek', 'Gujarati', 'Hebrew', 'Hindi', 'Hungarian',
-        'Icelandic', 'Indonesian', 'Italian', 'Japanese', 'Kannada', 'Kazakh', 'Khmer',
-        'Korean', 'Kyrgyz', 'Lao', 'Latvian', 'Lithuanian', 'Macedonian', 'Malay',
-        'Malayalam', 'Marathi', 'Mongolian', 'Myanmar', 'Nepali', 'Norwegian', 'Persian',
-        'Polish', 'Portuguese', 'Punjabi', 'Romanian', 'Russian', 'Serbian', 'Sinhala',
-        'Slovak', 'Slovenian', 'Spanish', 'Swahili', 'Swedish', 'Tamil', 'Telugu', 'Thai',
-        'Turkish', 'Ukrainian', 'Urdu', 'Uzbek', 'Vietnamese', 'Zulu'
-    ]
-    
-    for lang_name in languages_data:
-        if not Language.query.filter_by(name=lang_name).first():
-            language = Language(name=lang_name)
-            db.session.add(language)
-    
-    db.session.commit()
-    flash('Default data has been initialized successfully!', 'success')
-    return redirect(url_for('admin.dashboard'))
+    return queue_job('seed-data', 'Default data is being initialized.')
+
+# Background jobs
+
+def queue_job(name, message):
+    run_id = scheduler.enqueue(name)
+    if scheduler.alive():
+        flash(f'{message} Progress is shown below.', 'info')
+    else:
+        # The generated serving configs keep jobs out of web workers
+        flash(f'{name} has been queued, but no job scheduler is running, so it won\'t start '
+              'until one does (flask run-jobs).', 'warning')
+    return redirect(url_for('admin.jobs', _anchor=f'run-{run_id}'))
+
+@admin.route('/jobs')
+@login_required
+@admin_required
+def jobs():
+    leases = {lease.name: lease for lease in JobLease.query.all()}
+    recent = JobRun.query.order_by(JobRun.id.desc()).limit(50).all()
+    last_runs = {}
+    for run in JobRun.query.filter(JobRun.id.in_(
+            db.session.query(db.func.max(JobRun.id)).filter(JobRun.finished_at.isnot(None)).group_by(JobRun.name))):
+        last_runs[run.name] = run
+    job_list = [{'name': name, 'description': entry.description, 'schedule': scheduler.schedules.get(name),
+                 'lease': leases.get(name), 'last_run': last_runs.get(name)}
+                for name, entry in sorted(job_registry.items())]
+    return render_template('admin/jobs.html', jobs=job_list, runs=recent, scheduler=scheduler,
+                           scheduler_alive=scheduler.alive())
+
+@admin.route('/jobs/<name>/run', methods=['POST'])
+@login_required
+@admin_required
+def run_job(name):
+    if name not in job_registry:
+        abort(404)
+    return queue_job(name, f'{name} has been queued.')
+
+@admin.route('/jobs/runs.json')
+@login_required
+@admin_required
+def job_runs_status():
+    """Status of the runs in ?ids=1,2,3, polled by the jobs page"""
+    ids = [int(run_id) for run_id in request.args.get('ids', '').split(',') if run_id.isdigit()][:50]
+    runs = JobRun.query.filter(JobRun.id.in_(ids)).all() if ids else []
+    return jsonify({str(run.id): {
+        'status': run.status, 'progress': run.progress, 'total': run.total, 'message': run.message,
+        'duration_ms': run.duration_ms, 'rows': run.rows, 'error': run.error,
+    } for run in runs})
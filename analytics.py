@@ -0,0 +1,245 @@
+"""Group view and join-click analytics.
+
+Events are counted in memory per worker and flushed by a background thread
+as one batched upsert into hourly and daily ``group_stat`` buckets, so hot
+groups never serialize requests on a counter row.
+
+A crash loses at most the unflushed buffer: ``ANALYTICS_FLUSH_INTERVAL``
+seconds (default 10) or ``ANALYTICS_MAX_BUFFER`` events (default 1000) per
+worker, whichever comes first. Set ``ANALYTICS_ENABLED=0`` to turn recording
+off entirely.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import request, has_app_context
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+VIEWS = 'views'
+JOINS = 'joins'
+
+BOT_PATTERN = re.compile(r'bot|crawl|spider|slurp|facebookexternalhit|preview', re.IGNORECASE)
+
+class EventBuffer:
+    """Per-worker counters waiting to be flushed"""
+
+    def __init__(self):
+        self._counts = defaultdict(int)  # (group_id, field, hour) -> count
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def add(self, group_id, field, when):
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            self._counts[(group_id, field, hour)] += 1
+            self.pending += 1
+            return self.pending
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            self.pending = 0
+        return counts
+
+class Analytics:
+    def __init__(self):
+        self.app = None
+        self.buffer = EventBuffer()
+        self.enabled = False
+        self.flush_interval = 10.0
+        self.max_buffer = 1000
+        self.hourly_retention_days = 14
+        self._wake = threading.Event()
+        self._flusher = ProcessThread('analytics-flush', self._run)
+        self._last_prune = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('ANALYTICS_ENABLED', '1') == '1'
+        self.flush_interval = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', self.flush_interval))
+        self.max_buffer = int(os.environ.get('ANALYTICS_MAX_BUFFER', self.max_buffer))
+        self.hourly_retention_days = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS',
+                                                        self.hourly_retention_days))
+        app.extensions['analytics'] = self
+        atexit.register(self.flush)
+
+    # Recording
+
+    def record_view(self, group_id):
+        self._record(group_id, VIEWS)
+
+    def record_join(self, group_id):
+        self._record(group_id, JOINS)
+
+    def _record(self, group_id, field):
+        if not self.enabled or BOT_PATTERN.search(request.headers.get('User-Agent', '')):
+            return
+        self._flusher.ensure()
+        if self.buffer.add(group_id, field, datetime.utcnow()) >= self.max_buffer:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+                    if time.monotonic() - self._last_prune > 3600:
+                        self._last_prune = time.monotonic()
+                        prune_hourly(self.hourly_retention_days)
+            except Exception as e:
+                logger.error(f"Analytics flush failed: {e}")
+
+    # Flushing
+
+    def flush(self):
+        """Write buffered events; returns the number of bucket rows upserted"""
+        counts = self.buffer.drain()
+        if not counts:
+            return 0
+        rows = rows_from_counts(counts)
+        if self.app is not None and not has_app_context():
+            with self.app.app_context():
+                return write_rows(rows)
+        return write_rows(rows)
+
+def rows_from_counts(counts):
+    """Fold (group, field, hour) counts into hourly and daily bucket rows"""
+    buckets = {}
+    for (group_id, field, hour), count in counts.items():
+        day = hour.replace(hour=0)
+        for granularity, bucket in (('hour', hour), ('day', day)):
+            key = (group_id, granularity, bucket)
+            row = buckets.setdefault(key, {
+                'group_id': group_id, 'granularity': granularity, 'bucket': bucket,
+                VIEWS: 0, JOINS: 0,
+            })
+            row[field] += count
+    return list(buckets.values())
+
+def write_rows(rows):
+    """Upsert `rows` through the write queue; returns the number written"""
+    from sqlite_mode import write_queue
+
+    return write_queue.run(lambda connection: write_counters(connection, rows))
+
+def write_counters(connection, rows):
+    from models import WhatsAppGroup
+
+    try:
+        with connection.begin_nested():
+            upsert_counters(connection, rows)
+    except IntegrityError:
+        # A group was deleted since its events were buffered; drop those rows
+        table = WhatsAppGroup.__table__
+        existing = set(connection.execute(
+            select(table.c.id).where(table.c.id.in_({r['group_id'] for r in rows}))).scalars())
+        rows = [r for r in rows if r['group_id'] in existing]
+        if rows:
+            upsert_counters(connection, rows)
+    return len(rows)
+
+def upsert_counters(connection, rows):
+    """Add `rows` onto existing buckets in one statement where the database allows"""
+    from models import GroupStat
+
+    table = GroupStat.__table__
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.group_id, table.c.granularity, table.c.bucket],
+            set_={
+                VIEWS: table.c.views + stmt.excluded.views,
+                JOINS: table.c.joins + stmt.excluded.joins,
+            }
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(table.c.group_id == row['group_id'],
+                   table.c.granularity == row['granularity'],
+                   table.c.bucket == row['bucket'])
+            .values(views=table.c.views + row[VIEWS], joins=table.c.joins + row[JOINS])
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+def prune_hourly(days):
+    """Delete hourly buckets older than `days`; daily buckets are kept"""
+    from models import GroupStat
+    from sqlite_mode import write_queue
+
+    table = GroupStat.__table__
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stmt = table.delete().where(table.c.granularity == 'hour', table.c.bucket < cutoff)
+    return write_queue.run(lambda connection: connection.execute(stmt).rowcount)
+
+def period_start(days):
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
+
+def counts_subquery(field=JOINS, days=7):
+    """(group_id, total) over the last `days` daily buckets, for joining into listings"""
+    from models import GroupStat
+
+    column = getattr(GroupStat, field)
+    return db.session.query(
+        GroupStat.group_id.label('group_id'),
+        func.sum(column).label('total')
+    ).filter(
+        GroupStat.granularity == 'day',
+        GroupStat.bucket >= period_start(days)
+    ).group_by(GroupStat.group_id).subquery()
+
+def order_by_popularity(query, field=JOINS, days=7):
+    """Order a WhatsAppGroup query by `field` over the last `days` (e.g. most joined this week)"""
+    from models import WhatsAppGroup
+
+    counts = counts_subquery(field, days)
+    return query.outerjoin(counts, counts.c.group_id == WhatsAppGroup.id)\
+                .order_by(func.coalesce(counts.c.total, 0).desc(), WhatsAppGroup.created_at.desc())
+
+def top_groups(field=JOINS, days=7, limit=10):
+    """[(group, count)] for the most viewed/joined approved groups"""
+    from models import WhatsAppGroup
+
+    counts = counts_subquery(field, days)
+    return db.session.query(WhatsAppGroup, counts.c.total)\
+        .join(counts, counts.c.group_id == WhatsAppGroup.id)\
+        .filter(WhatsAppGroup.status == 'approved')\
+        .order_by(counts.c.total.desc())\
+        .limit(limit).all()
+
+def totals(days=7):
+    """{'views': n, 'joins': n} across all groups for the last `days`"""
+    from models import GroupStat
+
+    views, joins = db.session.query(
+        func.coalesce(func.sum(GroupStat.views), 0),
+        func.coalesce(func.sum(GroupStat.joins), 0)
+    ).filter(GroupStat.granularity == 'day', GroupStat.bucket >= period_start(days)).one()
+    return {VIEWS: views, JOINS: joins}
+
+analytics = Analytics()
@@ -0,0 +1,230 @@
+"""Read-only JSON API, version 1.
+
+    GET /api/v1/groups?category=&country=&language=&tag=&fields=&include=&cursor=&limit=
+    GET /api/v1/groups/<slug>?fields=&include=
+    GET /api/v1/categories | countries | languages | tags ?fields=&cursor=&limit=
+
+Listings are keyset-paginated by id, newest first: a page carries
+``next_cursor`` to send back as ``?cursor=`` until it is null. ``fields``
+picks a sparse fieldset (only those columns are loaded) and ``include``
+embeds a group's category, country, language and/or tags, eager-loaded
+rather than one query per group. Filters take the same slugs as the HTML
+listings, old slugs included.
+
+Bodies are serialized with orjson when it is installed (stdlib json
+otherwise), carry an ETag and answer a matching If-None-Match with 304.
+Each client is limited to ``API_RATE_PER_MINUTE`` requests (default 120) per
+address, or per key for keys registered in ``API_KEYS``, see ratelimit.py.
+"""
+import base64
+import hashlib
+import json
+import os
+
+from flask import Blueprint, Response, request, abort
+from sqlalchemy.orm import joinedload, load_only, noload, selectinload
+from werkzeug.exceptions import HTTPException
+
+from models import WhatsAppGroup, Category, Country, Language, Tag
+from ratelimit import rate_limiter
+from routes import approved_groups
+from slugs import slug_resolver
+import slugs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+RATE_PER_MINUTE = int(os.environ.get('API_RATE_PER_MINUTE', 120))
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+CACHE_SECONDS = 60
+
+GROUP_FIELDS = ('id', 'slug', 'name', 'description', 'invite_link', 'image_url', 'member_count',
+                'featured', 'category_id', 'country_id', 'language_id', 'created_at', 'updated_at')
+TAXONOMY_FIELDS = {
+    Category: ('id', 'slug', 'name', 'description'),
+    Country: ('id', 'slug', 'name', 'code'),
+    Language: ('id', 'slug', 'name', 'code'),
+    Tag: ('id', 'slug', 'name', 'usage_count'),
+}
+INCLUDES = {
+    'category': ('category_ref', Category),
+    'country': ('country_ref', Country),
+    'language': ('language_ref', Language),
+}
+EMBEDDED_FIELDS = ('id', 'slug', 'name')
+
+# Serialization
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+def json_response(payload, status=200):
+    """Serialized response with an ETag; 304 when the client already has it"""
+    body = dumps(payload)
+    response = Response(body, status=status, mimetype='application/json')
+    if status == 200:
+        response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = CACHE_SECONDS
+        response.make_conditional(request)
+    return response
+
+def serialize(obj, fields):
+    return {field: getattr(obj, field) for field in fields}
+
+# Request parsing
+
+def requested_fields(allowed):
+    """Fields named by ?fields= (in `allowed` order), or all of `allowed`"""
+    raw = request.args.get('fields')
+    if not raw:
+        return allowed
+    wanted = {field.strip() for field in raw.split(',') if field.strip()}
+    unknown = wanted.difference(allowed)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in allowed if field in wanted or field == 'id')
+
+def requested_includes():
+    raw = request.args.get('include')
+    if not raw:
+        return ()
+    wanted = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in wanted if name not in INCLUDES and name != 'tags']
+    if unknown:
+        abort(400, f"Unknown includes: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(wanted))
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        abort(400, 'Invalid cursor')
+
+def page_of(query, model):
+    """One keyset page of `query` by descending id, plus the cursor for the next"""
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT))
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(model.id < decode_cursor(cursor))
+    rows = query.order_by(model.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+# Groups
+
+def group_options(fields, includes):
+    """Load only the columns `fields` and the includes need, eager-loading the includes"""
+    columns = set(fields)
+    options = []
+    for name in includes:
+        if name == 'tags':
+            options.append(selectinload(WhatsAppGroup.tags).load_only(*[getattr(Tag, f) for f in EMBEDDED_FIELDS]))
+            continue
+        attribute, model = INCLUDES[name]
+        columns.add(f'{name}_id')
+        options.append(joinedload(getattr(WhatsAppGroup, attribute))
+                       .load_only(*[getattr(model, f) for f in EMBEDDED_FIELDS]))
+    if 'tags' not in includes:
+        options.append(noload(WhatsAppGroup.tags))
+    options.append(noload(WhatsAppGroup.image))
+    options.append(load_only(*[getattr(WhatsAppGroup, c) for c in columns]))
+    return options
+
+def serialize_group(group, fields, includes):
+    data = serialize(group, fields)
+    for name in includes:
+        if name == 'tags':
+            data['tags'] = [serialize(tag, EMBEDDED_FIELDS) for tag in group.tags]
+        else:
+            data[name] = serialize(getattr(group, INCLUDES[name][0]), EMBEDDED_FIELDS)
+    return data
+
+@api.route('/groups')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def groups():
+    filters = {}
+    for facet in ('category', 'country', 'language', 'tag'):
+        slug = request.args.get(facet)
+        if slug:
+            filters[facet] = slug_resolver.resolve(facet, slug)[0]
+            if filters[facet] is None:
+                # Unknown slug: an empty page rather than an unfiltered one
+                return json_response({'data': [], 'next_cursor': None})
+    fields = requested_fields(GROUP_FIELDS)
+    includes = requested_includes()
+    query = approved_groups(filters).options(*group_options(fields, includes))
+    rows, next_cursor = page_of(query, WhatsAppGroup)
+    return json_response({
+        'data': [serialize_group(group, fields, includes) for group in rows],
+        'next_cursor': next_cursor,
+    })
+
+@api.route('/groups/<group_slug>')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def group(group_slug):
+    group_id, moved = slug_resolver.resolve(slugs.GROUP, group_slug)
+    if group_id is None:
+        abort(404)
+    fields = requested_fields(GROUP_FIELDS)
+    includes = requested_includes()
+    group = approved_groups({}).filter(WhatsAppGroup.id == group_id)\
+        .options(*group_options(set(fields) | {'slug'}, includes)).first_or_404()
+    if moved:
+        slugs.redirect_to_current(group_slug=group.slug)
+    return json_response({'data': serialize_group(group, fields, includes)})
+
+# Taxonomies
+
+def taxonomy_listing(model):
+    fields = requested_fields(TAXONOMY_FIELDS[model])
+    query = model.query.options(load_only(*[getattr(model, f) for f in fields]))
+    rows, next_cursor = page_of(query, model)
+    return json_response({'data': [serialize(row, fields) for row in rows], 'next_cursor': next_cursor})
+
+@api.route('/categories')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def categories():
+    return taxonomy_listing(Category)
+
+@api.route('/countries')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def countries():
+    return taxonomy_listing(Country)
+
+@api.route('/languages')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def languages():
+    return taxonomy_listing(Language)
+
+@api.route('/tags')
+@rate_limiter.limit('api', RATE_PER_MINUTE, by_api_key=True)
+def tags():
+    return taxonomy_listing(Tag)
+
+def json_error(error):
+    response = json_response({'error': {'status': error.code, 'message': error.description}}, error.code)
+    for name, value in error.get_headers():
+        if name.lower() != 'content-type':
+            response.headers[name] = value
+    return response
+
+# Code-specific handlers, so the site's HTML 404/500 pages don't win over these
+api.register_error_handler(HTTPException, json_error)
+for code in (400, 404, 405, 429, 500, 503):
+    api.register_error_handler(code, json_error)
@@ -4,85 +4,145 @@ import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_mail import Mail
-from flask_ckeditor import CKEditor
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from replicas import RoutingSession
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 login_manager = LoginManager()
-mail = Mail()
-ckeditor = CKEditor()
-
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-    "pool_timeout": 20,
-    "pool_size": 10,
-    "max_overflow": 20,
-    "echo": False
-}
-
-# Flask-Login configuration
-app.config['LOGIN_VIEW'] = 'admin.login'
-app.config['LOGIN_MESSAGE'] = 'Please log in to access the admin panel.'
-app.config['LOGIN_MESSAGE_CATEGORY'] = 'info'
-
-# Flask-Mail configuration
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
-app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', '587'))
-app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
-app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
-
-# CKEditor configuration
-app.config['CKEDITOR_SERVE_LOCAL'] = False
-app.config['CKEDITOR_HEIGHT'] = 400
-
-# Initialize extensions
-db.init_app(app)
-login_manager.init_app(app)
-mail.init_app(app)
-ckeditor.init_app(app)
-
-# Import models and routes
-from models import *
-from routes import *
-from admin_routes import admin
-
-# Register blueprints
-app.register_blueprint(admin)
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-with app.app_context():
-    db.create_all()
-    
-    # Create default admin user if none exists
-    if not User.query.filter_by(username='admin').first():
-        from werkzeug.security import generate_password_hash
-        admin_user = User(
-            username='admin',
-            email='admin@example.com',
-            password_hash=generate_password_hash('admin123'),
-            is_admin=True
-        )
-        db.session.add(admin_user)
-        db.session.commit()
-        print("Default admin user created: admin/admin123")
+
+def create_app(config=None):
+    """Build and configure the Flask application.
+
+    Nothing here touches the database: schema creation and seeding live in
+    the ``flask init-db`` / ``flask seed-data`` commands (see cli.py).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+        "pool_timeout": 20,
+        # Sized per worker by the serving profile (see serving.py)
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "echo": False
+    }
+
+    # Flask-Login configuration
+    app.config['LOGIN_VIEW'] = 'admin.login'
+    app.config['LOGIN_MESSAGE'] = 'Please log in to access the admin panel.'
+    app.config['LOGIN_MESSAGE_CATEGORY'] = 'info'
+
+    # Flask-Mail configuration
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', '587'))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ['true', 'on', '1']
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
+
+    # CKEditor configuration. The admin editors load it from the CDN, and
+    # Flask-CKEditor is only imported for their templates (see admin_routes.py),
+    # so every setting its helpers read is set here rather than by CKEditor(app).
+    app.config['CKEDITOR_SERVE_LOCAL'] = False
+    app.config['CKEDITOR_PKG_TYPE'] = 'standard'
+    app.config['CKEDITOR_HEIGHT'] = 400
+    app.config['CKEDITOR_WIDTH'] = 0
+    app.config['CKEDITOR_LANGUAGE'] = ''
+    app.config['CKEDITOR_CODE_THEME'] = 'monokai_sublime'
+    app.config['CKEDITOR_FILE_UPLOADER'] = ''
+    app.config['CKEDITOR_FILE_BROWSER'] = ''
+    app.config['CKEDITOR_EXTRA_PLUGINS'] = []
+    app.config['CKEDITOR_ENABLE_CODESNIPPET'] = False
+    app.config['CKEDITOR_ENABLE_CSRF'] = False
+
+    if config:
+        app.config.update(config)
+
+    # SQLite files get their own engine profile and pragmas (see sqlite_mode.py)
+    import sqlite_mode
+    use_sqlite_mode = sqlite_mode.enabled(app.config["SQLALCHEMY_DATABASE_URI"])
+    if use_sqlite_mode:
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = sqlite_mode.engine_options(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+
+    # First, so request timings include every other hook
+    from metrics import metrics
+    metrics.init_app(app)
+
+    # Query budgets count statements from the first before_request hook on
+    from query_budget import query_budgets
+    query_budgets.init_app(app)
+
+    # Read replicas add SQLALCHEMY_BINDS, so they must be set up before db.init_app
+    import replicas
+    replicas.init_app(app, db)
+
+    # Initialize extensions
+    db.init_app(app)
+    if use_sqlite_mode:
+        sqlite_mode.install_pragmas(app)
+    login_manager.init_app(app)
+
+    # Nothing sends mail yet, so Flask-Mail is only loaded once a server is configured
+    if app.config['MAIL_SERVER']:
+        from flask_mail import Mail
+        Mail(app)
+
+    # Import models and routes
+    import models  # noqa: F401
+    from routes import public
+    from ratelimit import rate_limiter
+    import cli
+    import templating
+    from analytics import analytics
+    from slugs import slug_resolver
+    from facets import facet_index
+    from images import image_pipeline, media
+    from assets import asset_manifest, assets
+    from compression import compressor
+    from notifications import notification_schedule
+    from principals import principal_cache
+    from sqlite_mode import write_queue
+    from invalidation import invalidation_bus
+    from jobs import scheduler
+
+    # Register blueprints. Workers that only serve the public site (the
+    # submit pool, see serving.py) leave out the admin panel and the API:
+    # neither is imported then, and their rules aren't compiled.
+    app.register_blueprint(public)
+    if os.environ.get('ADMIN_ENABLED', '1') == '1':
+        from admin_routes import admin
+        app.register_blueprint(admin)
+    if os.environ.get('API_ENABLED', '1') == '1':
+        from api import api
+        app.register_blueprint(api)
+    app.register_blueprint(media)
+    app.register_blueprint(assets)
+    cli.init_app(app)
+    templating.init_app(app)
+    asset_manifest.init_app(app)
+    write_queue.init_app(app)
+    invalidation_bus.init_app(app)
+    analytics.init_app(app)
+    rate_limiter.init_app(app)
+    slug_resolver.init_app(app)
+    facet_index.init_app(app)
+    image_pipeline.init_app(app)
+    notification_schedule.init_app(app)
+    principal_cache.init_app(app, login_manager)
+    compressor.init_app(app)
+    scheduler.init_app(app)
+
+    return app
@@ -0,0 +1,198 @@
+"""Cold storage for rejected and dead groups.
+
+Rejected groups and groups whose invite links died stay out of every public
+listing, yet left in ``whatsapp_group`` they would widen every status
+filtered scan and index. The ``archive-groups`` job moves them, in batches of
+``ARCHIVE_BATCH`` (default 500), to ``archived_group``:
+
+* rejected groups not touched for ``ARCHIVE_REJECTED_DAYS`` (default 30)
+* groups whose link has been dead (``link_check.dead_since``, see the
+  verify-links job) for ``ARCHIVE_DEAD_DAYS`` (default 14)
+
+An archived group is one narrow row: its group id, name, invite code,
+status and why it was archived, and the rest of the group (every other
+column and its tag ids) as JSON. Its stats, thumbnail record, link check,
+ranking and slug history rows are dropped. The invite code stays unique
+there, so ``is_archived`` blocks resubmitting the group; ``restore`` puts it
+back under its old id, and its old slug where still free, for the admin
+panel and ``flask restore-group``. ``whatsapp_group`` ids are AUTOINCREMENT,
+so an archived group's id is never given to a new group.
+
+Archiving is Core statements in the write queue, so it publishes its
+deletes to the other workers' caches itself; restoring goes through the ORM
+like any admin edit.
+"""
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, delete, func, literal, or_, select
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+REJECTED, DEAD = 'rejected', 'dead'
+# Kept as columns of archived_group; everything else goes into its JSON
+KEPT_COLUMNS = ('id', 'name', 'invite_code', 'status')
+
+def encode(row, columns):
+    """JSON for the columns of `row` not kept as archive columns"""
+    data = {}
+    for column in columns:
+        if column.name not in KEPT_COLUMNS:
+            value = row[column.name]
+            data[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+def decode(data, columns):
+    """Column values from archive JSON; columns added since it was written keep their defaults"""
+    values = {}
+    for name, value in data.items():
+        if name in columns:
+            if value is not None and isinstance(columns[name].type, DateTime):
+                value = datetime.fromisoformat(value)
+            values[name] = value
+    return values
+
+def settings(now, rejected_days, dead_days):
+    """The arguments of an archive run, defaults filled in from the environment"""
+    return (now or datetime.utcnow(),
+            int(os.environ.get('ARCHIVE_REJECTED_DAYS', 30)) if rejected_days is None else rejected_days,
+            int(os.environ.get('ARCHIVE_DEAD_DAYS', 14)) if dead_days is None else dead_days)
+
+def candidates(now, rejected_days, dead_days, after=None):
+    """Selects of (group id, reason) for the groups due for the archive: dead ones, then rejected ones
+
+    `after` maps each reason to the last group id a previous batch took;
+    each select resumes past it, in id order, so a run reads the table once
+    instead of rescanning the rows it kept on every batch.
+    """
+    from models import WhatsAppGroup, LinkCheck
+
+    after = after or {}
+    dead_ids = select(LinkCheck.group_id).where(LinkCheck.dead_since < now - timedelta(days=dead_days))
+    dead = select(LinkCheck.group_id, literal(DEAD))\
+        .where(LinkCheck.dead_since < now - timedelta(days=dead_days), LinkCheck.group_id > after.get(DEAD, 0))\
+        .order_by(LinkCheck.group_id)
+    rejected = select(WhatsAppGroup.id, literal(REJECTED))\
+        .where(WhatsAppGroup.id > after.get(REJECTED, 0), WhatsAppGroup.status == REJECTED,
+               WhatsAppGroup.updated_at < now - timedelta(days=rejected_days), WhatsAppGroup.id.notin_(dead_ids))\
+        .order_by(WhatsAppGroup.id)
+    return dead, rejected
+
+def due_count(now=None, rejected_days=None, dead_days=None):
+    """How many groups an archive run would move"""
+    now, rejected_days, dead_days = settings(now, rejected_days, dead_days)
+    return sum(db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+               for query in candidates(now, rejected_days, dead_days))
+
+def archive_batch(connection, now, rejected_days, dead_days, batch, after=None):
+    """Move up to `batch` due groups to the archive; {group id: reason}"""
+    from models import (WhatsAppGroup, ArchivedGroup, GroupStat, GroupImage, LinkCheck, RankScore,
+                        SlugHistory, group_tags)
+
+    due = {}
+    for query in candidates(now, rejected_days, dead_days, after):
+        if len(due) < batch:
+            due.update(connection.execute(query.limit(batch - len(due))).all())
+    if not due:
+        return due
+    ids = list(due)
+    groups = WhatsAppGroup.__table__
+    tags = defaultdict(list)
+    for group_id, tag_id in connection.execute(select(group_tags.c.group_id, group_tags.c.tag_id)
+                                               .where(group_tags.c.group_id.in_(ids))):
+        tags[group_id].append(tag_id)
+    archived = []
+    for row in connection.execute(select(groups).where(groups.c.id.in_(ids))).mappings():
+        data = encode(row, groups.columns)
+        data['tag_ids'] = tags[row['id']]
+        archived.append({'group_id': row['id'], 'name': row['name'], 'invite_code': row['invite_code'],
+                         'status': row['status'], 'reason': due[row['id']], 'archived_at': now,
+                         'data': json.dumps(data)})
+    connection.execute(ArchivedGroup.__table__.insert(), archived)
+
+    for table in (group_tags, GroupStat.__table__, GroupImage.__table__, LinkCheck.__table__):
+        connection.execute(delete(table).where(table.c.group_id.in_(ids)))
+    # Entity ids of other tables: the group's id may be handed to a new group
+    for table in (RankScore.__table__, SlugHistory.__table__):
+        connection.execute(delete(table).where(table.c.entity_type == 'group', table.c.entity_id.in_(ids)))
+    connection.execute(delete(groups).where(groups.c.id.in_(ids)))
+    return due
+
+def archive_groups(batch=None, now=None, rejected_days=None, dead_days=None, progress=None):
+    """Move every due group to the archive, a batch per transaction; (rejected, dead) moved"""
+    from facets import facet_index
+    from invalidation import invalidation_bus, DELETE
+    from sqlite_mode import write_queue
+
+    now, rejected_days, dead_days = settings(now, rejected_days, dead_days)
+    batch = int(os.environ.get('ARCHIVE_BATCH', 500)) if batch is None else batch
+    total = due_count(now, rejected_days, dead_days)
+    moved = {REJECTED: 0, DEAD: 0}
+    after = {REJECTED: 0, DEAD: 0}
+    # Groups coming due while it runs wait for the next run
+    while sum(moved.values()) < total:
+        left = total - sum(moved.values())
+        due = write_queue.run(lambda connection: archive_batch(connection, now, rejected_days, dead_days,
+                                                               min(batch, left), after))
+        if not due:
+            break
+        for group_id, reason in due.items():
+            moved[reason] += 1
+            after[reason] = max(after[reason], group_id)
+        # Core deletes skip the session events the caches listen to
+        facet_index.forget(list(due))
+        invalidation_bus.publish([('group', group_id, DELETE) for group_id in due])
+        if progress is not None:
+            progress(sum(moved.values()), total)
+    if any(moved.values()):
+        logger.info(f"Archived {moved[REJECTED]} rejected and {moved[DEAD]} dead groups")
+    return moved[REJECTED], moved[DEAD]
+
+def is_archived(invite_link):
+    """True if the group behind `invite_link` is in the archive"""
+    from models import ArchivedGroup
+    from utils import extract_whatsapp_invite_code
+
+    code = extract_whatsapp_invite_code(invite_link)
+    return code is not None and db.session.query(
+        ArchivedGroup.query.filter_by(invite_code=code).exists()).scalar()
+
+def restore(archived):
+    """Put an ArchivedGroup back into whatsapp_group (not committed); the group
+
+    Raises ValueError when a group with the same invite link has been
+    added since. A slug taken in the meantime is replaced by a free one.
+    """
+    from models import WhatsAppGroup, Tag
+    from slugs import save_with_slug
+
+    columns = WhatsAppGroup.__table__.columns
+    data = json.loads(archived.data)
+    tag_ids = data.pop('tag_ids', [])
+    values = decode(data, columns)
+    taken = WhatsAppGroup.query.filter(or_(WhatsAppGroup.invite_code == archived.invite_code,
+                                           WhatsAppGroup.invite_link == values.get('invite_link'))).first()
+    if taken is not None:
+        raise ValueError(f'"{archived.name}" was submitted again as group {taken.id}')
+
+    tags = Tag.query.filter(Tag.id.in_(tag_ids)).all() if tag_ids else []
+    group = WhatsAppGroup(archived.name, values['invite_link'], values['category_id'],
+                          values['country_id'], values['language_id'])
+    slug = values.pop('slug')
+    for name, value in values.items():
+        setattr(group, name, value)
+    group.id = archived.group_id
+    group.invite_code = archived.invite_code
+    group.status = archived.status
+    group.slug = slug
+    # Counts as a fresh change: it isn't archived again until it is due anew
+    group.updated_at = datetime.utcnow()
+    save_with_slug(group, group.name)
+    group.tags = tags
+    db.session.delete(archived)
+    return group
@@ -0,0 +1,168 @@
+"""Static asset bundles: minified, fingerprinted and precompressed.
+
+Each bundle in ``BUNDLES`` is one file a page loads, concatenated from
+sources under ``static/``. Public pages load only ``site.css`` (plus
+``tags.js`` on the submission forms); the admin bundles stay in the admin.
+
+``flask build-assets`` minifies each bundle (with rcssmin/rjsmin when
+installed), names it after its content hash (``site.3f2a9c1b.css``), writes
+``.gz`` and, with the ``brotli`` package, ``.br`` copies next to it and
+records the names in ``manifest.json``. It writes to ``build/assets`` by
+default; workers serve from ``ASSETS_PATH`` when it points at a built
+directory. Built files are served from ``/assets/`` with a one-year
+immutable Cache-Control, compressed per Accept-Encoding.
+
+Templates link bundles with ``asset_url('site.css')``, which takes the same
+``_external`` arguments as ``url_for``. Without a build it points at the
+bundle concatenated on the fly from the sources, uncached, so edits show up
+during development.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from flask import Blueprint, Response, abort, current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BUNDLES = {
+    'site.css': ['css/style.css'],
+    'tags.js': ['js/tags.js'],
+    'admin.css': ['css/admin.css'],
+    'admin.js': ['js/admin.js'],
+}
+MANIFEST = 'manifest.json'
+ONE_YEAR = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+
+# Minification
+
+CSS_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+def minify_css(source):
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    # Comments and whitespace only, leaving quoted strings (data URIs) alone
+    parts = CSS_STRING.split(CSS_COMMENT.sub('', source))
+    for i in range(0, len(parts), 2):
+        code = CSS_PUNCTUATION.sub(r'\1', CSS_SPACE.sub(' ', parts[i]))
+        parts[i] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+def minify_js(source):
+    # No safe fallback for JS: unminified bundles still get compressed
+    return rjsmin.jsmin(source) if rjsmin is not None else source
+
+def bundle_source(app, name):
+    """Concatenated sources of bundle `name`"""
+    separator = '\n' if name.endswith('.css') else ';\n'
+    contents = []
+    for filename in BUNDLES[name]:
+        with open(os.path.join(app.static_folder, filename), encoding='utf-8') as fh:
+            contents.append(fh.read())
+    return separator.join(contents)
+
+def build_assets(app, target):
+    """Write every bundle to `target`; returns {name: {'file', 'source' and per-encoding bytes}}"""
+    os.makedirs(target, exist_ok=True)
+    manifest = {}
+    built = {}
+    for name in BUNDLES:
+        source = bundle_source(app, name)
+        data = (minify_css(source) if name.endswith('.css') else minify_js(source)).encode('utf-8')
+        stem, ext = os.path.splitext(name)
+        filename = f'{stem}.{hashlib.sha256(data).hexdigest()[:8]}{ext}'
+        variants = {'identity': data, 'gzip': gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(data, quality=11)
+        suffixes = dict(ENCODINGS, identity='')
+        for encoding, payload in variants.items():
+            with open(os.path.join(target, filename + suffixes[encoding]), 'wb') as fh:
+                fh.write(payload)
+        manifest[name] = filename
+        built[name] = {'file': filename, 'source': len(source.encode('utf-8')),
+                       **{encoding: len(payload) for encoding, payload in variants.items()}}
+    # Written last, so workers never see names whose files are missing
+    with open(os.path.join(target, MANIFEST + '.tmp'), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(os.path.join(target, MANIFEST + '.tmp'), os.path.join(target, MANIFEST))
+    return built
+
+# Serving
+
+class AssetManifest:
+    def __init__(self):
+        self.path = None
+        self.files = {}
+
+    def init_app(self, app):
+        path = app.config.get('ASSETS_PATH') or os.environ.get('ASSETS_PATH')
+        self.path = os.path.join(app.root_path, path) if path else None
+        self.files = {}
+        if self.path and os.path.isfile(os.path.join(self.path, MANIFEST)):
+            with open(os.path.join(self.path, MANIFEST)) as fh:
+                self.files = json.load(fh)
+        app.extensions['assets'] = self
+        app.jinja_env.globals['asset_url'] = asset_url
+
+    def url(self, name, **values):
+        filename = self.files.get(name)
+        if filename is None:
+            if name not in BUNDLES:
+                raise KeyError(f'Unknown asset bundle {name!r}')
+            return url_for('assets.source', name=name, **values)
+        return url_for('assets.built', filename=filename, **values)
+
+def asset_url(name, **values):
+    """URL of bundle `name`: the fingerprinted build when there is one"""
+    return asset_manifest.url(name, **values)
+
+assets = Blueprint('assets', __name__)
+
+@assets.route('/assets/<filename>')
+def built(filename):
+    if filename not in asset_manifest.files.values():
+        abort(404)
+    accepted = request.accept_encodings
+    for encoding, suffix in ENCODINGS:
+        path = os.path.join(asset_manifest.path, filename + suffix)
+        if accepted[encoding] and os.path.isfile(path):
+            response = send_from_directory(asset_manifest.path, filename + suffix, max_age=ONE_YEAR,
+                                           mimetype=MIMETYPES[os.path.splitext(filename)[1]])
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(asset_manifest.path, filename, max_age=ONE_YEAR)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@assets.route('/assets/src/<name>')
+def source(name):
+    if name not in BUNDLES:
+        abort(404)
+    response = Response(bundle_source(current_app, name), mimetype=MIMETYPES[os.path.splitext(name)[1]])
+    response.cache_control.no_cache = True
+    return response
+
+asset_manifest = AssetManifest()
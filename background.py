@@ -0,0 +1,46 @@
+"""Per-process background threads.
+
+Threads don't survive a fork, so each gunicorn worker starts its own the
+first time it needs one. Several request threads can get there at once
+(gthread workers), so the check and the start happen under a lock: exactly
+one thread per process, and ``setup`` (per-process connections, pools,
+ids) runs once before it starts.
+"""
+import os
+import threading
+
+class ProcessThread:
+    def __init__(self, name, target, setup=None):
+        self.name = name
+        self.target = target
+        self.setup = setup
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # A lock held by another thread at fork time would stay held in the child
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._pid == os.getpid()
+
+    def ensure(self):
+        """Start the thread unless this process already has it; True when this call started it"""
+        if self.running:
+            return False
+        with self._lock:
+            if self.running:
+                return False
+            if self.setup is not None:
+                self.setup()
+            thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            thread.start()
+            self._thread = thread
+            self._pid = os.getpid()
+        return True
+
+    def join(self):
+        self._thread.join()
@@ -0,0 +1,97 @@
+"""JSON API benchmark.
+
+Times serialization of loaded group pages with orjson and stdlib json
+(groups/sec), then end-to-end latency of the API routes through the test
+client for full and sparse fieldsets, with and without includes.
+
+    python benchmarks/api_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from common import make_app, latency_summary, append_history, redact_url
+
+def serialization(app, rows, iterations):
+    """groups/sec through each serializer for pages of `rows` groups with every include"""
+    import api
+    from models import WhatsAppGroup
+
+    includes = ('category', 'country', 'language', 'tags')
+    with app.test_request_context():
+        groups = api.approved_groups({}).options(*api.group_options(api.GROUP_FIELDS, includes))\
+            .order_by(WhatsAppGroup.id.desc()).limit(rows).all()
+        payload = {'data': [api.serialize_group(g, api.GROUP_FIELDS, includes) for g in groups]}
+
+    serializers = {'json': lambda p: json.dumps(p, default=api._default, separators=(',', ':')).encode()}
+    if api.orjson is not None:
+        serializers['orjson'] = api.orjson.dumps
+    results = {}
+    for name, dumps in serializers.items():
+        started = time.perf_counter()
+        for _ in range(iterations):
+            body = dumps(payload)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            'groups_per_s': round(len(groups) * iterations / elapsed),
+            'bytes': len(body),
+        }
+    return results
+
+def endpoints(app, iterations):
+    from models import Category
+
+    with app.app_context():
+        category = Category.query.first().slug
+    urls = [
+        '/api/v1/groups?limit=100',
+        '/api/v1/groups?limit=100&fields=name,slug',
+        '/api/v1/groups?limit=100&include=category,country,language,tags',
+        f'/api/v1/groups?limit=100&category={category}&fields=name,slug,member_count',
+        '/api/v1/tags?limit=100',
+    ]
+    client = app.test_client()
+    results = {}
+    for url in urls:
+        client.get(url)
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            client.get(url)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[url] = latency_summary(samples)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    app = make_app(args.database_url)
+
+    ser = serialization(app, args.rows, args.iterations)
+    print(f"{'serializer':<10} {'groups/s':>10} {'bytes':>8}")
+    for name, r in ser.items():
+        print(f"{name:<10} {r['groups_per_s']:>10} {r['bytes']:>8}")
+
+    routes = endpoints(app, max(10, args.iterations // 10))
+    print(f"\n{'url':<80} {'p50':>8} {'p95':>8}")
+    for url, r in routes.items():
+        print(f"{url:<80} {r['p50_ms']:>8} {r['p95_ms']:>8}")
+
+    if not args.no_save:
+        append_history('api', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'serialization': ser,
+            'routes': routes,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
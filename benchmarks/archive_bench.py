@@ -0,0 +1,116 @@
+"""Group archive: how much the status-filtered scans gain from a smaller hot set.
+
+Works on a copy of ``--database-url``. Marks ``--cold-pct`` percent of the
+groups rejected and untouched for a year (a site that never cleaned up),
+then times, before and after the ``archive-groups`` run,
+
+* counting approved groups (the facet index build and the sitemap filter
+  the same way)
+* the admin pending queue, newest first
+* a public search for a term no group contains, which scans every
+  approved row
+
+and reports the archive run's throughput. ``whatsapp_group`` has no
+status index, so every one of these reads the whole table.
+
+    python benchmarks/archive_bench.py --database-url sqlite:////tmp/bench.db --cold-pct 40
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import make_app, append_history, copy_sqlite, redact_url
+
+QUERIES = {
+    'approved_count': "SELECT count(*) FROM whatsapp_group WHERE status = 'approved'",
+    'pending_page': "SELECT id FROM whatsapp_group WHERE status = 'pending' ORDER BY created_at DESC LIMIT 20",
+    'missing_search': "SELECT id FROM whatsapp_group WHERE status = 'approved' "
+                      "AND (name LIKE '%zq-none-zq%' OR description LIKE '%zq-none-zq%') LIMIT 12",
+}
+
+def query_times(repeat):
+    """{query: best of `repeat` milliseconds}"""
+    from app import db
+
+    times = {}
+    for name, sql in QUERIES.items():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            db.session.execute(db.text(sql)).all()
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = round(best, 2)
+    db.session.remove()
+    return times
+
+def make_cold(cold_pct):
+    """Reject and backdate every nth group; the number of rejected groups"""
+    from app import db
+    from models import WhatsAppGroup
+
+    groups = WhatsAppGroup.__table__
+    step = max(1, round(100 / cold_pct)) if cold_pct else 0
+    with db.engine.begin() as conn:
+        if step:
+            conn.execute(groups.update().where(groups.c.id % step == 0).values(status='rejected'))
+        conn.execute(groups.update().where(groups.c.status == 'rejected')
+                     .values(updated_at=datetime.utcnow() - timedelta(days=365)))
+        return conn.execute(db.select(db.func.count()).select_from(groups)
+                            .where(groups.c.status == 'rejected')).scalar()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='sqlite:////path/to/source.db (copied, not modified)')
+    parser.add_argument('--cold-pct', type=float, default=40, help='Share of groups to make rejected and old.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.setdefault('INVALIDATION_URL', 'off')
+    os.environ.setdefault('JOBS_ENABLED', '0')
+    tmp = tempfile.mkdtemp()
+    try:
+        database = os.path.join(tmp, 'archive.db')
+        copy_sqlite(args.database_url.split(':///', 1)[1], database)
+        app = make_app(f'sqlite:///{database}')
+        with app.app_context():
+            from app import db
+            import archive
+
+            db.create_all()
+            rejected = make_cold(args.cold_pct)
+            total = db.session.execute(db.text('SELECT count(*) FROM whatsapp_group')).scalar()
+            before = query_times(args.repeat)
+            started = time.perf_counter()
+            moved = sum(archive.archive_groups())
+            archive_s = time.perf_counter() - started
+            db.session.execute(db.text('ANALYZE'))
+            after = query_times(args.repeat)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    stats = {
+        'groups': total,
+        'rejected': rejected,
+        'archived': moved,
+        'archive_s': round(archive_s, 2),
+        'archive_per_s': round(moved / archive_s) if archive_s else 0,
+        'before_ms': before,
+        'after_ms': after,
+    }
+    print(f"{total} groups, {rejected} rejected and a year old; archived {moved} in {stats['archive_s']}s "
+          f"({stats['archive_per_s']} groups/s)")
+    for name in QUERIES:
+        print(f"{name}: {before[name]} ms -> {after[name]} ms")
+
+    if not args.no_save:
+        append_history('archive', {'database': redact_url(args.database_url), 'cold_pct': args.cold_pct, **stats})
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
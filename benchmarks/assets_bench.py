@@ -0,0 +1,83 @@
+"""Bytes transferred per first page view, before and after the asset build.
+
+For each page, sums the HTML and the same-origin CSS/JS it links, fetched
+with an empty cache. "before" is the unbuilt sources served as-is, as they
+were before bundles existed; "after" is the bundles from ``flask
+build-assets`` fetched with ``Accept-Encoding: br, gzip``. CDN assets are
+the same in both and not counted.
+
+    python benchmarks/assets_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+from common import make_app, append_history, redact_url
+
+LINKED = re.compile(r'<(?:link|script)\b[^>]*?(?:href|src)="(/[^"/][^"]*)"')
+
+def page_urls(app):
+    from models import WhatsAppGroup
+
+    with app.app_context():
+        group = WhatsAppGroup.query.filter_by(status='approved').first()
+        return ['/', '/submit-group', f'/group/{group.category_ref.slug}/{group.slug}']
+
+def first_view(client, url, headers):
+    """(HTML bytes, {asset url: bytes transferred}) for one cold page view"""
+    page = client.get(url, headers=headers)
+    assets = {}
+    for asset in LINKED.findall(page.get_data(as_text=True)):
+        assets[asset] = len(client.get(asset, headers=headers).data)
+    return len(page.data), assets
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    app = make_app(args.database_url)
+    from assets import asset_manifest, build_assets
+
+    # Unbuilt, bundle URLs serve the concatenated sources: the old bytes
+    client = app.test_client()
+    urls = page_urls(app)
+    before = {url: first_view(client, url, {}) for url in urls}
+
+    target = tempfile.mkdtemp(prefix='assets-')
+    built = build_assets(app, target)
+    app.config['ASSETS_PATH'] = target
+    asset_manifest.init_app(app)
+    after = {url: first_view(client, url, {'Accept-Encoding': 'br, gzip'}) for url in urls}
+
+    print(f"{'bundle':<12} {'source':>8} {'minified':>9} {'gzip':>7} {'br':>7}")
+    for name, sizes in built.items():
+        print(f"{name:<12} {sizes['source']:>8} {sizes['identity']:>9} {sizes['gzip']:>7} {sizes.get('br', '-'):>7}")
+
+    results = {}
+    print(f"\n{'page':<50} {'assets before':>14} {'after':>8} {'html':>8}")
+    for url in urls:
+        html, assets_before = before[url]
+        _, assets_after = after[url]
+        results[url] = {
+            'html_bytes': html,
+            'asset_bytes_before': sum(assets_before.values()),
+            'asset_bytes_after': sum(assets_after.values()),
+        }
+        r = results[url]
+        print(f"{url:<50} {r['asset_bytes_before']:>14} {r['asset_bytes_after']:>8} {html:>8}")
+
+    if not args.no_save:
+        append_history('assets', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'bundles': built,
+            'pages': results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Helpers shared by the benchmark scripts"""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+HISTORY_PATH = os.path.join(RESULTS_DIR, 'history.json')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def make_app(database_url, **config):
+    """Build an app bound to `database_url` with CSRF off and optional extra config"""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SESSION_SECRET', 'benchmark')
+    from app import create_app
+    return create_app({'WTF_CSRF_ENABLED': False, **config})
+
+def copy_sqlite(source, target):
+    """Copy a SQLite database, including writes still in its WAL file"""
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def latency_summary(samples_ms):
+    values = sorted(samples_ms)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+    }
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as fh:
+            pages = int(fh.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is KB on Linux, bytes on macOS; close enough as a fallback
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def redact_url(database_url):
+    """Drop credentials from a database URL before it is written to history"""
+    if '@' in database_url:
+        scheme, rest = database_url.split('://', 1)
+        return f"{scheme}://{rest.split('@', 1)[1]}"
+    return database_url
+
+def append_history(kind, payload):
+    """Append a result entry to benchmarks/results/history.json"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    history = load_history()
+    entry = {
+        'kind': kind,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        **payload,
+    }
+    history.append(entry)
+    with open(HISTORY_PATH, 'w') as fh:
+        json.dump(history, fh, indent=2)
+    return entry
+
+def load_history():
+    if not os.path.exists(HISTORY_PATH):
+        return []
+    with open(HISTORY_PATH) as fh:
+        return json.load(fh)
+
+def previous_entry(kind, match):
+    """Most recent history entry of `kind` whose keys equal `match`"""
+    for entry in reversed(load_history()):
+        if entry.get('kind') == kind and all(entry.get(k) == v for k, v in match.items()):
+            return entry
+    return None
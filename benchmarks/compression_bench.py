@@ -0,0 +1,89 @@
+"""Response compression benchmark.
+
+For listing pages, a group page, the sitemap and an API page: bytes saved
+and CPU milliseconds per response for gzip and (when installed) brotli at
+the levels compression.py uses, plus the end-to-end latency added when the
+client sends Accept-Encoding.
+
+    python benchmarks/compression_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import os
+import sys
+import time
+
+from common import make_app, latency_summary, append_history, redact_url
+
+def page_urls(app):
+    from models import Category, WhatsAppGroup
+
+    with app.app_context():
+        group = WhatsAppGroup.query.filter_by(status='approved').first()
+        return [
+            '/',
+            f'/category/{Category.query.first().slug}',
+            f'/group/{group.category_ref.slug}/{group.slug}',
+            '/sitemap.xml',
+            '/api/v1/groups?limit=100',
+        ]
+
+def cpu_ms(compress, data, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        body = compress(data)
+    return (time.perf_counter() - started) * 1000 / iterations, len(body)
+
+def request_ms(client, url, headers, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        client.get(url, headers=headers).get_data()
+        samples.append((time.perf_counter() - started) * 1000)
+    return latency_summary(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    app = make_app(args.database_url)
+    import compression
+    from compression import compressor
+
+    encoders = {'gzip': lambda data: compression.gzip_compress(data, compressor.gzip_level)}
+    if compression.brotli is not None:
+        encoders['br'] = lambda data: compression.brotli_compress(data, compressor.br_quality)
+
+    client = app.test_client()
+    urls = page_urls(app)
+    results = {}
+    print(f"{'url':<44} {'bytes':>8} " + ' '.join(f"{e + ' bytes':>10} {e + ' ms':>8}" for e in encoders)
+          + f" {'p50 plain':>10} {'p50 comp':>9}")
+    for url in urls:
+        data = client.get(url).get_data()
+        r = results[url] = {'bytes': len(data)}
+        for encoding, compress in encoders.items():
+            ms, size = cpu_ms(compress, data, args.iterations)
+            r[encoding] = {'bytes': size, 'cpu_ms': round(ms, 3), 'ratio': round(len(data) / size, 2)}
+        # API pages carry an ETag, so after the first request their compressed
+        # body comes from the cache; HTML pages pay for compression every time
+        r['plain'] = request_ms(client, url, {}, args.iterations)
+        r['compressed'] = request_ms(client, url, {'Accept-Encoding': 'br, gzip'}, args.iterations)
+        print(f"{url[:44]:<44} {len(data):>8} "
+              + ' '.join(f"{r[e]['bytes']:>10} {r[e]['cpu_ms']:>8}" for e in encoders)
+              + f" {r['plain']['p50_ms']:>10} {r['compressed']['p50_ms']:>9}")
+
+    if not args.no_save:
+        append_history('compression', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'gzip_level': compressor.gzip_level,
+            'br_quality': compressor.br_quality,
+            'urls': results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
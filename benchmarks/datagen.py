@@ -0,0 +1,169 @@
+"""Synthetic data generator for benchmarks.
+
+Fills a database with categories, countries, languages, tags and groups at a
+configurable scale. Rows are inserted with executemany in batches, so a 1M
+group database takes minutes rather than hours.
+
+    python benchmarks/datagen.py --database-url sqlite:////tmp/bench.db --groups 100000
+    python benchmarks/datagen.py --database-url postgresql://localhost/bench --groups 1000000
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from common import make_app
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+WORDS = ('news jobs music movies cricket football crypto trading study exam '
+         'friends dating funny memes recipes travel fitness gaming anime '
+         'business marketing coding python design photography pets quotes').split()
+
+def sizes_for(groups):
+    """Taxonomy sizes that grow with the number of groups"""
+    return {
+        'categories': 28,
+        'countries': 100,
+        'languages': 72,
+        'tags': max(50, groups // 20),
+        'posts': max(10, groups // 1000),
+        'pages': 10,
+    }
+
+def _batches(rows_iter, size):
+    batch = []
+    for row in rows_iter:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _name(rng, words=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+def generate(groups, seed=42, batch_size=10_000, log=print):
+    """Populate the current app's database; returns the sizes used"""
+    from app import db
+    from models import Category, Country, Language, Tag, WhatsAppGroup, Post, Page, group_tags
+    from cli import ensure_admin_user
+
+    rng = random.Random(seed)
+    sizes = sizes_for(groups)
+    now = datetime.utcnow()
+
+    db.drop_all()
+    db.create_all()
+    ensure_admin_user()
+
+    def taxonomy(model, count, prefix, extra=None):
+        rows = []
+        for i in range(count):
+            name = f'{prefix} {i:04d}'
+            row = {'name': name, 'slug': f'{prefix.lower()}-{i:04d}', 'created_at': now}
+            if extra:
+                row.update(extra(i))
+            rows.append(row)
+        db.session.execute(model.__table__.insert(), rows)
+
+    taxonomy(Category, sizes['categories'], 'Category', lambda i: {'description': _name(rng, 8)})
+    taxonomy(Country, sizes['countries'], 'Country', lambda i: {'code': f'{i % 100:02d}'})
+    taxonomy(Language, sizes['languages'], 'Language', lambda i: {'code': f'l{i:02d}'})
+    taxonomy(Tag, sizes['tags'], 'Tag', lambda i: {'usage_count': 0})
+    db.session.commit()
+    log(f"taxonomy: {sizes['categories']} categories, {sizes['countries']} countries, "
+        f"{sizes['languages']} languages, {sizes['tags']} tags")
+
+    statuses = ['approved'] * 16 + ['pending'] * 3 + ['rejected']
+
+    def group_rows():
+        for i in range(1, groups + 1):
+            name = f'{_name(rng)} {i}'
+            created = now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60))
+            description = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(10, 80)))
+            yield {
+                'id': i,
+                'name': name,
+                'slug': f'{name.lower().replace(" ", "-")}',
+                'description': description,
+                'invite_link': f'https://chat.whatsapp.com/BENCH{i:010d}',
+                'invite_code': f'BENCH{i:010d}',
+                'image_url': None,
+                'member_count': rng.randrange(0, 1025),
+                'category_id': rng.randrange(1, sizes['categories'] + 1),
+                'country_id': rng.randrange(1, sizes['countries'] + 1),
+                'language_id': rng.randrange(1, sizes['languages'] + 1),
+                'status': rng.choice(statuses),
+                'featured': rng.random() < 0.01,
+                'meta_title': f'{name} - WhatsApp Group',
+                'meta_description': description[:157],
+                'created_at': created,
+                'updated_at': created,
+            }
+
+    def tag_rows():
+        # Zipf-ish: low tag ids are used much more often than high ones
+        for group_id in range(1, groups + 1):
+            picked = set()
+            for _ in range(rng.randrange(0, 6)):
+                picked.add(min(sizes['tags'], int(rng.paretovariate(1.2))))
+            for tag_id in picked:
+                yield {'group_id': group_id, 'tag_id': tag_id}
+
+    started = time.perf_counter()
+    inserted = 0
+    for batch in _batches(group_rows(), batch_size):
+        db.session.execute(WhatsAppGroup.__table__.insert(), batch)
+        db.session.commit()
+        inserted += len(batch)
+        log(f'groups: {inserted}/{groups}')
+    for batch in _batches(tag_rows(), batch_size):
+        db.session.execute(group_tags.insert(), batch)
+        db.session.commit()
+    log(f'groups and tags inserted in {time.perf_counter() - started:.1f}s')
+
+    if db.engine.dialect.name == 'postgresql':
+        # Explicit ids above leave the serial sequence behind
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('whatsapp_group', 'id'), "
+            "(SELECT MAX(id) FROM whatsapp_group))"))
+        db.session.commit()
+
+    post_rows = [{
+        'title': f'Post {i}', 'slug': f'post-{i}', 'content': _name(rng, 400),
+        'excerpt': _name(rng, 30), 'is_published': True,
+        'created_at': now - timedelta(days=i), 'updated_at': now - timedelta(days=i),
+    } for i in range(sizes['posts'])]
+    page_rows = [{
+        'title': f'Page {i}', 'slug': f'page-{i}', 'content': _name(rng, 200),
+        'is_published': True, 'created_at': now, 'updated_at': now,
+    } for i in range(sizes['pages'])]
+    db.session.execute(Post.__table__.insert(), post_rows)
+    db.session.execute(Page.__table__.insert(), page_rows)
+    db.session.commit()
+
+    from utils import update_tag_usage_counts
+    if groups <= 100_000:
+        update_tag_usage_counts()
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--groups', default='10k',
+                        help='number of groups, or one of: ' + ', '.join(SCALES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    groups = SCALES.get(str(args.groups).lower()) or int(args.groups)
+    app = make_app(args.database_url)
+    with app.app_context():
+        generate(groups, seed=args.seed, batch_size=args.batch_size)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Facet index benchmark.
+
+Builds the in-memory facet index and times search (intersection, per-facet
+counts and one page of ids) for a spread of filter combinations, with the
+counts cache cold and warm.
+
+    python benchmarks/facet_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import sys
+import time
+
+from common import make_app, latency_summary, append_history, redact_url, rss_mb
+
+def filter_sets(app):
+    from models import Category, Country, Language, Tag
+
+    with app.app_context():
+        category = Category.query.first().id
+        country = Country.query.first().id
+        language = Language.query.first().id
+        tag = Tag.query.order_by(Tag.usage_count.desc()).first().id
+    return {
+        'none': {},
+        'category': {'category': category},
+        'category+country': {'category': category, 'country': country},
+        'category+language+tag': {'category': category, 'language': language, 'tag': tag},
+        'all four': {'category': category, 'country': country, 'language': language, 'tag': tag},
+    }
+
+def timed_search(index, filters, iterations, cold):
+    samples = []
+    for i in range(iterations):
+        if cold:
+            index.state.counts_cache.clear()
+        started = time.perf_counter()
+        result = index.search(filters)
+        result.page_ids(20 * (i % 50), 20)
+        samples.append((time.perf_counter() - started) * 1000)
+    return latency_summary(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from facets import facet_index
+
+    rss_before = rss_mb()
+    with app.app_context():
+        started = time.perf_counter()
+        state = facet_index.build()
+        build_s = round(time.perf_counter() - started, 2)
+    groups = len(state.group_ids)
+    print(f'built index over {groups} groups in {build_s}s, +{rss_mb() - rss_before:.0f} MB RSS')
+
+    # Keep the timed loop from kicking off syncs against the database
+    facet_index.sync_interval = facet_index.rebuild_interval = float('inf')
+    facet_index._sync_due = False
+
+    results = {}
+    print(f"{'filters':<24} {'cold p50':>9} {'cold p95':>9} {'warm p50':>9} {'warm p95':>9}")
+    for label, filters in filter_sets(app).items():
+        cold = timed_search(facet_index, filters, args.iterations, cold=True)
+        warm = timed_search(facet_index, filters, args.iterations, cold=False)
+        results[label] = {'cold': cold, 'warm': warm}
+        print(f"{label:<24} {cold['p50_ms']:>9} {cold['p95_ms']:>9} {warm['p50_ms']:>9} {warm['p95_ms']:>9}")
+
+    if not args.no_save:
+        append_history('facets', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'groups': groups,
+            'build_s': build_s,
+            'search': results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
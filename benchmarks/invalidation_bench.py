@@ -0,0 +1,145 @@
+"""Cross-worker invalidation latency: how long until another process sees an edit.
+
+A second process (its own app, like another gunicorn worker) keeps the
+category slug map warm, as every listing request does. This process renames
+a category ``--changes`` times through the ORM, and the other process polls
+``slug_resolver.resolve`` for the new slug; the time from commit to the
+first successful resolve is the staleness a visitor could see. Run per
+``INVALIDATION_URL``: ``db`` (the polled table on SQLite), ``off`` (the
+refresh interval alone, capped at ``--timeout``) and, with ``--redis-url``,
+Redis pub/sub. Also reports the cost of one poll of the table.
+
+    python benchmarks/invalidation_bench.py --database-url sqlite:////tmp/bench.db
+    python benchmarks/invalidation_bench.py --database-url sqlite:////tmp/bench.db --redis-url redis://localhost:6379/0
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+
+from common import make_app, append_history, copy_sqlite, latency_summary, redact_url
+
+def watch(database_url, invalidation_url, requests, results):
+    os.environ['INVALIDATION_URL'] = invalidation_url
+    app = make_app(database_url)
+    from invalidation import invalidation_bus
+    from slugs import slug_resolver
+
+    with app.app_context():
+        invalidation_bus.start()
+        slug_resolver.resolve('category', 'warm-up')
+        results.put('ready')
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+            slug, timeout = message
+            started = time.monotonic()
+            while time.monotonic() - started < timeout:
+                entity_id, moved = slug_resolver.resolve('category', slug)
+                if entity_id is not None and not moved:
+                    results.put(time.time())
+                    break
+                time.sleep(0.005)
+            else:
+                results.put(None)
+
+def run(database_url, invalidation_url, changes, interval, timeout):
+    context = multiprocessing.get_context('spawn')
+    requests, results = context.Queue(), context.Queue()
+    watcher = context.Process(target=watch, args=(database_url, invalidation_url, requests, results), daemon=True)
+    watcher.start()
+    try:
+        results.get(timeout=60)
+        from app import db
+        from models import Category
+        from slugs import save_with_slug
+
+        category = Category.query.order_by(Category.id).first()
+        samples, missed = [], 0
+        for i in range(changes):
+            category.name = f'Invalidation bench {invalidation_url} {i}'
+            slug = save_with_slug(category, category.name, allocate=True)
+            db.session.commit()
+            committed = time.time()
+            requests.put((slug, timeout))
+            seen = results.get(timeout=timeout + 30)
+            if seen is None:
+                missed += 1
+            else:
+                samples.append((seen - committed) * 1000)
+            time.sleep(interval)
+        requests.put(None)
+        watcher.join(10)
+    finally:
+        if watcher.is_alive():
+            watcher.terminate()
+    return {**latency_summary(samples), 'missed': missed}
+
+def poll_cost(repeat=200):
+    """Milliseconds for one poll of the cache_invalidation table"""
+    from sqlalchemy import func, select
+    from app import db
+    from models import CacheInvalidation
+
+    table = CacheInvalidation.__table__
+    with db.engine.connect() as conn:
+        last_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(select(table.c.id, table.c.origin, table.c.topic, table.c.entity_id, table.c.op)
+                         .where(table.c.id > last_id - 100).order_by(table.c.id)).all()
+        return round((time.perf_counter() - started) * 1000 / repeat, 3)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='sqlite:////path/to/source.db (copied, not modified)')
+    parser.add_argument('--redis-url', default=None)
+    parser.add_argument('--transports', nargs='+', default=['db', 'off'])
+    parser.add_argument('--changes', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.25, help='Seconds between edits.')
+    parser.add_argument('--timeout', type=float, default=5.0, help='Give up on an edit after this many seconds.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    transports = list(args.transports) + ([args.redis_url] if args.redis_url else [])
+    tmp = tempfile.mkdtemp()
+    results = {}
+    try:
+        database = os.path.join(tmp, 'invalidation.db')
+        copy_sqlite(args.database_url.split(':///', 1)[1], database)
+        database_url = f'sqlite:///{database}'
+        for transport in transports:
+            # A fresh app per transport: the bus reads INVALIDATION_URL in init_app
+            os.environ['INVALIDATION_URL'] = transport
+            app = make_app(database_url)
+            with app.app_context():
+                from app import db
+                db.create_all()
+                results[redact_url(transport)] = stats = run(database_url, transport, args.changes,
+                                                             args.interval, args.timeout)
+            print(f"{redact_url(transport)}: p50 {stats['p50_ms']}ms, p95 {stats['p95_ms']}ms, "
+                  f"max {stats['max_ms']}ms, {stats['missed']} of {args.changes} not seen within {args.timeout}s")
+        with app.app_context():
+            results['poll_ms'] = poll_cost()
+            print(f"one table poll: {results['poll_ms']}ms")
+    except queue.Empty:
+        print('the watcher process did not answer', file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if not args.no_save:
+        append_history('invalidation', {
+            'database': redact_url(args.database_url),
+            'changes': args.changes,
+            **results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Job scheduler: exactly-once runs under contention, and what a tick costs.
+
+Starts ``--workers`` processes (own apps, like gunicorn workers or nodes on
+one database), each running the scheduler with a short poll interval and a
+``bench-sleep`` job that sleeps ``--job-ms``. ``--rounds`` times this process
+makes the job due and waits for its run to finish, then reports
+
+* runs per round (1 means exactly one worker queued and ran it)
+* overlapping runs (two workers inside the job at once; must be 0)
+* the delay from due to started, which is bounded by the poll interval
+* the cost of one idle scheduler tick, which every worker pays per poll
+
+    python benchmarks/jobs_bench.py --database-url sqlite:////tmp/bench.db --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import make_app, append_history, copy_sqlite, latency_summary, redact_url
+
+def register_bench_job(job_ms, results):
+    import jobs
+
+    def bench_sleep(progress):
+        """Sleep, recording who ran it and when"""
+        started = time.time()
+        time.sleep(job_ms / 1000)
+        results.put((os.getpid(), started, time.time()))
+    # Yearly: it only comes due when make_due says so
+    jobs.job('bench-sleep', '0 0 1 1 *')(bench_sleep)
+
+def work(database_url, poll_interval, job_ms, results):
+    os.environ['JOB_POLL_INTERVAL'] = str(poll_interval)
+    register_bench_job(job_ms, results)
+    app = make_app(database_url)
+    from jobs import scheduler
+
+    # Only the bench job: a due maintenance job would hold the worker slot
+    scheduler.schedules = {'bench-sleep': scheduler.schedules['bench-sleep']}
+    scheduler.enabled = True
+    scheduler.start()
+    results.put('ready')
+    while True:
+        time.sleep(3600)
+
+def make_due(now):
+    from app import db
+    from models import JobLease
+
+    leases = JobLease.__table__
+    with db.engine.begin() as conn:
+        conn.execute(leases.update().where(leases.c.name == 'bench-sleep').values(next_run_at=now - timedelta(seconds=1)))
+
+def tick_cost(repeat=100):
+    """Milliseconds for one scheduler tick with nothing due"""
+    from jobs import scheduler
+
+    scheduler.schedules = {}  # nothing to queue; still reads leases and queued runs
+    scheduler._leases_created = True
+    started = time.perf_counter()
+    for _ in range(repeat):
+        scheduler.renew(datetime.utcnow())
+        scheduler.queue_due(datetime.utcnow())
+        scheduler.fail_abandoned(datetime.utcnow())
+    return round((time.perf_counter() - started) * 1000 / repeat, 3)
+
+def run(database_url, workers, rounds, poll_interval, job_ms):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=work, args=(database_url, poll_interval, job_ms, results), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            results.get(timeout=60)
+        runs, per_round, delays = [], [], []
+        for _ in range(rounds):
+            due = datetime.utcnow()
+            make_due(due)
+            got = [results.get(timeout=poll_interval * 10 + job_ms / 1000 + 30)]
+            # Any duplicate would start within a poll of the first
+            deadline = time.time() + 2 * poll_interval + job_ms / 1000
+            while time.time() < deadline:
+                try:
+                    got.append(results.get(timeout=max(0.01, deadline - time.time())))
+                except queue.Empty:
+                    break
+            per_round.append(len(got))
+            runs.extend(got)
+            delays.append((got[0][1] - (due - datetime(1970, 1, 1)).total_seconds()) * 1000)
+    finally:
+        for process in processes:
+            process.terminate()
+    runs.sort(key=lambda r: r[1])
+    overlaps = sum(1 for previous, current in zip(runs, runs[1:]) if current[1] < previous[2])
+    return {
+        'runs_per_round': round(sum(per_round) / len(per_round), 2),
+        'max_runs_in_a_round': max(per_round),
+        'overlaps': overlaps,
+        'workers_that_ran': len({pid for pid, _, _ in runs}),
+        'due_to_start': latency_summary(delays),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='sqlite:////path/to/source.db (copied, not modified)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--job-ms', type=float, default=200)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.setdefault('INVALIDATION_URL', 'off')
+    tmp = tempfile.mkdtemp()
+    try:
+        database = os.path.join(tmp, 'jobs.db')
+        copy_sqlite(args.database_url.split(':///', 1)[1], database)
+        database_url = f'sqlite:///{database}'
+        register_bench_job(args.job_ms, None)
+        app = make_app(database_url)
+        with app.app_context():
+            from app import db
+            db.create_all()
+            stats = run(database_url, args.workers, args.rounds, args.poll_interval, args.job_ms)
+            stats['tick_ms'] = tick_cost()
+    except queue.Empty:
+        print('a worker process did not answer', file=sys.stderr)
+        return 1
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    delays = stats['due_to_start']
+    print(f"{args.workers} workers, {args.rounds} rounds: {stats['runs_per_round']} runs per round "
+          f"(max {stats['max_runs_in_a_round']}), {stats['overlaps']} overlapping, "
+          f"run by {stats['workers_that_ran']} different workers")
+    print(f"due -> started: p50 {delays['p50_ms']}ms, max {delays['max_ms']}ms "
+          f"(poll interval {args.poll_interval * 1000:.0f}ms)")
+    print(f"one idle tick: {stats['tick_ms']}ms")
+
+    if not args.no_save:
+        append_history('jobs', {
+            'database': redact_url(args.database_url),
+            'workers': args.workers,
+            'poll_interval': args.poll_interval,
+            **stats,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
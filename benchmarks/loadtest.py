@@ -0,0 +1,163 @@
+"""Throughput per serving configuration.
+
+Starts gunicorn once per configuration, drives it with a pool of HTTP client
+threads for a fixed duration and reports requests/second and error counts.
+
+    python benchmarks/loadtest.py --database-url sqlite:////tmp/bench.db
+    python benchmarks/loadtest.py --configs sync:4:1 gthread:4:8 --duration 20
+
+A configuration is ``worker_class:workers:threads``. Without ``--configs``
+the ``web`` and ``submit`` profiles from serving.py are measured.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import serving  # noqa: E402
+
+DEFAULT_PATHS = ['/', '/categories', '/tags', '/countries', '/languages', '/blog', '/sitemap.xml']
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+def parse_config(spec):
+    worker_class, workers, threads = spec.split(':')
+    return {'worker_class': worker_class, 'workers': int(workers), 'threads': int(threads)}
+
+def profile_configs():
+    configs = []
+    for name in ('web', 'submit'):
+        profile = serving.build_profile(name)
+        configs.append({
+            'name': name,
+            'worker_class': profile['worker_class'],
+            'workers': profile['workers'],
+            'threads': profile.get('threads', 1),
+        })
+    return configs
+
+def start_server(config, port, env):
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'main:app',
+        '--bind', f'127.0.0.1:{port}',
+        '--worker-class', config['worker_class'],
+        '--workers', str(config['workers']),
+        '--threads', str(config['threads']),
+        '--log-level', 'warning',
+    ]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env)
+
+def drive(port, paths, concurrency, duration):
+    """Hit the server from `concurrency` threads; return (completed, errors, elapsed)"""
+    counts = {'ok': 0, 'error': 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(offset):
+        i = offset
+        ok = error = 0
+        while time.perf_counter() < stop_at:
+            url = f'http://127.0.0.1:{port}{paths[i % len(paths)]}'
+            i += 1
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                ok += 1
+            except (urllib.error.URLError, OSError):
+                error += 1
+        with lock:
+            counts['ok'] += ok
+            counts['error'] += error
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['ok'], counts['error'], time.perf_counter() - started
+
+def run_config(config, args, env):
+    port = free_port()
+    server = start_server(config, port, env)
+    try:
+        wait_for_port(port)
+        drive(port, args.paths, args.concurrency, min(2, args.duration))  # warm up
+        ok, errors, elapsed = drive(port, args.paths, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {
+        **config,
+        'requests': ok,
+        'errors': errors,
+        'rps': round(ok / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--configs', nargs='*', help='worker_class:workers:threads')
+    parser.add_argument('--paths', nargs='*', default=DEFAULT_PATHS)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault('SESSION_SECRET', 'loadtest')
+        env['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmp, 'loadtest.db')}"
+        if not args.database_url:
+            subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'],
+                           cwd=ROOT, env=env, check=True, capture_output=True)
+
+        if args.configs:
+            configs = [dict(parse_config(spec), name=spec) for spec in args.configs]
+        else:
+            configs = profile_configs()
+
+        results = []
+        for config in configs:
+            run_env = dict(env)
+            run_env['WEB_WORKERS'] = str(config['workers'])
+            run_env['WEB_THREADS'] = str(config['threads'])
+            pool = serving.pool_options(config['workers'], config['threads'])
+            run_env['DB_POOL_SIZE'] = str(pool['pool_size'])
+            run_env['DB_MAX_OVERFLOW'] = str(pool['max_overflow'])
+            results.append(run_config(config, args, run_env))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'config':<20} {'class':<8} {'workers':>7} {'threads':>7} {'req/s':>9} {'errors':>7}")
+        for r in results:
+            print(f"{r['name']:<20} {r['worker_class']:<8} {r['workers']:>7} {r['threads']:>7} "
+                  f"{r['rps']:>9} {r['errors']:>7}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Metrics overhead: what request timing adds to a request.
+
+Two measurements on the same app and database:
+
+* ``hooks``: the before/after request hooks alone, in a request context,
+  in microseconds per request
+* ``requests``: a mix of public routes through the test client with the
+  hooks installed and removed, alternating in ``--rounds`` rounds so drift
+  hits both sides; the overhead is the difference of the medians
+
+and the cost of rendering ``/metrics`` once those requests are recorded.
+The budget is 1% of request time.
+
+    python benchmarks/metrics_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from common import make_app, append_history, redact_url
+
+BUDGET_PCT = 1.0
+
+def sample_paths(app):
+    from models import WhatsAppGroup, Category
+
+    with app.app_context():
+        group = WhatsAppGroup.query.filter_by(status='approved').order_by(WhatsAppGroup.id).first()
+        category = Category.query.order_by(Category.id).first()
+        return ['/', '/?page=2', f'/group/{group.slug}', f'/category/{category.slug}', '/categories',
+                '/api/v1/groups?limit=20', '/healthz']
+
+def hook_cost(app, metrics, repeat=20000):
+    """Microseconds for one before/after pair"""
+    from flask import Response
+
+    response = Response('ok')
+    with app.test_request_context('/categories'):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            metrics.start_request()
+            metrics.finish_request(response)
+        return (time.perf_counter() - started) * 1e6 / repeat
+
+def set_hooks(app, metrics, installed):
+    before, after = app.before_request_funcs[None], app.after_request_funcs[None]
+    for hooks, hook in ((before, metrics.start_request), (after, metrics.finish_request)):
+        if installed and hook not in hooks:
+            hooks.insert(0, hook)
+        elif not installed and hook in hooks:
+            hooks.remove(hook)
+
+def request_times(client, paths, passes):
+    """(median, mean) milliseconds per request over `passes` of `paths`"""
+    samples = []
+    for _ in range(passes):
+        for path in paths:
+            started = time.perf_counter()
+            client.get(path)
+            samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), sum(samples) / len(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--passes', type=int, default=20, help='Passes over the routes per round and side.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from metrics import metrics
+
+    paths = sample_paths(app)
+    client = app.test_client()
+    request_times(client, paths, 3)  # warm caches on both sides
+    hooks_us = hook_cost(app, metrics)
+
+    on, off = [], []
+    for _ in range(args.rounds):
+        for installed, results in ((True, on), (False, off)):
+            set_hooks(app, metrics, installed)
+            results.append(request_times(client, paths, args.passes))
+    set_hooks(app, metrics, True)
+    median_on = statistics.median(median for median, _ in on)
+    median_off = statistics.median(median for median, _ in off)
+    mean_request_ms = statistics.mean(mean for _, mean in off)
+
+    with app.app_context():
+        started = time.perf_counter()
+        for _ in range(20):
+            size = len(metrics.exposition())
+        scrape_ms = (time.perf_counter() - started) * 1000 / 20
+
+    stats = {
+        'hooks_us': round(hooks_us, 2),
+        'hooks_pct': round(100 * hooks_us / 1000 / mean_request_ms, 3),
+        'request_ms_on': round(median_on, 3),
+        'request_ms_off': round(median_off, 3),
+        'request_overhead_pct': round(100 * (median_on - median_off) / median_off, 2),
+        'scrape_ms': round(scrape_ms, 2),
+        'scrape_bytes': size,
+    }
+    print(f"hooks: {stats['hooks_us']} us per request = {stats['hooks_pct']}% of a {mean_request_ms:.2f} ms "
+          f"mean request (budget {BUDGET_PCT}%)")
+    print(f"requests: median {stats['request_ms_on']} ms with metrics, {stats['request_ms_off']} ms without "
+          f"({stats['request_overhead_pct']:+}%, includes run-to-run noise)")
+    print(f"/metrics: {stats['scrape_ms']} ms, {stats['scrape_bytes']} bytes")
+
+    if not args.no_save:
+        append_history('metrics', {'database': redact_url(args.database_url), 'routes': len(paths), **stats})
+    return 0 if stats['hooks_pct'] < BUDGET_PCT else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Pre-render build time: full builds per worker count, then incremental ones.
+
+Runs ``prerenderer.build`` on a copy of the database into a temporary
+directory: a full build for each ``--workers`` count (pages/s should grow
+with cores), a no-op run (nothing changed), and an incremental run after
+editing ``--edits`` approved groups, which re-renders only their pages and
+the listings they appear on.
+
+    python benchmarks/prerender_bench.py --database-url sqlite:////tmp/bench.db
+    python benchmarks/prerender_bench.py --database-url sqlite:////tmp/bench.db --workers 1 2 4 8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+
+from common import make_app, append_history, copy_sqlite, redact_url
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='sqlite:////path/to/source.db (copied, not modified)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--edits', type=int, default=20)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        database = os.path.join(tmp, 'prerender.db')
+        copy_sqlite(args.database_url.split(':///', 1)[1], database)
+        app = make_app(f'sqlite:///{database}')
+        from app import db
+        from models import WhatsAppGroup
+        from prerender import prerenderer
+
+        prerenderer.init_app(app)
+        results = {'full': {}}
+        with app.app_context():
+            for workers in sorted(set(args.workers)):
+                target = os.path.join(tmp, f'site-{workers}')
+                stats = prerenderer.build(full=True, target=target, base_url='https://example.com', workers=workers)
+                stats['pages_per_s'] = round(stats['rendered'] / stats['seconds'], 1)
+                results['full'][workers] = stats
+                print(f"full, {workers} workers: {stats['rendered']} pages in {stats['seconds']}s "
+                      f"({stats['pages_per_s']} pages/s)")
+
+            results['noop'] = prerenderer.build(target=target, base_url='https://example.com', workers=workers)
+            print(f"nothing changed: {results['noop']['seconds']}s")
+
+            groups = WhatsAppGroup.query.filter_by(status='approved').order_by(WhatsAppGroup.id).limit(args.edits).all()
+            for group in groups:
+                group.member_count = (group.member_count or 0) + 1
+                group.updated_at = datetime.utcnow()
+            db.session.commit()
+            results['incremental'] = prerenderer.build(target=target, base_url='https://example.com', workers=workers)
+            print(f"{len(groups)} groups edited: {results['incremental']['rendered']} pages re-rendered "
+                  f"in {results['incremental']['seconds']}s (scan {results['incremental']['scan_seconds']}s)")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if not args.no_save:
+        append_history('prerender', {
+            'database': redact_url(args.database_url),
+            'edits': args.edits,
+            **results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Query budgets: what counting statements costs, and how fast a bad search stops.
+
+Two measurements on the same app and database:
+
+* ``hooks``: one cheap statement (``SELECT 1``) in a budgeted request
+  context, with the engine listeners installed (counting, timing and
+  arming the statement timeout) and removed, alternating in ``--rounds``
+  rounds; the overhead is the difference, in microseconds per statement
+* ``search``: ``/search`` for a term no group contains, so the LIKE scans
+  every approved group; without the listeners it takes the full scan, with
+  them it is cut off at ``--timeout-ms`` and answers (503, or capped
+  results when the fallback finds matches) shortly after
+
+The hook budget is 10 µs per statement, a fraction of the cheapest round trip
+to the database.
+
+    python benchmarks/query_budget_bench.py --database-url sqlite:////tmp/bench.db --timeout-ms 100
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from common import make_app, append_history, redact_url
+
+BUDGET_US = 10.0
+MISSING_TERM = 'zq-no-such-group-zq'
+
+def statement_cost(app, repeat=20000):
+    """Microseconds for one SELECT 1 in a request context"""
+    from app import db
+    from query_budget import query_budgets
+
+    with app.test_request_context('/categories'):
+        app.preprocess_request()
+        query_budgets.current.statements = float('inf')
+        connection = db.session.connection()
+        statement = db.text('SELECT 1')
+        started = time.perf_counter()
+        for _ in range(repeat):
+            connection.execute(statement).scalar()
+        return (time.perf_counter() - started) * 1e6 / repeat
+
+def search_time(app, passes):
+    """(median milliseconds, status) of a search that matches nothing"""
+    client = app.test_client()
+    samples, status = [], None
+    for _ in range(passes):
+        started = time.perf_counter()
+        status = client.get(f'/search?q={MISSING_TERM}').status_code
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), status
+
+def set_hooks(installed):
+    """Install or remove the engine listeners; without them nothing is counted or interrupted"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from query_budget import query_budgets
+
+    for name, listener in (('before_cursor_execute', query_budgets._before_execute),
+                           ('after_cursor_execute', query_budgets._after_execute),
+                           ('handle_error', query_budgets._handle_error)):
+        if installed and not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+        elif not installed and event.contains(Engine, name, listener):
+            event.remove(Engine, name, listener)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--timeout-ms', type=int, default=100, help='Query budget of /search for the run.')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--passes', type=int, default=5, help='Searches per side.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    os.environ.setdefault('INVALIDATION_URL', 'off')
+    os.environ.setdefault('JOBS_ENABLED', '0')
+    os.environ['QUERY_BUDGET_MODE'] = 'enforce'
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    os.environ['SEARCH_TIMEOUT_MS'] = str(args.timeout_ms)
+    app = make_app(args.database_url)
+
+    on, off = [], []
+    for _ in range(args.rounds):
+        for installed, results in ((True, on), (False, off)):
+            set_hooks(installed)
+            results.append(statement_cost(app))
+    set_hooks(False)
+    unbounded_ms, unbounded_status = search_time(app, args.passes)
+    set_hooks(True)
+    bounded_ms, bounded_status = search_time(app, args.passes)
+
+    stats = {
+        'statement_us_on': round(statistics.median(on), 2),
+        'statement_us_off': round(statistics.median(off), 2),
+        'hooks_us': round(statistics.median(on) - statistics.median(off), 2),
+        'timeout_ms': args.timeout_ms,
+        'search_ms_unbounded': round(unbounded_ms, 1),
+        'search_ms_bounded': round(bounded_ms, 1),
+        'search_status_bounded': bounded_status,
+    }
+    print(f"hooks: {stats['hooks_us']} us per statement ({stats['statement_us_on']} us with budgets, "
+          f"{stats['statement_us_off']} us without; budget {BUDGET_US} us)")
+    print(f"search for a missing term: {stats['search_ms_unbounded']} ms unbounded ({unbounded_status}), "
+          f"{stats['search_ms_bounded']} ms with a {args.timeout_ms} ms timeout ({bounded_status})")
+
+    if not args.no_save:
+        append_history('query_budget', {'database': redact_url(args.database_url), **stats})
+    return 0 if stats['hooks_us'] < BUDGET_US else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Rate limiter overhead benchmark.
+
+Times one token bucket check and one sliding-window check per request
+context, across many distinct clients, against the configured store
+(``RATELIMIT_STORAGE_URL``, in-process memory when unset). The budget is
+0.2 ms per request.
+
+    python benchmarks/ratelimit_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import sys
+import time
+
+from common import make_app, latency_summary, append_history, redact_url
+
+BUDGET_MS = 0.2
+
+def timed(app, check, clients, iterations):
+    samples = []
+    for i in range(iterations):
+        with app.test_request_context('/search?q=bench',
+                                      environ_base={'REMOTE_ADDR': f'10.0.{i % clients // 256}.{i % 256}'}):
+            started = time.perf_counter()
+            check()
+            samples.append((time.perf_counter() - started) * 1000)
+    return latency_summary(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--clients', type=int, default=10_000)
+    parser.add_argument('--iterations', type=int, default=50_000)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from ratelimit import rate_limiter
+
+    # Limits high enough that every check passes and the view would run
+    checks = {
+        'token bucket': lambda: rate_limiter.check('bench', 1e9, 1e9),
+        'sliding window': lambda: rate_limiter.check_window('bench-window', 10 ** 9, 3600),
+    }
+    store = type(rate_limiter.store).__name__
+    results = {}
+    print(f"{store:<16} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, check in checks.items():
+        results[label] = timed(app, check, args.clients, args.iterations)
+        r = results[label]
+        flag = '' if r['p99_ms'] <= BUDGET_MS else f'  over {BUDGET_MS} ms budget'
+        print(f"{label:<16} {r['p50_ms']:>8} {r['p99_ms']:>8}{flag}")
+
+    if not args.no_save:
+        append_history('ratelimit', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'store': store,
+            'checks': results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
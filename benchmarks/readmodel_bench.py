@@ -0,0 +1,117 @@
+"""Listing loads: full ORM entities versus read models.
+
+Loads ``--pages`` listing pages of approved groups (newest first, like the
+home page) two ways and reports time per page, rows/s and the peak memory
+allocated per page (tracemalloc):
+
+* ``orm``: ``WhatsAppGroup`` entities with every column, touching what a
+  card shows (taxonomy refs, tags, image), as listings did before
+* ``readmodel``: ``readmodels.load_group_cards``
+
+and the same for blog pages (``Post`` entities versus ``PostSummary``).
+Each page starts from an empty session, like a request; for entities it
+holds the taxonomy the navigation loads first.
+
+    python benchmarks/readmodel_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from common import make_app, append_history, latency_summary, redact_url
+
+def load_orm_groups(query):
+    groups = query.all()
+    for group in groups:
+        # What the card macros read
+        group.category_ref, group.country_ref, group.language_ref, group.image
+        [tag.slug for tag in group.tags]
+    return groups
+
+def load_orm_posts(query):
+    return query.all()
+
+def preload_taxonomy():
+    # Requests load these for the navigation first, so the cards' many-to-one
+    # lookups hit the identity map
+    from models import Category, Country, Language
+
+    for model in (Category, Country, Language):
+        model.query.all()
+
+def measure(db, make_query, load, pages, per_page, prepare=None):
+    """Timings from one pass, peak allocations from a second (tracemalloc slows everything down)"""
+    samples, peaks, rows = [], [], 0
+    available = max(1, -(-make_query().count() // per_page))
+    for traced in (False, True):
+        for page in range(pages):
+            db.session.remove()
+            if prepare is not None:
+                prepare()
+            query = make_query().limit(per_page).offset(page % available * per_page)
+            if traced:
+                tracemalloc.start()
+                items = load(query)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            else:
+                started = time.perf_counter()
+                items = load(query)
+                samples.append((time.perf_counter() - started) * 1000)
+                rows += len(items)
+            del items
+    peaks.sort()
+    summary = latency_summary(samples)
+    return {
+        'page_ms': summary['p50_ms'],
+        'page_p95_ms': summary['p95_ms'],
+        'rows_per_s': round(rows / (sum(samples) / 1000), 1) if samples else 0.0,
+        'peak_kb_per_page': round(peaks[len(peaks) // 2] / 1024, 1) if peaks else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    from sqlalchemy.orm import undefer, undefer_group
+    from app import db
+    from models import WhatsAppGroup, Post
+    import readmodels
+
+    def groups():
+        return WhatsAppGroup.query.filter_by(status='approved')\
+            .order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())
+
+    def posts():
+        return Post.query.filter_by(is_published=True).order_by(Post.created_at.desc())
+
+    results = {}
+    with app.app_context():
+        for name, make_query, load, prepare in (
+                ('groups_orm', lambda: groups().options(undefer_group('text')), load_orm_groups, preload_taxonomy),
+                ('groups_readmodel', groups, readmodels.load_group_cards, None),
+                ('posts_orm', lambda: posts().options(undefer(Post.content)), load_orm_posts, None),
+                ('posts_readmodel', posts, readmodels.load_post_summaries, None)):
+            per_page = args.per_page if name.startswith('groups') else 6
+            measure(db, make_query, load, 2, per_page, prepare)  # warm up
+            results[name] = stats = measure(db, make_query, load, args.pages, per_page, prepare)
+            print(f"{name:18} {stats['page_ms']:8.2f} ms/page (p95 {stats['page_p95_ms']:.2f})  "
+                  f"{stats['rows_per_s']:10.1f} rows/s  {stats['peak_kb_per_page']:8.1f} KB peak/page")
+
+    if not args.no_save:
+        append_history('readmodel', {
+            'database': redact_url(args.database_url),
+            'pages': args.pages,
+            'per_page': args.per_page,
+            **results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Listing page render benchmark.
+
+Compares, for each listing page:
+
+* steady-state latency with the group card fragment cache off and warm
+* first-hit latency of a fresh app rendering from template sources versus
+  modules precompiled by ``flask compile-templates``
+
+    python benchmarks/render_bench.py --database-url sqlite:////tmp/bench.db
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from common import make_app, latency_summary, append_history, redact_url
+
+def listing_urls(app):
+    from models import Category, Country, Language, Tag, WhatsAppGroup
+
+    with app.app_context():
+        group = WhatsAppGroup.query.filter_by(status='approved').first()
+        tag = Tag.query.order_by(Tag.usage_count.desc()).first()
+        word = group.name.split()[0] if group else 'group'
+        return [
+            '/',
+            f'/category/{Category.query.first().slug}',
+            f'/country/{Country.query.first().slug}',
+            f'/language/{Language.query.first().slug}',
+            f'/tags/{tag.slug}',
+            f'/search?q={word}',
+        ]
+
+def timed(client, url, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        client.get(url)
+        samples.append((time.perf_counter() - started) * 1000)
+    return latency_summary(samples)
+
+def bench_fragment_cache(app, urls, iterations):
+    from templating import card_cache
+
+    client = app.test_client()
+    results = {}
+    size = card_cache.max_entries
+    for url in urls:
+        card_cache.max_entries = 0
+        card_cache.clear()
+        client.get(url)
+        cold = timed(client, url, iterations)
+        card_cache.max_entries = size
+        client.get(url)
+        warm = timed(client, url, iterations)
+        results[url] = {'uncached': cold, 'cached': warm}
+    card_cache.max_entries = size
+    return results
+
+def bench_first_hit(database_url, urls):
+    """First request latency per URL in a fresh app, sources vs compiled modules"""
+    from templating import compile_templates
+
+    results = {}
+    with tempfile.TemporaryDirectory() as modules:
+        app = make_app(database_url)
+        compile_templates(app, modules)
+        for url in urls:
+            source_app = make_app(database_url)
+            compiled_app = make_app(database_url, TEMPLATE_MODULES_PATH=modules)
+            row = {}
+            for label, target in (('source', source_app), ('compiled', compiled_app)):
+                client = target.test_client()
+                started = time.perf_counter()
+                client.get(url)
+                row[f'{label}_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            results[url] = row
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    urls = listing_urls(app)
+
+    cache = bench_fragment_cache(app, urls, args.iterations)
+    print(f"{'url':<40} {'uncached p50':>13} {'cached p50':>11} {'change':>8}")
+    for url, r in cache.items():
+        before, after = r['uncached']['p50_ms'], r['cached']['p50_ms']
+        change = f'{(after - before) / before * 100:+.0f}%' if before else ''
+        print(f'{url[:40]:<40} {before:>13} {after:>11} {change:>8}')
+
+    first = bench_first_hit(args.database_url, urls)
+    print(f"\n{'first hit':<40} {'source ms':>13} {'compiled ms':>11}")
+    for url, r in first.items():
+        print(f"{url[:40]:<40} {r['source_ms']:>13} {r['compiled_ms']:>11}")
+
+    if not args.no_save:
+        append_history('render', {
+            'database': redact_url(args.database_url).split('://')[0],
+            'fragment_cache': cache,
+            'first_hit': first,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Per-route latency benchmark.
+
+Drives every GET route of the public and admin blueprints, either in-process
+through the Flask test client or over HTTP against a running server, and
+records p50/p95/p99 latency, SQL statements per request and RSS. Each run is
+appended to benchmarks/results/history.json; ``--compare`` prints the change
+against the previous run with the same database and scale.
+
+    python benchmarks/datagen.py --database-url sqlite:////tmp/bench.db --groups 10k
+    python benchmarks/route_bench.py --database-url sqlite:////tmp/bench.db --compare
+    python benchmarks/route_bench.py --database-url sqlite:////tmp/bench.db \\
+        --http http://127.0.0.1:8000 --concurrency 16
+"""
+import argparse
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from common import (make_app, latency_summary, rss_mb, append_history, previous_entry,
+                    redact_url)
+
+# GET endpoints that change data or end the session; never benchmarked
+SKIP_ENDPOINTS = {'admin.logout', 'admin.init_data', 'admin.update_tag_counts', 'static'}
+
+class QueryCounter:
+    """Counts statements executed on an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+def sample_values(app):
+    """Real slugs/ids to substitute into URL rules"""
+    from models import (WhatsAppGroup, Category, Country, Language, Tag, Page, Post,
+                        Notification, User)
+
+    with app.app_context():
+        group = WhatsAppGroup.query.filter_by(status='approved').order_by(WhatsAppGroup.id).first()
+        first = lambda model: model.query.order_by(model.id).first()
+        category, country, language = first(Category), first(Country), first(Language)
+        tag, page, post, notification = first(Tag), first(Page), first(Post), first(Notification)
+        admin = User.query.filter_by(is_admin=True).first()
+        return {
+            'group_slug': group.slug if group else None,
+            'category_slug': group.category_ref.slug if group else (category.slug if category else None),
+            'invite_code': group.invite_code if group else None,
+            'group_id': group.id if group else None,
+            'country_slug': country.slug if country else None,
+            'language_slug': language.slug if language else None,
+            'tag_slug': tag.slug if tag else None,
+            'tag_id': tag.id if tag else None,
+            'page_slug': page.slug if page else None,
+            'page_id': page.id if page else None,
+            'post_slug': post.slug if post else None,
+            'post_id': post.id if post else None,
+            'category_id': category.id if category else None,
+            'notification_id': notification.id if notification else None,
+            'admin_id': admin.id if admin else None,
+        }
+
+def build_targets(app, values, include_admin=True):
+    """(endpoint, url) pairs for every benchmarkable GET rule"""
+    targets = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if rule.endpoint in SKIP_ENDPOINTS or 'GET' not in rule.methods:
+            continue
+        if rule.endpoint.startswith('admin.') and not include_admin:
+            continue
+        args = {}
+        for name in rule.arguments:
+            if values.get(name) is None:
+                break
+            args[name] = values[name]
+        else:
+            url = rule.rule
+            for name, value in args.items():
+                url = url.replace(f'<{name}>', str(value)).replace(f'<int:{name}>', str(value))
+            targets.append((rule.endpoint, url))
+    return targets
+
+def bench_in_process(app, targets, iterations, admin_id):
+    from app import db
+
+    results = {}
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    client = app.test_client()
+    if admin_id:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+            session['_fresh'] = True
+
+    for endpoint, url in targets:
+        client.get(url).close()  # warm caches / template compilation
+        samples = []
+        queries = []
+        status = None
+        for _ in range(iterations):
+            before = counter.count
+            started = time.perf_counter()
+            response = client.get(url)
+            # Streamed responses (the sitemap) are timed to their last byte
+            body = response.get_data()
+            response.close()
+            samples.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count - before)
+            status = response.status_code
+        results[url] = {
+            'endpoint': endpoint,
+            'status': status,
+            'queries_per_request': round(sum(queries) / len(queries), 1),
+            'bytes': len(body),
+            **latency_summary(samples),
+        }
+    return results
+
+def bench_http(base_url, targets, iterations, concurrency):
+    results = {}
+    for endpoint, url in targets:
+        samples = []
+        errors = [0]
+        lock = threading.Lock()
+        per_thread = max(1, iterations // concurrency)
+
+        def worker():
+            local = []
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(base_url.rstrip('/') + url, timeout=60) as response:
+                        response.read()
+                except (urllib.error.URLError, OSError):
+                    with lock:
+                        errors[0] += 1
+                    continue
+                local.append((time.perf_counter() - started) * 1000)
+            with lock:
+                samples.extend(local)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        results[url] = {
+            'endpoint': endpoint,
+            'errors': errors[0],
+            'rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            **latency_summary(samples),
+        }
+    return results
+
+def print_results(results, previous=None):
+    print(f"{'url':<45} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'Δp95':>8}")
+    for url, r in results.items():
+        delta = ''
+        if previous and url in previous.get('routes', {}):
+            old = previous['routes'][url]['p95_ms']
+            if old:
+                delta = f"{(r['p95_ms'] - old) / old * 100:+.0f}%"
+        queries = r.get('queries_per_request', '')
+        print(f"{url[:45]:<45} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {queries:>8} {delta:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--http', help='benchmark a running server at this base URL')
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP client threads')
+    parser.add_argument('--scale', help='label stored with the results, e.g. 100k')
+    parser.add_argument('--no-admin', action='store_true', help='skip admin routes')
+    parser.add_argument('--compare', action='store_true', help='compare with the previous run')
+    parser.add_argument('--no-save', action='store_true', help='do not append to history')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    values = sample_values(app)
+    with app.app_context():
+        from models import WhatsAppGroup
+        scale = args.scale or str(WhatsAppGroup.query.count())
+
+    rss_before = rss_mb()
+    if args.http:
+        # Admin pages need a logged-in session, which plain HTTP clients don't have
+        targets = build_targets(app, values, include_admin=False)
+        results = bench_http(args.http, targets, args.iterations, args.concurrency)
+        mode = 'http'
+    else:
+        targets = build_targets(app, values, include_admin=not args.no_admin)
+        results = bench_in_process(app, targets, args.iterations, values['admin_id'])
+        mode = 'test_client'
+
+    match = {'mode': mode, 'database': redact_url(args.database_url).split('://')[0], 'scale': scale}
+    previous = previous_entry('routes', match) if args.compare else None
+    print_results(results, previous)
+    print(f'RSS: {rss_before} MB -> {rss_mb()} MB')
+
+    if not args.no_save:
+        append_history('routes', {**match, 'rss_mb': rss_mb(), 'routes': results})
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
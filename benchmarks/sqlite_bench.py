@@ -0,0 +1,151 @@
+"""Mixed read/write throughput on SQLite, with and without SQLite mode.
+
+Runs gunicorn (several workers) on a copy of the database twice: once with
+``SQLITE_MODE=0`` and the rollback journal, as before sqlite_mode.py, and
+once with WAL, the pragmas and the write queue. Client threads mix group
+page views (each also an analytics write, flushed every half second) with
+group submissions, and the run reports reads/s, writes/s and failures,
+"database is locked" included.
+
+    python benchmarks/sqlite_bench.py --database-url sqlite:////tmp/bench.db
+    python benchmarks/sqlite_bench.py --database-url sqlite:////tmp/bench.db --workers 4 --write-ratio 0.2
+"""
+import argparse
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from common import append_history, copy_sqlite
+from loadtest import free_port, wait_for_port
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def sample_data(path):
+    with sqlite3.connect(path) as connection:
+        pages = [f'/group/{category}/{slug}' for slug, category in connection.execute(
+            "SELECT g.slug, c.slug FROM whatsapp_group g JOIN category c ON c.id = g.category_id "
+            "WHERE g.status = 'approved' ORDER BY g.id LIMIT 200")]
+        taxonomy = [connection.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1').fetchone()[0]
+                    for table in ('category', 'country', 'language')]
+    return pages, taxonomy
+
+def prepare(source, target, wal):
+    copy_sqlite(source, target)
+    with sqlite3.connect(target) as connection:
+        connection.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+
+def drive(port, pages, taxonomy, concurrency, duration, write_ratio):
+    counts = {'reads': 0, 'writes': 0, 'read_errors': 0, 'write_errors': 0}
+    lock = threading.Lock()
+    opener = urllib.request.build_opener(NoRedirect)
+    stop_at = time.perf_counter() + duration
+
+    def submit():
+        data = urllib.parse.urlencode({
+            'name': f'Bench group {uuid.uuid4().hex[:8]}',
+            'description': 'Load test submission',
+            # Unroutable, so enrichment fails fast instead of reaching WhatsApp
+            'invite_link': f'http://127.0.0.1:9/{uuid.uuid4().hex}',
+            'category_id': taxonomy[0], 'country_id': taxonomy[1], 'language_id': taxonomy[2],
+            'tags': 'bench, load',
+        }).encode()
+        try:
+            opener.open(f'http://127.0.0.1:{port}/submit-group', data, timeout=60).read()
+            return False  # a 200 is the form again, with the error flashed
+        except urllib.error.HTTPError as e:
+            return e.code == 302
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = dict.fromkeys(counts, 0)
+        while time.perf_counter() < stop_at:
+            if rng.random() < write_ratio:
+                ok = submit()
+                local['writes' if ok else 'write_errors'] += 1
+                continue
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}{rng.choice(pages)}', timeout=60) as r:
+                    r.read()
+                local['reads'] += 1
+            except (urllib.error.URLError, OSError):
+                local['read_errors'] += 1
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {**counts, 'reads_per_s': round(counts['reads'] / elapsed, 1),
+            'writes_per_s': round(counts['writes'] / elapsed, 1)}
+
+def run_mode(mode, path, args, pages, taxonomy):
+    env = dict(os.environ, SQLITE_MODE='1' if mode == 'sqlite mode' else '0', SESSION_SECRET='bench',
+               RATELIMIT_ENABLED='0', IMAGES_ENABLED='0', ANALYTICS_FLUSH_INTERVAL='0.5')
+    port = free_port()
+    app_spec = f'common:make_app("sqlite:///{path}")'
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', app_spec, '--bind', f'127.0.0.1:{port}',
+                               '--workers', str(args.workers), '--worker-class', 'gthread',
+                               '--threads', str(args.threads), '--log-level', 'error'],
+                              cwd=BENCH_DIR, env=env)
+    try:
+        wait_for_port(port)
+        drive(port, pages, taxonomy, args.concurrency, 2, args.write_ratio)  # warm up
+        return drive(port, pages, taxonomy, args.concurrency, args.duration, args.write_ratio)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='sqlite:////path/to/source.db (copied, not modified)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    source = args.database_url.split(':///', 1)[1]
+    pages, taxonomy = sample_data(source)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('before', 'sqlite mode'):
+            path = os.path.join(tmp, f"{mode.replace(' ', '_')}.db")
+            prepare(source, path, wal=mode == 'sqlite mode')
+            results[mode] = run_mode(mode, path, args, pages, taxonomy)
+
+    print(f"{'mode':<12} {'reads/s':>8} {'writes/s':>9} {'read errors':>12} {'write errors':>13}")
+    for mode, r in results.items():
+        print(f"{mode:<12} {r['reads_per_s']:>8} {r['writes_per_s']:>9} {r['read_errors']:>12} {r['write_errors']:>13}")
+
+    if not args.no_save:
+        append_history('sqlite', {
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'write_ratio': args.write_ratio,
+            'modes': results,
+        })
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
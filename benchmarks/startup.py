@@ -0,0 +1,138 @@
+"""Cold start benchmark.
+
+Measures, in fresh interpreters, the time from interpreter start to the
+first completed request, split into:
+
+* ``framework_ms`` - importing Flask, Flask-SQLAlchemy, Flask-Login and the
+  SQLite dialect, which every worker pays whatever the app does
+* ``import_ms`` - importing ``main`` on top of that (our modules, models and
+  ``create_app()``)
+* ``first_request_ms`` - the first request (mapper configuration, first
+  queries and templates)
+
+``overhead`` is the app's share, ``(import_ms + first_request_ms) /
+framework_ms``. Being a ratio to the framework measured in the same
+process, it can be compared across machines, which is what ``--check`` and
+tests/test_startup.py do.
+
+Usage::
+
+    python benchmarks/startup.py                 # print results
+    python benchmarks/startup.py --save-baseline # record current numbers
+    python benchmarks/startup.py --check         # fail if slower than baseline
+
+``--check`` exits non-zero when ``overhead`` regresses by more than
+``--tolerance`` against the stored baseline, so it can run in CI.
+"""
+import argparse
+import compileall
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'startup_baseline.json')
+TOLERANCE = 0.25
+
+FIRST_REQUEST_SCRIPT = """
+import time
+start = time.perf_counter()
+import flask, flask_sqlalchemy, flask_login, sqlalchemy.dialects.sqlite
+framework = time.perf_counter()
+from main import app
+imported = time.perf_counter()
+client = app.test_client()
+response = client.get('/sitemap.xml')
+response.get_data()  # the sitemap streams: time it to the last byte
+response.close()
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print((framework - start) * 1000, (imported - framework) * 1000, (done - imported) * 1000)
+"""
+
+def _env(database_url):
+    env = dict(os.environ)
+    env['DATABASE_URL'] = database_url
+    env.setdefault('SESSION_SECRET', 'benchmark')
+    env.setdefault('INVALIDATION_URL', 'off')
+    env.setdefault('JOBS_ENABLED', '0')
+    env['PYTHONPATH'] = ROOT
+    return env
+
+def prepare_database(database_url):
+    """Create the schema once so the timed runs only measure startup"""
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'main', 'init-db'],
+        cwd=ROOT, env=_env(database_url), check=True, capture_output=True
+    )
+
+def measure_once(database_url):
+    """(framework_ms, import_ms, first_request_ms) of one fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, '-c', FIRST_REQUEST_SCRIPT],
+        cwd=ROOT, env=_env(database_url), check=True, capture_output=True, text=True
+    )
+    return tuple(float(value) for value in result.stdout.strip().splitlines()[-1].split())
+
+def run(runs):
+    # Deployments ship compiled modules; without them every run would time the compiler
+    compileall.compile_dir(ROOT, quiet=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'startup.db')}"
+        prepare_database(database_url)
+        samples = [measure_once(database_url) for _ in range(runs)]
+    framework, imports, first = (statistics.median(column) for column in zip(*samples))
+    return {
+        'framework_ms': round(framework, 1),
+        'import_ms': round(imports, 1),
+        'first_request_ms': round(first, 1),
+        'overhead': round(statistics.median((i + f) / w for w, i, f in samples), 3),
+        'runs': runs,
+    }
+
+def load_baseline():
+    with open(BASELINE_PATH) as fh:
+        return json.load(fh)
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """Messages for every figure that is over its baseline allowance"""
+    limit = baseline['overhead'] * (1 + tolerance)
+    if results['overhead'] > limit:
+        return [f"REGRESSION overhead: {results['overhead']} > {limit:.3f} "
+                f"(import {results['import_ms']} ms + first request {results['first_request_ms']} ms "
+                f"on a {results['framework_ms']} ms framework import)"]
+    return []
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print(f'Baseline written to {BASELINE_PATH}')
+
+    if args.check:
+        if not os.path.exists(BASELINE_PATH):
+            print('No baseline recorded; run with --save-baseline first.')
+            return 1
+        failed = regressions(results, load_baseline(), args.tolerance)
+        for message in failed:
+            print(message)
+        return 1 if failed else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import click
+from flask.cli import with_appcontext
+from werkzeug.security import generate_password_hash
+
+from app import db
+
+def init_app(app):
+    """Register the management commands on the Flask CLI"""
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(create_admin_command)
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(serve_config_command)
+    app.cli.add_command(sync_replicas_command)
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(compute_rankings_command)
+    app.cli.add_command(migrate_slugs_command)
+    app.cli.add_command(migrate_group_ids_command)
+    app.cli.add_command(refresh_images_command)
+    app.cli.add_command(prerender_command)
+    app.cli.add_command(run_jobs_command)
+    app.cli.add_command(run_job_command)
+    app.cli.add_command(restore_group_command)
+
+def ensure_admin_user(username='admin', email='admin@example.com', password='admin123'):
+    """Create an admin user if one with this username does not exist yet"""
+    from models import User
+
+    if User.query.filter_by(username=username).first():
+        return None
+
+    admin_user = User(
+        username=username,
+        email=email,
+        password_hash=generate_password_hash(password),
+        is_admin=True
+    )
+    db.session.add(admin_user)
+    db.session.commit()
+    return admin_user
+
+@click.command('init-db')
+@with_appcontext
+@click.option('--no-admin', is_flag=True, help='Do not create the default admin user.')
+def init_db_command(no_admin):
+    """Create database tables and the default admin user"""
+    db.create_all()
+    click.echo('Database tables created.')
+
+    if not no_admin and ensure_admin_user():
+        click.echo('Default admin user created: admin/admin123')
+
+@click.command('create-admin')
+@with_appcontext
+@click.argument('username')
+@click.argument('email')
+@click.password_option()
+def create_admin_command(username, email, password):
+    """Create an admin user"""
+    if ensure_admin_user(username, email, password):
+        click.echo(f'Admin user "{username}" created.')
+    else:
+        click.echo(f'User "{username}" already exists.')
+
+@click.command('seed-data')
+@with_appcontext
+def seed_data_command():
+    """Create the default categories, countries and languages"""
+    from utils import seed_default_data
+
+    seed_default_data()
+    click.echo('Default data has been initialized.')
+
+@click.command('serve-config')
+@click.option('--profile', type=click.Choice(['web', 'submit']), default='web')
+@click.option('--format', 'fmt', type=click.Choice(['gunicorn', 'uvicorn', 'nginx']), default='gunicorn')
+@click.option('--cores', type=int, default=None, help='Override the detected core count.')
+def serve_config_command(profile, fmt, cores):
+    """Print a production server configuration"""
+    import serving
+
+    if fmt == 'gunicorn':
+        click.echo(serving.gunicorn_config(profile, cores), nl=False)
+    elif fmt == 'uvicorn':
+        click.echo(serving.uvicorn_command(profile, cores))
+    else:
+        click.echo(serving.nginx_snippet(), nl=False)
+
+@click.command('sync-replicas')
+@with_appcontext
+def sync_replicas_command():
+    """Copy the SQLite primary into the SQLite read replicas"""
+    from flask import current_app
+    from replicas import sync_sqlite_replicas
+
+    for path in sync_sqlite_replicas(current_app, db):
+        click.echo(f'Replica refreshed: {path}')
+
+@click.command('compile-templates')
+@click.option('--target', default='build/templates', show_default=True)
+@with_appcontext
+def compile_templates_command(target):
+    """Precompile Jinja templates for TEMPLATE_MODULES_PATH"""
+    from flask import current_app
+    from templating import compile_templates
+
+    count = compile_templates(current_app, target)
+    click.echo(f'{count} templates compiled into {target}')
+
+@click.command('build-assets')
+@click.option('--target', default='build/assets', show_default=True)
+@with_appcontext
+def build_assets_command(target):
+    """Minify, fingerprint and precompress the CSS/JS bundles; serve with ASSETS_PATH"""
+    from flask import current_app
+    from assets import build_assets
+
+    for name, sizes in build_assets(current_app, target).items():
+        compressed = ', '.join(f'{sizes[e]} {e}' for e in ('gzip', 'br') if e in sizes)
+        click.echo(f"{sizes['file']}: {sizes['source']} -> {sizes['identity']} bytes ({compressed})")
+
+@click.command('compute-rankings')
+@with_appcontext
+def compute_rankings_command():
+    """Rebuild trending/popularity scores; run periodically from cron"""
+    import ranking
+
+    counts = ranking.compute_rankings()
+    click.echo(f"Ranked {counts['group']} groups, {counts['category']} categories, {counts['tag']} tags")
+
+@click.command('migrate-slugs')
+@with_appcontext
+def migrate_slugs_command():
+    """Make group slugs unique and add the slug history table to an existing database"""
+    from sqlalchemy import bindparam, func
+    from models import WhatsAppGroup, SlugHistory
+    from slugs import allocate_slugs
+
+    SlugHistory.__table__.create(db.engine, checkfirst=True)
+
+    # The oldest group keeps a shared slug, the rest get numbered ones in one
+    # batch. Core updates, so no history is recorded for a slug that stays live.
+    table = WhatsAppGroup.__table__
+    first_ids = db.session.query(func.min(WhatsAppGroup.id)).group_by(WhatsAppGroup.slug)
+    duplicates = db.session.query(WhatsAppGroup.id, WhatsAppGroup.name)\
+        .filter(WhatsAppGroup.id.not_in(first_ids))\
+        .order_by(WhatsAppGroup.id).all()
+    new_slugs = allocate_slugs(WhatsAppGroup, [name for _, name in duplicates])
+    if duplicates:
+        db.session.execute(table.update().where(table.c.id == bindparam('group_id')),
+                           [{'group_id': group_id, 'slug': slug}
+                            for (group_id, _), slug in zip(duplicates, new_slugs)])
+    db.session.commit()
+
+    for index in WhatsAppGroup.__table__.indexes:
+        if index.name == 'uq_whatsapp_group_slug':
+            index.create(db.engine, checkfirst=True)
+    click.echo(f'{len(duplicates)} duplicate group slugs renamed; slug index and history table in place.')
+
+@click.command('migrate-group-ids')
+@with_appcontext
+def migrate_group_ids_command():
+    """Rebuild a SQLite group table created without AUTOINCREMENT, so archived group ids are never reused"""
+    from sqlalchemy import text
+    from sqlalchemy.schema import CreateTable
+    from models import WhatsAppGroup, ArchivedGroup
+
+    table = WhatsAppGroup.__table__
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Only SQLite reuses ids; nothing to do.')
+        return
+    ArchivedGroup.__table__.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {'name': table.name}).scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            click.echo('Group ids already use AUTOINCREMENT.')
+            return
+        # The usual SQLite table rebuild: new table, copy, drop, rename. With
+        # foreign keys off, group_tags and friends keep pointing at the name.
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.commit()
+        with conn.begin():
+            conn.exec_driver_sql(str(CreateTable(table).compile(db.engine))
+                                 .replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_new ', 1))
+            names = ', '.join(column.name for column in table.columns)
+            conn.exec_driver_sql(f'INSERT INTO {table.name}_new ({names}) SELECT {names} FROM {table.name}')
+            conn.exec_driver_sql(f'DROP TABLE {table.name}')
+            conn.exec_driver_sql(f'ALTER TABLE {table.name}_new RENAME TO {table.name}')
+            for index in table.indexes:
+                index.create(conn)
+            # Ids handed out before, archived since, must not come back either
+            highest = conn.execute(text(
+                f'SELECT max(coalesce((SELECT max(id) FROM {table.name}), 0), '
+                f'coalesce((SELECT max(group_id) FROM archived_group), 0))')).scalar()
+            conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+            conn.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                         {'name': table.name, 'seq': highest})
+    click.echo(f'Group table rebuilt with AUTOINCREMENT; new ids start after {highest}.')
+
+@click.command('refresh-images')
+@click.option('--limit', type=int, default=500, show_default=True, help='Groups to fetch per run.')
+@with_appcontext
+def refresh_images_command(limit):
+    """Fetch missing group thumbnails and retry failed ones; run periodically from cron"""
+    from models import GroupImage
+    from images import image_pipeline
+
+    # Also adds the table to a database created before images.py existed
+    GroupImage.__table__.create(db.engine, checkfirst=True)
+    attempted, stored = image_pipeline.refresh(limit)
+    click.echo(f'{stored} of {attempted} group images stored.')
+
+@click.command('prerender')
+@click.option('--full', is_flag=True, help='Render every page, not only the changed ones.')
+@click.option('--target', default=None, help='Output directory (default PRERENDER_PATH).')
+@click.option('--base-url', default=None, help='Public site URL (default PRERENDER_BASE_URL).')
+@click.option('--workers', type=int, default=None, help='Render processes (default PRERENDER_WORKERS).')
+@with_appcontext
+def prerender_command(full, target, base_url, workers):
+    """Render changed public pages to static files; run periodically from cron"""
+    from flask import current_app
+    from prerender import prerenderer, BuildInProgress
+
+    # Only this command renders, so the web workers never set the renderer up
+    prerenderer.init_app(current_app)
+    try:
+        stats = prerenderer.build(full=full, target=target, base_url=base_url, workers=workers)
+    except (ValueError, BuildInProgress) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{stats['rendered']} pages rendered, {stats['removed']} removed, "
+               f"{stats['pages']} in the manifest ({stats['seconds']}s)")
+
+@click.command('run-jobs')
+@with_appcontext
+def run_jobs_command():
+    """Run the job scheduler in the foreground, e.g. when web workers have JOBS_ENABLED=0"""
+    from jobs import scheduler
+
+    click.echo(f'Scheduling {", ".join(name for name, cron in scheduler.schedules.items() if cron)}; '
+               f'{scheduler.workers} worker(s), polling every {scheduler.poll_interval:g}s.')
+    scheduler.run_forever()
+
+@click.command('run-job')
+@click.argument('name')
+@with_appcontext
+def run_job_command(name):
+    """Run one background job now, recorded in the run history like any other"""
+    from jobs import scheduler, registry, JobBusy
+    from models import JobRun
+
+    if name not in registry:
+        raise click.BadParameter(f'choose from {", ".join(sorted(registry))}', param_hint='NAME')
+    try:
+        run_id, error = scheduler.run_now(name)
+    except JobBusy as e:
+        raise click.ClickException(str(e))
+    run = db.session.get(JobRun, run_id)
+    if error:
+        raise click.ClickException(f'{name} failed after {run.duration_ms:.0f} ms: {error}')
+    rows = '' if run.rows is None else f', {run.rows} rows'
+    click.echo(f'{name} finished in {run.duration_ms:.0f} ms{rows}' + (f' ({run.message})' if run.message else ''))
+
+@click.command('restore-group')
+@click.argument('group_ids', nargs=-1, type=int, required=True)
+@with_appcontext
+def restore_group_command(group_ids):
+    """Move archived groups back into the group table, by the id they had"""
+    import archive
+    from models import ArchivedGroup
+
+    for group_id in group_ids:
+        archived = ArchivedGroup.query.filter_by(group_id=group_id).first()
+        if archived is None:
+            click.echo(f'{group_id}: not in the archive')
+            continue
+        try:
+            group = archive.restore(archived)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            click.echo(f'{group_id}: {e}')
+            continue
+        click.echo(f'{group_id}: restored, "{group.slug}" ({group.status})')
@@ -0,0 +1,128 @@
+"""Response compression negotiated by Accept-Encoding.
+
+Text responses (HTML, JSON, XML, CSS/JS, SVG) of at least
+``COMPRESS_MIN_SIZE`` bytes (default 500) go out brotli-compressed when the
+client accepts it and the ``brotli`` package is installed, gzip otherwise.
+Streamed responses such as the sitemap are compressed chunk by chunk, each
+chunk flushed so clients still receive them as they are produced.
+
+Levels are tuned for per-request CPU, not size (``COMPRESS_GZIP_LEVEL``
+default 6, ``COMPRESS_BR_QUALITY`` default 4); precompressed static assets
+(assets.py) and files sent with send_file are left alone. Responses with an
+ETag, like the JSON API's, are compressed once per ETag and served from an
+LRU after that (``COMPRESS_CACHE_SIZE``, default 500), and their ETag is
+made weak since the bytes differ per encoding.
+
+``COMPRESS_ENABLED=0`` turns it off, e.g. when nginx compresses instead.
+"""
+import os
+import zlib
+
+from flask import request
+
+from templating import FragmentCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIMETYPES = frozenset((
+    'text/html', 'text/plain', 'text/css', 'text/xml', 'text/javascript', 'application/javascript',
+    'application/json', 'application/xml', 'application/rss+xml', 'image/svg+xml',
+))
+
+def gzip_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def brotli_compress(data, quality):
+    return brotli.compress(data, quality=quality, mode=brotli.MODE_TEXT)
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality, mode=brotli.MODE_TEXT)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+class Compressor:
+    def __init__(self):
+        self.enabled = False
+        self.min_size = 500
+        self.gzip_level = 6
+        self.br_quality = 4
+        self.cache = FragmentCache(500)
+
+    def init_app(self, app):
+        self.enabled = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+        self.min_size = int(os.environ.get('COMPRESS_MIN_SIZE', self.min_size))
+        self.gzip_level = int(os.environ.get('COMPRESS_GZIP_LEVEL', self.gzip_level))
+        self.br_quality = int(os.environ.get('COMPRESS_BR_QUALITY', self.br_quality))
+        self.cache.max_entries = int(os.environ.get('COMPRESS_CACHE_SIZE', self.cache.max_entries))
+        app.extensions['compression'] = self
+        if self.enabled:
+            app.after_request(self.compress_response)
+
+    def choose_encoding(self):
+        """Best encoding the client accepts: brotli over gzip at equal preference"""
+        accepted = request.accept_encodings
+        candidates = [('gzip', accepted['gzip'])]
+        if brotli is not None:
+            candidates.insert(0, ('br', accepted['br']))
+        encoding, quality = max(candidates, key=lambda candidate: candidate[1])
+        return encoding if quality > 0 else None
+
+    def compress_response(self, response):
+        if (response.mimetype not in MIMETYPES or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            if encoding == 'br':
+                response.response = brotli_stream(response.iter_encoded(), self.br_quality)
+            else:
+                response.response = gzip_stream(response.iter_encoded(), self.gzip_level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compressed(data, encoding, response.get_etag()[0]))
+
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def compressed(self, data, encoding, etag):
+        key = (encoding, etag)
+        if etag:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if encoding == 'br':
+            body = brotli_compress(data, self.br_quality)
+        else:
+            body = gzip_compress(data, self.gzip_level)
+        if etag:
+            self.cache.set(key, body)
+        return body
+
+compressor = Compressor()
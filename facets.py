@@ -0,0 +1,576 @@
+"""In-memory faceted browse over approved groups.
+
+Every group gets a fixed bit position in (created_at, id) order. Categories,
+countries and languages keep a bitmap (a Python int) per value and tags a
+posting list of positions, so any filter combination is a handful of ANDs
+and a page is read off the highest set bits. Facet counts come from the same
+structures in the same call:
+
+* category/country/language counts are lookups in marginal count tables
+  (a small OLAP cube, plus one per big tag) kept up to date on every change,
+* anything else popcounts each facet value against the result or walks the
+  result's set bits once, whichever is cheaper for its size.
+
+Only the ``FACET_TAG_LIMIT`` (default 30) largest tags are counted.
+
+Computed counts are cached per filter combination and patched in place on
+every change, so a combination is only computed once per build.
+
+Each worker builds its index in the background on first use and serves the
+database path until it is ready. Changes are picked up incrementally: a
+commit in this worker, or one in another worker reported by the invalidation
+bus, marks the index due, and rows whose ``updated_at`` moved are re-read on
+the next request (and at least every ``FACET_SYNC_INTERVAL`` seconds,
+default 60). Deletes the bus reports are dropped at once; others are
+dropped from pages as they are noticed and from counts on the next full
+rebuild (``FACET_REBUILD_INTERVAL``, default 3600s).
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from itertools import chain, combinations, compress
+from operator import itemgetter
+
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event, select
+
+from app import db
+from invalidation import invalidation_bus, DELETE
+from slugs import slug_resolver
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('category', 'country', 'language')
+FACETS = DIMENSIONS + ('tag',)
+ANY_VALUES = {'', 'Any Category', 'Any Country', 'Any Language', 'Any Tag'}
+
+# Every non-empty subset of DIMENSIONS (as index tuples) gets a marginal table
+SUBSETS = [subset for r in range(1, len(DIMENSIONS) + 1)
+           for subset in combinations(range(len(DIMENSIONS)), r)]
+
+# Big tags keep a cube of their own, minus the full-size subset to bound memory
+TAG_CUBE_SUBSETS = [subset for subset in SUBSETS if len(subset) < len(DIMENSIONS)]
+
+# Rough costs (microseconds) for choosing between popcounting every facet
+# value against a result and enumerating the result's positions once
+POPCOUNT_COST_PER_BIT = 1.5e-4
+ENUMERATE_COST_PER_BIT = 1e-3
+ENUMERATE_COST_PER_MATCH = 0.5
+
+def bitmap(positions, size):
+    """Int with a bit set for each position"""
+    buf = bytearray((size >> 3) + 1)
+    for pos in positions:
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buf, 'little')
+
+def highest_positions(bits, skip, limit):
+    """Positions of set bits from the top, skipping the `skip` highest"""
+    if skip:
+        # Smallest cut whose upper part holds at most `skip` bits
+        low, high = 0, bits.bit_length()
+        while low < high:
+            mid = (low + high) // 2
+            if (bits >> mid).bit_count() <= skip:
+                high = mid
+            else:
+                low = mid + 1
+        bits &= (1 << low) - 1
+    positions = []
+    while bits and len(positions) < limit:
+        pos = bits.bit_length() - 1
+        positions.append(pos)
+        bits ^= 1 << pos
+    return positions
+
+def set_positions(bits):
+    """Positions of all set bits, skipping empty 64-bit words at C speed"""
+    n_bytes = (bits.bit_length() + 63) // 64 * 8
+    words = memoryview(bits.to_bytes(n_bytes, 'little')).cast('Q')
+    positions = []
+    for index in compress(range(len(words)), words):
+        word, base = words[index], index << 6
+        while word:
+            low = word & -word
+            positions.append(base + low.bit_length() - 1)
+            word ^= low
+    return positions
+
+def gather(column, positions):
+    """column[p] for each position, at C speed"""
+    if len(positions) > 1:
+        return itemgetter(*positions)(column)
+    return tuple(column[p] for p in positions)
+
+class FacetState:
+    """One generation of the index; rebuilt wholesale, patched in place by sync"""
+
+    def __init__(self, pinned_tags=30, cube_tags=8, tag_cache_size=256):
+        self.positions = {}  # group id -> bit position
+        self.group_ids = array('q')  # bit position -> group id
+        self.approved = bytearray()  # bit position -> 1 if live
+        self.values = {dim: array('q') for dim in DIMENSIONS}  # bit position -> value id
+        self.tags_at = []  # bit position -> tuple of tag ids
+        self.live = 0  # approved groups
+        self.featured = 0
+        self.bitmaps = {dim: {} for dim in DIMENSIONS}  # value id -> bitmap
+        self.cube = {subset: Counter() for subset in SUBSETS}  # value tuple -> count
+        self.postings = {}  # tag id -> array of positions
+        self.pinned_tags = ()  # largest tags, counted on every page
+        self.tag_cubes = {}  # largest few tags -> their own cube, without the full subset
+        self.pinned_limit = pinned_tags
+        self.cube_tag_limit = cube_tags
+        self.tag_bitmaps = OrderedDict()
+        self.tag_cache_size = tag_cache_size
+        self.counts_cache = OrderedDict()
+
+    @property
+    def size(self):
+        return len(self.group_ids)
+
+    def tag_bitmap(self, tag_id):
+        bits = self.tag_bitmaps.get(tag_id)
+        if bits is None:
+            bits = bitmap(self.postings.get(tag_id, ()), self.size)
+            self.tag_bitmaps[tag_id] = bits
+            while len(self.tag_bitmaps) > self.tag_cache_size + len(self.pinned_tags):
+                evict = next(t for t in self.tag_bitmaps if t not in self.pinned_tags)
+                del self.tag_bitmaps[evict]
+        return bits
+
+    def pin_tags(self):
+        ranked = sorted(self.postings, key=lambda tag_id: len(self.postings[tag_id]), reverse=True)
+        self.pinned_tags = tuple(ranked[:self.pinned_limit])
+        for tag_id in self.pinned_tags:
+            self.tag_bitmap(tag_id)
+        for tag_id in self.pinned_tags[:self.cube_tag_limit]:
+            columns = [gather(self.values[dim], self.postings[tag_id]) for dim in DIMENSIONS]
+            self.tag_cubes[tag_id] = {
+                subset: Counter(zip(*(columns[i] for i in subset))) for subset in TAG_CUBE_SUBSETS
+            }
+
+    # Changes
+
+    def _place(self, group_id):
+        pos = self.positions.get(group_id)
+        if pos is None:
+            pos = self.size
+            self.positions[group_id] = pos
+            self.group_ids.append(group_id)
+            self.approved.append(0)
+            for dim in DIMENSIONS:
+                self.values[dim].append(0)
+            self.tags_at.append(())
+        return pos
+
+    def _count(self, vals, tag_ids, delta):
+        for subset in SUBSETS:
+            key = tuple(vals[i] for i in subset)
+            cube = self.cube[subset]
+            cube[key] += delta
+            if not cube[key]:
+                del cube[key]
+        for tag_id in tag_ids:
+            tag_cube = self.tag_cubes.get(tag_id)
+            if tag_cube is not None:
+                for subset in TAG_CUBE_SUBSETS:
+                    tag_cube[subset][tuple(vals[i] for i in subset)] += delta
+        # Keep cached facet counts exact rather than dropping them
+        group = dict(zip(DIMENSIONS, vals))
+        for key, counts in self.counts_cache.items():
+            filters = dict(key)
+            for facet in FACETS:
+                others_match = all(
+                    (value in tag_ids) if other == 'tag' else group[other] == value
+                    for other, value in filters.items() if other != facet
+                )
+                if not others_match:
+                    continue
+                if facet == 'tag':
+                    for tag_id in tag_ids:
+                        if tag_id in counts['tag']:
+                            counts['tag'][tag_id] += delta
+                else:
+                    value = group[facet]
+                    counts[facet][value] = counts[facet].get(value, 0) + delta
+
+    def _set_bits(self, pos, vals, tag_ids, on):
+        bit = 1 << pos
+        for dim, value in zip(DIMENSIONS, vals):
+            bitmaps = self.bitmaps[dim]
+            bitmaps[value] = bitmaps.get(value, 0) | bit if on else bitmaps.get(value, 0) & ~bit
+        for tag_id in tag_ids:
+            if tag_id in self.tag_bitmaps:
+                bits = self.tag_bitmaps[tag_id]
+                self.tag_bitmaps[tag_id] = bits | bit if on else bits & ~bit
+            postings = self.postings.setdefault(tag_id, array('q'))
+            if on:
+                postings.append(pos)
+            else:
+                postings.remove(pos)
+        self.live = self.live | bit if on else self.live & ~bit
+
+    def apply(self, group_id, vals, tag_ids, approved, featured):
+        """Insert, update or remove one group"""
+        pos = self._place(group_id)
+        if self.approved[pos]:
+            old_vals = tuple(self.values[dim][pos] for dim in DIMENSIONS)
+            old_tags = self.tags_at[pos]
+            self._set_bits(pos, old_vals, old_tags, False)
+            self._count(old_vals, old_tags, -1)
+            self.approved[pos] = 0
+            self.tags_at[pos] = ()
+        if approved:
+            for dim, value in zip(DIMENSIONS, vals):
+                self.values[dim][pos] = value
+            self.tags_at[pos] = tag_ids
+            self.approved[pos] = 1
+            self._set_bits(pos, vals, tag_ids, True)
+            self._count(vals, tag_ids, 1)
+        bit = 1 << pos
+        self.featured = self.featured | bit if featured and approved else self.featured & ~bit
+
+    def remove(self, group_id):
+        if group_id in self.positions:
+            self.apply(group_id, None, (), False, False)
+
+    # Counting
+
+    def counts(self, filters):
+        """Per-value counts for each facet, applying the filters on the other facets"""
+        dims = {dim: filters[dim] for dim in DIMENSIONS if dim in filters}
+        tag = filters.get('tag')
+        counts = {}
+        for index, facet in enumerate(DIMENSIONS):
+            others = {dim: value for dim, value in dims.items() if dim != facet}
+            if tag is None:
+                counts[facet] = self._cube_counts(self.cube, index, others)
+            elif tag in self.tag_cubes and len(others) < len(DIMENSIONS) - 1:
+                counts[facet] = self._cube_counts(self.tag_cubes[tag], index, others)
+            elif not others:
+                found = Counter(gather(self.values[facet], self.postings.get(tag, ())))
+                counts[facet] = {value: found.get(value, 0) for value in self.bitmaps[facet]}
+            else:
+                counts[facet] = self._counts_over(facet, self._base(others, tag))
+        # Only the largest tags are counted; the tag filter itself doesn't apply
+        counts['tag'] = self._pinned_tag_counts(dims)
+        return counts
+
+    def _base(self, dims, tag=None):
+        bits = self.live
+        for dim, value in dims.items():
+            bits &= self.bitmaps[dim].get(value, 0)
+        if tag is not None:
+            bits &= self.tag_bitmap(tag)
+        return bits
+
+    def _enumerate_is_cheaper(self, bits, n_values):
+        enumerate_cost = self.size * ENUMERATE_COST_PER_BIT + bits.bit_count() * ENUMERATE_COST_PER_MATCH
+        return enumerate_cost < n_values * self.size * POPCOUNT_COST_PER_BIT
+
+    def _cube_counts(self, cubes, index, others):
+        fixed = {DIMENSIONS.index(dim): value for dim, value in others.items()}
+        subset = tuple(sorted([index, *fixed]))
+        cube = cubes[subset]
+        return {
+            value: cube.get(tuple(value if i == index else fixed[i] for i in subset), 0)
+            for value in self.bitmaps[DIMENSIONS[index]]
+        }
+
+    def _counts_over(self, facet, base):
+        values = self.bitmaps[facet]
+        if self._enumerate_is_cheaper(base, len(values)):
+            found = Counter(gather(self.values[facet], set_positions(base)))
+            return {value: found.get(value, 0) for value in values}
+        return {value: (base & bits).bit_count() for value, bits in values.items()}
+
+    def _pinned_tag_counts(self, dims):
+        if not dims:
+            return {t: len(self.postings.get(t, ())) for t in self.pinned_tags}
+        base = self._base(dims)
+        if self._enumerate_is_cheaper(base, len(self.pinned_tags)):
+            found = Counter(chain.from_iterable(gather(self.tags_at, set_positions(base))))
+            return {t: found.get(t, 0) for t in self.pinned_tags}
+        return {t: (base & self.tag_bitmap(t)).bit_count() for t in self.pinned_tags}
+
+class FacetResult:
+    def __init__(self, state, bits, counts):
+        self.state = state
+        self.bits = bits
+        self.counts = counts  # {facet: {value id: count}}
+        self.total = bits.bit_count()
+
+    def page_ids(self, offset, limit):
+        """Group ids for one page: featured first, then newest"""
+        featured = self.bits & self.state.featured
+        rest = self.bits & ~self.state.featured
+        n_featured = featured.bit_count()
+        positions = []
+        if offset < n_featured:
+            positions = highest_positions(featured, offset, limit)
+        if len(positions) < limit:
+            positions += highest_positions(rest, max(offset - n_featured, 0), limit - len(positions))
+        return [self.state.group_ids[pos] for pos in positions]
+
+class FacetPagination(Pagination):
+    """Pagination over a FacetResult, loading only the page's groups (as read models)"""
+
+    def _query_items(self):
+        from readmodels import group_cards
+
+        result = self._query_args['result']
+        ids = result.page_ids(self._query_offset, self.per_page)
+        groups = {g.id: g for g in group_cards(ids) if g.status == 'approved'}
+        missing = [i for i in ids if i not in groups]
+        if missing:
+            # Deleted or unapproved elsewhere since the last sync
+            self._query_args['index'].forget(missing)
+        return [groups[i] for i in ids if i in groups]
+
+    def _query_count(self):
+        return self._query_args['result'].total
+
+class FacetIndex:
+    def __init__(self):
+        self.app = None
+        self.state = None
+        self.enabled = False
+        self.sync_interval = 60.0
+        self.rebuild_interval = 3600.0
+        self.tag_limit = 30
+        self.counts_cache_size = 256
+        self._lock = threading.RLock()
+        self._building = False
+        self._built_at = 0.0
+        self._synced_at = None
+        self._last_sync = 0.0
+        self._sync_due = False
+        self._deleted = set()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('FACETS_ENABLED', '1') == '1'
+        self.sync_interval = float(os.environ.get('FACET_SYNC_INTERVAL', self.sync_interval))
+        self.rebuild_interval = float(os.environ.get('FACET_REBUILD_INTERVAL', self.rebuild_interval))
+        self.tag_limit = int(os.environ.get('FACET_TAG_LIMIT', self.tag_limit))
+        app.extensions['facets'] = self
+        invalidation_bus.subscribe(('group', 'tag'), self._on_invalidation)
+        if not event.contains(db.session, 'after_flush', self._after_flush):
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+
+    # Change tracking
+
+    def _after_flush(self, session, flush_context):
+        from models import WhatsAppGroup, Category, Country, Language, Tag
+
+        taxonomy = (Category, Country, Language, Tag)
+        for obj in session.deleted:
+            if isinstance(obj, WhatsAppGroup):
+                self._deleted.add(obj.id)
+            elif isinstance(obj, taxonomy):
+                self._built_at = 0.0  # rebuild on next use
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, WhatsAppGroup):
+                self._sync_due = True
+
+    def _after_commit(self, session):
+        # Released savepoints (save_with_slug) fire this too; wait for the real commit
+        if session.in_nested_transaction():
+            return
+        if self._deleted:
+            self._sync_due = True
+
+    def _on_invalidation(self, topic, entity_id, op):
+        # Tag deletes bump their groups' updated_at, so a sync covers them too
+        if topic == 'group' and op == DELETE:
+            self._deleted.add(entity_id)
+        self._sync_due = True
+
+    def forget(self, group_ids):
+        with self._lock:
+            if self.state is not None:
+                for group_id in group_ids:
+                    self.state.remove(group_id)
+
+    # Building and syncing
+
+    def ready(self):
+        """Current state, kicking off a (re)build or sync as needed; None until built"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        if self.state is None or now - self._built_at > self.rebuild_interval:
+            self._start_build()
+        if self.state is not None and (self._sync_due or now - self._last_sync > self.sync_interval):
+            self.sync()
+        return self.state
+
+    def _start_build(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        thread = threading.Thread(target=self._build_in_background, name='facet-build', daemon=True)
+        thread.start()
+
+    def _build_in_background(self):
+        try:
+            with self.app.app_context():
+                self.build()
+                db.session.remove()
+        except Exception as e:
+            logger.error(f"Facet index build failed: {e}")
+        finally:
+            self._building = False
+
+    def build(self):
+        """Load every group into a fresh state and swap it in"""
+        from models import WhatsAppGroup, group_tags
+
+        started = time.perf_counter()
+        synced_at = datetime.utcnow()
+        state = FacetState(pinned_tags=self.tag_limit)
+        columns = [state.values[dim] for dim in DIMENSIONS]
+
+        members = [{} for _ in DIMENSIONS]
+        live, featured = [], []
+        cube = Counter()
+        groups = WhatsAppGroup.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execution_options(yield_per=10_000).execute(
+                select(groups.c.id, groups.c.status, groups.c.featured,
+                       groups.c.category_id, groups.c.country_id, groups.c.language_id)
+                .order_by(groups.c.created_at, groups.c.id))
+            rows = chain.from_iterable(rows.partitions())
+            for pos, (group_id, status, is_featured, category_id, country_id, language_id) in enumerate(rows):
+                state.positions[group_id] = pos
+                state.group_ids.append(group_id)
+                if status != 'approved':
+                    state.approved.append(0)
+                    for column in columns:
+                        column.append(0)
+                    continue
+                state.approved.append(1)
+                vals = (category_id, country_id, language_id)
+                for column, dim_members, value in zip(columns, members, vals):
+                    column.append(value)
+                    dim_members.setdefault(value, []).append(pos)
+                cube[vals] += 1
+                live.append(pos)
+                if is_featured:
+                    featured.append(pos)
+
+            shared = {}  # one int object per tag id across all tuples
+            links = {}
+            postings = state.postings
+            positions = state.positions
+            approved = state.approved
+            links_rows = conn.execution_options(yield_per=10_000).execute(
+                select(group_tags.c.group_id, group_tags.c.tag_id))
+            for group_id, tag_id in chain.from_iterable(links_rows.partitions()):
+                pos = positions.get(group_id)
+                if pos is not None and approved[pos]:
+                    tag_id = shared.setdefault(tag_id, tag_id)
+                    links.setdefault(pos, []).append(tag_id)
+                    postings.setdefault(tag_id, array('q')).append(pos)
+        size = state.size
+        state.tags_at = [()] * size
+        for pos, tag_ids in links.items():
+            state.tags_at[pos] = tuple(tag_ids)
+
+        for dim, dim_members in zip(DIMENSIONS, members):
+            state.bitmaps[dim] = {value: bitmap(positions, size) for value, positions in dim_members.items()}
+        state.live = bitmap(live, size)
+        state.featured = bitmap(featured, size)
+        for vals, count in cube.items():
+            for subset in SUBSETS:
+                state.cube[subset][tuple(vals[i] for i in subset)] += count
+        state.pin_tags()
+
+        with self._lock:
+            self.state = state
+            self._synced_at = synced_at
+            self._built_at = self._last_sync = time.monotonic()
+            self._deleted.clear()
+            self._sync_due = True  # catch anything committed while building
+        logger.info(f"Facet index built: {size} groups in {time.perf_counter() - started:.2f}s")
+        return state
+
+    def sync(self):
+        """Re-read groups changed since the last sync and patch the index"""
+        from models import WhatsAppGroup, group_tags
+
+        with self._lock:
+            state = self.state
+            if state is None:
+                return
+            self._sync_due = False
+            self._last_sync = time.monotonic()
+            since = self._synced_at - timedelta(seconds=1)
+            self._synced_at = datetime.utcnow()
+            deleted, self._deleted = self._deleted, set()
+
+            # Straight to the primary: a lagging replica would lose changes for good
+            table = WhatsAppGroup.__table__
+            with db.engine.connect() as conn:
+                changed = conn.execute(
+                    select(table.c.id, table.c.status, table.c.featured,
+                           table.c.category_id, table.c.country_id, table.c.language_id)
+                    .where(table.c.updated_at >= since).order_by(table.c.id)
+                ).all()
+                tags = {}
+                if changed:
+                    ids = [row[0] for row in changed]
+                    for group_id, tag_id in conn.execute(
+                            select(group_tags.c.group_id, group_tags.c.tag_id)
+                            .where(group_tags.c.group_id.in_(ids))):
+                        tags.setdefault(group_id, []).append(tag_id)
+            # Deletes first: a group archived and restored since the last sync is back among the changed
+            for group_id in deleted:
+                state.remove(group_id)
+            for group_id, status, featured, *vals in changed:
+                state.apply(group_id, tuple(vals), tuple(tags.get(group_id, ())),
+                            status == 'approved', featured)
+
+    # Querying
+
+    def resolve(self, facet, slug):
+        """Id for a facet slug (old slugs included), or None when unset or unknown"""
+        if not slug or slug in ANY_VALUES:
+            return None
+        return slug_resolver.resolve(facet, slug)[0]
+
+    def search(self, filters):
+        """FacetResult for {facet: value id}, or None while the index is still building"""
+        state = self.ready()
+        if state is None:
+            return None
+        filters = {facet: value for facet, value in filters.items() if value is not None}
+        with self._lock:
+            bits = state.live
+            for dim in DIMENSIONS:
+                if dim in filters:
+                    bits &= state.bitmaps[dim].get(filters[dim], 0)
+            if 'tag' in filters:
+                bits &= state.tag_bitmap(filters['tag'])
+            return FacetResult(state, bits, self.counts(state, filters))
+
+    def counts(self, state, filters):
+        """Facet counts for `filters`, from the per-state cache when possible"""
+        key = tuple(sorted(filters.items()))
+        counts = state.counts_cache.get(key)
+        if counts is None:
+            counts = state.counts(filters)
+            state.counts_cache[key] = counts
+            while len(state.counts_cache) > self.counts_cache_size:
+                state.counts_cache.popitem(last=False)
+        else:
+            state.counts_cache.move_to_end(key)
+        return counts
+
+facet_index = FacetIndex()
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, SelectField, BooleanField, PasswordField, HiddenField
-from wtforms.validators import DataRequired, Email, Length, URL, Optional
+from wtforms import StringField, TextAreaField, SelectField, BooleanField, PasswordField, HiddenField, DateTimeLocalField
+from wtforms.validators import DataRequired, Email, Length, URL, Optional, ValidationError
 from wtforms.widgets import TextArea
 from flask_ckeditor import CKEditorField
 
@@ -72,3 +72,9 @@ class NotificationForm(FlaskForm):
     message = TextAreaField('Message', validators=[DataRequired()])
     notification_type = SelectField('Type', choices=[('info', 'Info'), ('success', 'Success'), ('warning', 'Warning'), ('error', 'Error')])
     is_active = BooleanField('Active', default=True)
+    start_date = DateTimeLocalField('Show From (UTC)', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    end_date = DateTimeLocalField('Show Until (UTC)', format='%Y-%m-%dT%H:%M', validators=[Optional()])
+    
+    def validate_end_date(self, field):
+        if field.data and self.start_date.data and field.data <= self.start_date.data:
+            raise ValidationError('Must be after the start.')
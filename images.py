@@ -0,0 +1,235 @@
+"""Group image pipeline: local WebP thumbnails instead of WhatsApp CDN links.
+
+``image_url`` is a signed pps.whatsapp.net URL that expires. When a group is
+enriched (submission, invite link change) its image is downloaded once,
+resized to WebP thumbnails at each of ``SIZES`` by Pillow in a process pool
+and stored content-addressed under ``IMAGE_STORE_PATH`` (default
+``instance/images``) as ``ab/abcdef...-card.webp``, so identical images
+share files.
+
+Thumbnails are served from ``/media/<digest>-<size>.webp`` with a one-year
+immutable Cache-Control: a new image gets a new name. ``group_image_url``
+gives templates the thumbnail URL, or the CDN URL until one exists.
+
+Downloads that fail (usually an expired signature) back off exponentially
+and are retried by ``flask refresh-images``, which re-scrapes the invite
+page for a fresh URL first; run it from cron. It also picks up groups that
+have never been fetched. Without Pillow installed the pipeline stays off
+and pages keep the CDN URLs.
+"""
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import Blueprint, abort, send_from_directory, url_for
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+SIZES = {'card': 120, 'detail': 240}  # square, 2x the largest CSS size they are shown at
+WEBP_QUALITY = 80
+MAX_BYTES = 5 * 1024 * 1024
+ONE_YEAR = 365 * 24 * 3600
+MAX_BACKOFF_HOURS = 7 * 24
+DIGEST = re.compile(r'[0-9a-f]{40}')
+
+def make_thumbnails(data):
+    """{size name: WebP bytes} for one source image; runs in the process pool"""
+    from PIL import Image, ImageOps
+
+    thumbnails = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for name, pixels in SIZES.items():
+            thumbnail = ImageOps.fit(image, (pixels, pixels), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+            thumbnails[name] = buffer.getvalue()
+    return thumbnails
+
+def backoff(failures):
+    """How long to wait before retrying an image that failed `failures` times in a row"""
+    # Capped before the timedelta is built: 2 ** failures hours overflows it past ~35 failures
+    return timedelta(hours=min(2 ** min(failures, 8), MAX_BACKOFF_HOURS))
+
+def relative_path(digest, size):
+    return os.path.join(digest[:2], f'{digest}-{size}.webp')
+
+class ImagePipeline:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.root = None
+        self.workers = 2
+        self._queue = queue.Queue()
+        self._pool = None
+        # Process pools don't survive a fork either: each worker makes its own
+        self._worker = ProcessThread('image-fetch', self._run, setup=self._reset_pool)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('IMAGES_ENABLED', '1') == '1'
+        if self.enabled and importlib.util.find_spec('PIL') is None:
+            # Otherwise every group would be fetched, fail to thumbnail and back off
+            logger.warning("Pillow is not installed, group images are disabled (pip install pillow)")
+            self.enabled = False
+        self.root = os.environ.get('IMAGE_STORE_PATH') or os.path.join(app.instance_path, 'images')
+        self.workers = int(os.environ.get('IMAGE_WORKERS', self.workers))
+        app.extensions['images'] = self
+        app.jinja_env.globals['group_image_url'] = group_image_url
+
+    # Background processing
+
+    def enqueue(self, group_id):
+        """Fetch and thumbnail a group's image off the request path"""
+        if not self.enabled:
+            return
+        self._worker.ensure()
+        self._queue.put(group_id)
+
+    def _reset_pool(self):
+        self._pool = None
+
+    def _run(self):
+        while True:
+            group_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self.process([group_id])
+                    db.session.remove()
+            except Exception as e:
+                logger.error(f"Image processing failed for group {group_id}: {e}")
+
+    def pool(self):
+        if self._pool is None:
+            # Only thumbnailing needs multiprocessing, so it isn't imported at startup
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn: forking a process that runs request threads can copy held locks
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    # Fetching
+
+    def process(self, group_ids, rescrape=False):
+        """Download, thumbnail and store images for `group_ids`; returns how many were stored"""
+        from models import WhatsAppGroup, GroupImage
+        from whatsapp_api import download_image, fetch_group_image
+
+        groups = WhatsAppGroup.query.filter(WhatsAppGroup.id.in_(group_ids)).all()
+        if rescrape:
+            for group in groups:
+                fresh = fetch_group_image(group.invite_link)
+                if fresh:
+                    group.image_url = fresh
+
+        with ThreadPoolExecutor(8) as downloads:
+            sources = list(downloads.map(
+                lambda url: download_image(url, MAX_BYTES) if url else None,
+                [group.image_url for group in groups]))
+
+        pending = {}
+        for group, data in zip(groups, sources):
+            if data is None:
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            if not self.stored(digest):
+                pending[group.id] = (digest, self.pool().submit(make_thumbnails, data))
+            else:
+                pending[group.id] = (digest, None)
+
+        now = datetime.utcnow()
+        stored = 0
+        for group, data in zip(groups, sources):
+            image = group.image or GroupImage(group_id=group.id)
+            image.source_url = group.image_url
+            image.fetched_at = now
+            entry = pending.get(group.id)
+            try:
+                if entry is None:
+                    raise ValueError('download failed')
+                digest, future = entry
+                if future is not None:
+                    self.write(digest, future.result())
+            except Exception as e:
+                image.failures = (image.failures or 0) + 1
+                image.next_attempt_at = now + backoff(image.failures)
+                logger.info(f"No image for group {group.id}: {e}")
+            else:
+                image.digest = digest
+                image.failures = 0
+                image.next_attempt_at = None
+                # Cached cards are keyed on updated_at
+                group.updated_at = now
+                stored += 1
+            group.image = image
+        db.session.commit()
+        return stored
+
+    def refresh(self, limit=500):
+        """Retry failed images (re-scraping the invite page) and fetch missing ones"""
+        from models import WhatsAppGroup, GroupImage
+
+        if not self.enabled:
+            return 0, 0
+        now = datetime.utcnow()
+        due = db.session.query(GroupImage.group_id)\
+            .filter(GroupImage.next_attempt_at <= now)\
+            .order_by(GroupImage.next_attempt_at).limit(limit).all()
+        failed = [group_id for (group_id,) in due]
+        missing = [group_id for (group_id,) in db.session.query(WhatsAppGroup.id)
+                   .outerjoin(GroupImage, GroupImage.group_id == WhatsAppGroup.id)
+                   .filter(GroupImage.group_id.is_(None), WhatsAppGroup.image_url.isnot(None),
+                           WhatsAppGroup.status == 'approved')
+                   .limit(max(0, limit - len(failed)))]
+        stored = 0
+        if failed:
+            stored += self.process(failed, rescrape=True)
+        if missing:
+            stored += self.process(missing)
+        return len(failed) + len(missing), stored
+
+    # Storage
+
+    def stored(self, digest):
+        return all(os.path.exists(os.path.join(self.root, relative_path(digest, size))) for size in SIZES)
+
+    def write(self, digest, thumbnails):
+        for size, data in thumbnails.items():
+            path = os.path.join(self.root, relative_path(digest, size))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as fh:
+                fh.write(data)
+            os.replace(temporary, path)
+
+def group_image_url(group, size='card', external=False):
+    """Local thumbnail URL for `group`, falling back to its CDN image_url"""
+    image = getattr(group, 'image', None)
+    if image is not None and image.digest:
+        return url_for('media.thumbnail', digest=image.digest, size=size, _external=external)
+    return group.image_url
+
+# Serving
+
+media = Blueprint('media', __name__)
+
+@media.route('/media/<digest>-<size>.webp')
+def thumbnail(digest, size):
+    if size not in SIZES or not DIGEST.fullmatch(digest):
+        abort(404)
+    response = send_from_directory(image_pipeline.root, relative_path(digest, size), max_age=ONE_YEAR)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,319 @@
+"""Cross-worker cache invalidation.
+
+Every worker keeps caches of its own (slug maps, the facet index, the
+notification schedule, logged-in principals, group cards). A commit updates
+them in the worker that made it; the bus tells every other worker and node,
+so those caches can keep long refresh intervals and still see admin edits
+within about a second.
+
+Commits publish one message per changed entity, ``(topic, id, op)`` with op
+``new``/``update``/``delete``, after they succeed (from the session's
+``after_commit``). Caches ``subscribe`` to the topics they hold and are
+called from the bus's listener thread for changes made by *other*
+processes. After the listener (re)connects, subscribers get
+``('*', None, None)``: anything may have changed while nobody listened.
+
+The transport is chosen by ``INVALIDATION_URL``:
+
+* unset or ``db``: a ``cache_invalidation`` table in the primary database,
+  polled every ``INVALIDATION_POLL_INTERVAL`` seconds (default 1) with one
+  indexed query; on a psycopg2 Postgres primary, ``LISTEN``/``NOTIFY``
+  instead, which needs no polling
+* ``redis://host:6379/0``: Redis-compatible pub/sub (``pip install redis``)
+* ``memory://``: in-process only, for a single worker and tests
+* ``off``: no bus; caches fall back to their refresh intervals
+
+Only ORM changes are published: Core statements (analytics, write queue
+jobs, bulk updates) are not. A message lost to a crash between commit and
+publish is covered by the same refresh intervals.
+"""
+import json
+import logging
+import os
+import select as select_module
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, select
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+ALL = '*'
+NEW, UPDATE, DELETE = 'new', 'update', 'delete'
+CHANNEL = 'groupleft_invalidation'
+PRUNE_AFTER = timedelta(hours=1)
+PAYLOAD_LIMIT = 7000  # NOTIFY payloads must stay under 8000 bytes
+
+def model_topics():
+    from models import (WhatsAppGroup, Category, Country, Language, Tag, Page, Post,
+                        SiteSettings, Notification, User)
+
+    return {WhatsAppGroup: 'group', Category: 'category', Country: 'country', Language: 'language',
+            Tag: 'tag', Page: 'page', Post: 'post', SiteSettings: 'settings',
+            Notification: 'notification', User: 'user'}
+
+def encode(origin, messages):
+    return json.dumps({'o': origin, 'm': messages}, separators=(',', ':'))
+
+def decode(payload):
+    data = json.loads(payload)
+    return data['o'], [tuple(message) for message in data['m']]
+
+# Transports
+
+class MemoryTransport:
+    """Delivers within this process: the stand-in when there is nothing to share"""
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, origin, messages):
+        with self._lock:
+            listeners = list(self._listeners)
+        for deliver in listeners:
+            deliver(origin, messages)
+
+    def listen(self, deliver, on_connect):
+        with self._lock:
+            self._listeners.append(deliver)
+        on_connect()
+        threading.Event().wait()
+
+class TableTransport:
+    """Messages as rows of ``cache_invalidation``, polled by every worker"""
+
+    lookback = 100  # ids below the last seen one that may still commit (Postgres)
+
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+
+    def publish(self, origin, messages):
+        from models import CacheInvalidation
+        from sqlite_mode import write_queue
+
+        rows = [{'origin': origin, 'topic': topic, 'entity_id': entity_id, 'op': op,
+                 'created_at': datetime.utcnow()} for topic, entity_id, op in messages]
+        statement = insert(CacheInvalidation.__table__)
+        # Through the write queue: on SQLite it joins the next batch instead of waiting for the lock
+        write_queue.run(lambda connection: connection.execute(statement, rows))
+
+    def listen(self, deliver, on_connect):
+        from models import CacheInvalidation
+
+        table = CacheInvalidation.__table__
+        with db.engine.connect() as conn:
+            last_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            seen = deque(conn.execute(select(table.c.id).where(table.c.id > last_id - self.lookback)).scalars(),
+                         maxlen=1000)
+        pruned_at = time.monotonic()
+        on_connect()
+        while True:
+            time.sleep(self.poll_interval)
+            with db.engine.connect() as conn:
+                rows = conn.execute(
+                    select(table.c.id, table.c.origin, table.c.topic, table.c.entity_id, table.c.op)
+                    .where(table.c.id > last_id - self.lookback)
+                    .order_by(table.c.id)).all()
+            by_origin = {}
+            for row_id, origin, topic, entity_id, op in rows:
+                if row_id > last_id or row_id not in seen:
+                    seen.append(row_id)
+                    by_origin.setdefault(origin, []).append((topic, entity_id, op))
+            if rows:
+                last_id = max(last_id, rows[-1][0])
+            for origin, messages in by_origin.items():
+                deliver(origin, messages)
+            if time.monotonic() - pruned_at > PRUNE_AFTER.total_seconds():
+                pruned_at = time.monotonic()
+                self.prune()
+
+    def prune(self):
+        from models import CacheInvalidation
+        from sqlite_mode import write_queue
+
+        table = CacheInvalidation.__table__
+        statement = delete(table).where(table.c.created_at < datetime.utcnow() - PRUNE_AFTER)
+        write_queue.run(lambda connection: connection.execute(statement))
+
+class PostgresTransport:
+    """``NOTIFY`` on publish, a dedicated ``LISTEN`` connection per worker"""
+
+    def publish(self, origin, messages):
+        with db.engine.connect() as conn:
+            for start in range(0, len(messages), 100):
+                payload = encode(origin, messages[start:start + 100])
+                if len(payload) > PAYLOAD_LIMIT:
+                    payload = encode(origin, [(ALL, None, None)])
+                conn.execute(select(func.pg_notify(CHANNEL, payload)))
+            conn.commit()
+
+    def listen(self, deliver, on_connect):
+        connection = db.engine.raw_connection()
+        connection.detach()  # long-lived and in autocommit: keep it out of the pool
+        dbapi = connection.driver_connection
+        try:
+            dbapi.autocommit = True
+            with dbapi.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            on_connect()
+            while True:
+                if select_module.select([dbapi], [], [], 5.0) == ([], [], []):
+                    continue
+                dbapi.poll()
+                while dbapi.notifies:
+                    deliver(*decode(dbapi.notifies.pop(0).payload))
+        finally:
+            connection.close()
+
+class RedisTransport:
+    """Pub/sub on a Redis-compatible server shared by every node"""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=1.0)
+
+    def publish(self, origin, messages):
+        self.client.publish(CHANNEL, encode(origin, messages))
+
+    def listen(self, deliver, on_connect):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(CHANNEL)
+            on_connect()
+            for message in pubsub.listen():
+                deliver(*decode(message['data']))
+        finally:
+            pubsub.close()
+
+def make_transport(url, database_url):
+    if url == 'off':
+        return None
+    if url == 'memory://':
+        return MemoryTransport()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisTransport(url)
+    if url != 'db':
+        raise ValueError(f'Unknown INVALIDATION_URL: {url}')
+    if database_url and database_url.startswith(('postgresql://', 'postgresql+psycopg2://', 'postgres://')):
+        try:
+            import psycopg2  # noqa: F401
+            return PostgresTransport()
+        except ImportError:
+            pass
+    return TableTransport(float(os.environ.get('INVALIDATION_POLL_INTERVAL', 1.0)))
+
+# The bus
+
+class InvalidationBus:
+    def __init__(self):
+        self.app = None
+        self.transport = None
+        self.origin = None
+        self.subscribers = []  # (topics, callback)
+        self.received = 0
+        # Each worker is its own origin, set when its listener starts
+        self._listener = ProcessThread('invalidation-listener', self._listen, setup=self._new_origin)
+
+    def init_app(self, app):
+        self.app = app
+        url = os.environ.get('INVALIDATION_URL', 'db')
+        self.transport = make_transport(url, app.config.get('SQLALCHEMY_DATABASE_URI'))
+        app.extensions['invalidation'] = self
+        if self.transport is None:
+            return
+        app.before_request(self.start)
+        if not event.contains(db.session, 'after_flush', self._after_flush):
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def subscribe(self, topics, callback):
+        """Call `callback(topic, entity_id, op)` for other processes' changes to `topics`"""
+        subscription = (frozenset(topics) | {ALL}, callback)
+        if subscription not in self.subscribers:
+            self.subscribers.append(subscription)
+
+    def publish(self, messages):
+        """Tell the other workers about `messages` [(topic, id, op)]"""
+        if self.transport is None or not messages:
+            return
+        self.start()
+        try:
+            self.transport.publish(self.origin, messages)
+        except Exception as e:
+            logger.error(f"Publishing cache invalidations failed: {e}")
+
+    # Listening
+
+    def start(self):
+        """Start this process's listener; requests do it on their own"""
+        if self.transport is not None:
+            self._listener.ensure()
+
+    def _new_origin(self):
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    def _listen(self):
+        backoff = 1.0
+        while True:
+            try:
+                with self.app.app_context():
+                    self.transport.listen(self._deliver, self._on_connect)
+            except Exception as e:
+                logger.error(f"Cache invalidation listener failed, reconnecting in {backoff:.0f}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def _on_connect(self):
+        self._dispatch([(ALL, None, None)])
+
+    def _deliver(self, origin, messages):
+        if origin != self.origin:
+            self._dispatch(messages)
+
+    def _dispatch(self, messages):
+        for topic, entity_id, op in messages:
+            self.received += 1
+            for topics, callback in self.subscribers:
+                if topic in topics:
+                    try:
+                        callback(topic, entity_id, op)
+                    except Exception as e:
+                        logger.error(f"Cache invalidation for {topic} {entity_id} failed: {e}")
+
+    # Session events
+
+    def _after_flush(self, session, flush_context):
+        topics = model_topics()
+        pending = session.info.setdefault('invalidations', {})
+        for objects, op in ((session.new, NEW), (session.dirty, UPDATE), (session.deleted, DELETE)):
+            for obj in objects:
+                topic = topics.get(type(obj))
+                if topic is not None and (op != UPDATE or session.is_modified(obj)):
+                    key = (topic, obj.id)
+                    # A row created and edited in one transaction is still new
+                    if pending.get(key) != NEW or op == DELETE:
+                        pending[key] = op
+
+    def _after_commit(self, session):
+        # Released savepoints (save_with_slug) fire this too; wait for the real commit
+        if session.in_nested_transaction():
+            return
+        pending = session.info.pop('invalidations', None)
+        if pending:
+            self.publish([(topic, entity_id, op) for (topic, entity_id), op in pending.items()])
+
+    def _after_rollback(self, session):
+        # A rolled back savepoint keeps the outer transaction's changes: publishing a few extra is harmless
+        if not session.in_nested_transaction():
+            session.info.pop('invalidations', None)
+
+invalidation_bus = InvalidationBus()
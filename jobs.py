@@ -0,0 +1,597 @@
+"""Background jobs: cron-scheduled maintenance and admin-triggered tasks.
+
+Jobs are registered with ``@job(name, schedule)``, the schedule a five-field
+cron expression in UTC (``JOB_SCHEDULES`` overrides them). In production
+they run in their own process, ``flask run-jobs``; the gunicorn configs
+from serving.py set ``JOBS_ENABLED=0`` so web workers only queue runs.
+Without them (``flask run``, a hand-written gunicorn command) every worker
+with ``JOBS_ENABLED`` (the default) runs a scheduler thread as well. A
+scheduler wakes every ``JOB_POLL_INTERVAL`` seconds and
+
+* queues a run of each job whose ``job_lease.next_run_at`` has passed; the
+  conditional UPDATE that moves ``next_run_at`` on succeeds on one node only
+* starts queued runs on up to ``JOB_WORKERS`` threads, each after taking
+  the job's lease (``owner``/``expires_at`` on the same row), so a job never
+  runs twice at once, whichever node it is on
+* renews the leases of its running jobs, and fails runs whose lease ran
+  out: their worker died mid-run
+
+Each round also renews the ``scheduler`` heartbeat row in ``job_lease``;
+``alive()`` reads it so the admin panel can warn when runs are queued with
+no scheduler polling anywhere.
+
+Runs are ``job_run`` rows with their trigger, status, duration, rows
+affected and progress, which jobs report through the callable they are
+given; the admin jobs page polls it. A job has at most one queued run:
+triggering it again returns that run.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+# job_lease row every scheduler renews each round, not a job
+HEARTBEAT = 'scheduler'
+
+class JobBusy(Exception):
+    """The job is already running somewhere"""
+
+# Cron expressions
+
+def parse_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        span, _, step = part.partition('/')
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (int(value) for value in span.split('-', 1))
+        else:
+            start = int(span)
+            end = high if step else start
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'Cron field out of range: {field!r}')
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class Cron:
+    """A cron expression: minute hour day-of-month month day-of-week, in UTC"""
+
+    ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *'}
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = self.ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expressions have five fields: {expression!r}')
+        self.minutes = parse_field(fields[0], 0, 59)
+        self.hours = parse_field(fields[1], 0, 23)
+        self.days = parse_field(fields[2], 1, 31)
+        self.months = parse_field(fields[3], 1, 12)
+        # Sunday is 0 or 7
+        self.weekdays = frozenset(day % 7 for day in parse_field(fields[4], 0, 7))
+        self.any_day, self.any_weekday = fields[2] == '*', fields[4] == '*'
+        self.next_after(datetime(2000, 1, 1))  # raises for expressions that never fire
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        # Like cron: with both restricted, either one will do
+        return day or weekday
+
+    def next_after(self, moment):
+        """The first minute after `moment` that matches"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 8)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f'Cron expression never fires: {self.expression!r}')
+
+    def __str__(self):
+        return self.expression
+
+# The registry
+
+Job = namedtuple('Job', 'name func schedule description')
+registry = {}
+
+def job(name, schedule=None):
+    """Register `func(progress)` as job `name`; it returns the rows it affected (or None)"""
+    def register(func):
+        registry[name] = Job(name, func, schedule, (func.__doc__ or '').strip())
+        return func
+    return register
+
+def load_schedules(overrides):
+    """{job name: Cron or None} from the registry, with JOB_SCHEDULES overrides applied
+
+    Overrides are ``name=expression`` pairs separated by ``;``, where an
+    expression of ``off`` unschedules the job.
+    """
+    schedules = {name: Cron(entry.schedule) if entry.schedule else None for name, entry in registry.items()}
+    for override in filter(None, (part.strip() for part in overrides.split(';'))):
+        name, _, expression = (value.strip() for value in override.partition('='))
+        if name not in registry:
+            raise ValueError(f'JOB_SCHEDULES names an unknown job: {name!r}')
+        schedules[name] = None if expression in ('', 'off') else Cron(expression)
+    return schedules
+
+class Progress:
+    """Passed to a running job: call it with the items done (and the total) as it goes"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.done = 0
+        self.total = None
+        self.message = None
+        self._written = 0.0
+
+    def __call__(self, done, total=None, message=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message[:200]
+        if time.monotonic() - self._written >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        from models import JobRun
+        from sqlite_mode import write_queue
+
+        self._written = time.monotonic()
+        runs = JobRun.__table__
+        statement = runs.update().where(runs.c.id == self.run_id, runs.c.status == RUNNING)\
+            .values(progress=self.done, total=self.total, message=self.message)
+        # Not waited for: the job carries on while the write joins the next batch
+        write_queue.submit(lambda connection: connection.execute(statement))
+
+# The scheduler
+
+class Scheduler:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.workers = 1
+        self.poll_interval = 30.0
+        self.lease = timedelta(seconds=120)
+        self.schedules = {}
+        self.owner = None
+        self._running = {}  # run id -> job name, in this process
+        self._leases_created = False
+        self._executor = None
+        # Each worker holds leases under its own name, set when its scheduler starts
+        self._scheduler = ProcessThread('job-scheduler', self._loop, setup=self._reset)
+        self._wake = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('JOBS_ENABLED', '1').lower() in ('1', 'true', 'on')
+        self.workers = max(1, int(os.environ.get('JOB_WORKERS', self.workers)))
+        self.poll_interval = float(os.environ.get('JOB_POLL_INTERVAL', self.poll_interval))
+        # Renewed every poll, so a lease only runs out when its worker is gone
+        self.lease = timedelta(seconds=max(60.0, 4 * self.poll_interval))
+        self.schedules = load_schedules(os.environ.get('JOB_SCHEDULES', ''))
+        self.owner = self._owner_id()
+        app.extensions['jobs'] = self
+        if self.enabled:
+            app.before_request(self.start)
+
+    def _owner_id(self):
+        return f'{socket.gethostname()[:32]}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+    def start(self):
+        """Start this process's scheduler thread; requests do it on their own"""
+        if self.enabled:
+            self._scheduler.ensure()
+
+    def _reset(self):
+        self.owner = self._owner_id()
+        self._running = {}
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='job')
+
+    def _loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception as e:
+                logger.error(f"Job scheduler tick failed: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def tick(self, now=None):
+        """One round: renew leases, queue due jobs, fail abandoned runs, start queued ones"""
+        now = now or datetime.utcnow()
+        self._ensure_leases(now)
+        self.beat(now)
+        self.renew(now)
+        self.queue_due(now)
+        self.fail_abandoned(now)
+        self.start_queued(now)
+
+    # Queueing
+
+    def enqueue(self, name, trigger='admin'):
+        """Queue a run of job `name` and return its id; an already queued run is reused"""
+        from models import JobRun
+        from sqlite_mode import write_queue
+
+        if name not in registry:
+            raise ValueError(f'Unknown job: {name}')
+        self._ensure_leases(datetime.utcnow())
+        runs = JobRun.__table__
+
+        def queue(connection):
+            queued = connection.execute(select(runs.c.id).where(runs.c.name == name, runs.c.status == QUEUED)).scalar()
+            if queued is not None:
+                return queued
+            return connection.execute(runs.insert().values(
+                name=name, trigger=trigger, status=QUEUED, enqueued_at=datetime.utcnow())).inserted_primary_key[0]
+
+        run_id = write_queue.run(queue)
+        self._wake.set()
+        return run_id
+
+    def queue_due(self, now):
+        """Queue a run of every scheduled job that is due, unless one is queued or running"""
+        from models import JobLease, JobRun
+        from sqlite_mode import write_queue
+
+        leases, runs = JobLease.__table__, JobRun.__table__
+        with db.engine.connect() as conn:
+            next_runs = dict(conn.execute(select(leases.c.name, leases.c.next_run_at)).all())
+        for name, cron in self.schedules.items():
+            if cron is None or name not in next_runs:
+                continue
+            due = next_runs[name]
+            if due is not None and due > now:
+                continue
+
+            def claim(connection, name=name, due=due, next_run=cron.next_after(now)):
+                # Only one node moves next_run_at on; it queues the run
+                moved = connection.execute(leases.update()
+                                           .where(leases.c.name == name,
+                                                  leases.c.next_run_at.is_(None) if due is None
+                                                  else leases.c.next_run_at <= now)
+                                           .values(next_run_at=next_run)).rowcount
+                # A newly scheduled job waits for its first slot
+                if not moved or due is None:
+                    return
+                active = connection.execute(select(runs.c.id).where(
+                    runs.c.name == name, runs.c.status.in_((QUEUED, RUNNING)))).first()
+                if active is None:
+                    connection.execute(runs.insert().values(name=name, trigger='schedule', status=QUEUED,
+                                                            enqueued_at=now))
+
+            write_queue.run(claim)
+
+    def _ensure_leases(self, now):
+        # Every job needs its lease row before it can be scheduled or claimed
+        if self._leases_created:
+            return
+        from models import JobLease
+        from sqlite_mode import write_queue
+
+        leases = JobLease.__table__
+
+        def create(connection):
+            existing = set(connection.execute(select(leases.c.name)).scalars())
+            missing = [{'name': name, 'next_run_at': cron.next_after(now) if cron else None}
+                       for name, cron in self.schedules.items() if name not in existing]
+            if HEARTBEAT not in existing:
+                missing.append({'name': HEARTBEAT, 'next_run_at': None})
+            if missing:
+                connection.execute(leases.insert(), missing)
+
+        try:
+            write_queue.run(create)
+        except IntegrityError:
+            return  # another node got there first; the next round finds its rows
+        self._leases_created = True
+
+    # Liveness
+
+    def beat(self, now):
+        """Record that a scheduler polled; it counts as alive for one lease period"""
+        from models import JobLease
+        from sqlite_mode import write_queue
+
+        leases = JobLease.__table__
+        statement = leases.update().where(leases.c.name == HEARTBEAT)\
+            .values(owner=self.owner, expires_at=now + self.lease)
+        write_queue.run(lambda connection: connection.execute(statement))
+
+    def alive(self, now=None):
+        """Whether any scheduler (a web worker's or flask run-jobs) polled within a lease period"""
+        from models import JobLease
+
+        now = now or datetime.utcnow()
+        leases = JobLease.__table__
+        with db.engine.connect() as conn:
+            expires_at = conn.execute(select(leases.c.expires_at).where(leases.c.name == HEARTBEAT)).scalar()
+        return expires_at is not None and expires_at >= now
+
+    # Running
+
+    def renew(self, now):
+        from models import JobLease
+        from sqlite_mode import write_queue
+
+        if not self._running:
+            return
+        leases = JobLease.__table__
+        statement = leases.update().where(leases.c.owner == self.owner).values(expires_at=now + self.lease)
+        write_queue.run(lambda connection: connection.execute(statement))
+
+    def fail_abandoned(self, now):
+        """Mark runs failed whose worker no longer holds the job's lease"""
+        from models import JobLease, JobRun
+        from sqlite_mode import write_queue
+
+        leases, runs = JobLease.__table__, JobRun.__table__
+        abandoned = select(runs.c.id)\
+            .select_from(runs.outerjoin(leases, leases.c.name == runs.c.name))\
+            .where(runs.c.status == RUNNING,
+                   or_(leases.c.owner.is_(None), leases.c.owner != runs.c.owner, leases.c.expires_at < now))
+        with db.engine.connect() as conn:
+            ids = list(conn.execute(abandoned).scalars())
+        if ids:
+            statement = runs.update().where(runs.c.id.in_(ids), runs.c.status == RUNNING)\
+                .values(status=FAILED, finished_at=now, error='The worker stopped before the run finished')
+            write_queue.run(lambda connection: connection.execute(statement))
+            logger.warning(f"Job runs {ids} were abandoned by their worker")
+
+    def start_queued(self, now):
+        from models import JobRun
+
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        runs = JobRun.__table__
+        with db.engine.connect() as conn:
+            queued = conn.execute(select(runs.c.id, runs.c.name).where(runs.c.status == QUEUED)
+                                  .order_by(runs.c.id).limit(50)).all()
+        for run_id, name in queued:
+            # Runs of jobs this code doesn't know are left to the nodes that do
+            if free > 0 and name in registry and name not in self._running.values() and self._claim(run_id, name, now):
+                self._running[run_id] = name
+                free -= 1
+                self._executor.submit(self._run_in_thread, run_id, name)
+
+    def _claim(self, run_id, name, now):
+        """Take the job's lease and mark the run running, or neither"""
+        from models import JobLease, JobRun
+        from sqlite_mode import write_queue
+
+        leases, runs = JobLease.__table__, JobRun.__table__
+
+        def claim(connection):
+            taken = connection.execute(leases.update()
+                                       .where(leases.c.name == name,
+                                              or_(leases.c.owner.is_(None), leases.c.expires_at < now))
+                                       .values(owner=self.owner, expires_at=now + self.lease)).rowcount
+            if not taken:
+                return False
+            started = connection.execute(runs.update().where(runs.c.id == run_id, runs.c.status == QUEUED)
+                                         .values(status=RUNNING, owner=self.owner, started_at=now)).rowcount
+            if not started:
+                connection.execute(leases.update().where(leases.c.name == name).values(owner=None, expires_at=None))
+            return bool(started)
+
+        return write_queue.run(claim)
+
+    def _run_in_thread(self, run_id, name):
+        try:
+            with self.app.app_context():
+                self._execute(run_id, name)
+        finally:
+            self._running.pop(run_id, None)
+            self._wake.set()
+
+    def _execute(self, run_id, name):
+        from models import JobLease, JobRun
+        from sqlite_mode import write_queue
+
+        progress = Progress(run_id)
+        started = time.perf_counter()
+        rows, error = None, None
+        try:
+            rows = registry[name].func(progress)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(f"Job {name} (run {run_id}) failed")
+            error = f'{type(e).__name__}: {e}'
+        finally:
+            db.session.remove()
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        leases, runs = JobLease.__table__, JobRun.__table__
+
+        def finish(connection):
+            connection.execute(runs.update().where(runs.c.id == run_id).values(
+                status=FAILED if error else SUCCEEDED, finished_at=datetime.utcnow(), duration_ms=duration_ms,
+                rows=rows if isinstance(rows, int) else None, error=error,
+                progress=progress.done, total=progress.total, message=progress.message))
+            connection.execute(leases.update().where(leases.c.name == name, leases.c.owner == self.owner)
+                               .values(owner=None, expires_at=None))
+
+        write_queue.run(finish)
+        return error
+
+    def run_now(self, name, trigger='cli'):
+        """Queue job `name` and run it in this thread; returns the run id and its error (None on success)"""
+        run_id = self.enqueue(name, trigger)
+        if not self._claim(run_id, name, datetime.utcnow()):
+            raise JobBusy(f'{name} is already running')
+        self._running[run_id] = name
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(stop,), name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            return run_id, self._execute(run_id, name)
+        finally:
+            stop.set()
+            self._running.pop(run_id, None)
+
+    def _heartbeat(self, stop):
+        # Without the scheduler thread (flask run-job) something else must renew the lease
+        while not stop.wait(self.poll_interval):
+            with self.app.app_context():
+                self.renew(datetime.utcnow())
+
+    def run_forever(self):
+        """The scheduler loop in the foreground, for a dedicated process (flask run-jobs)"""
+        self.enabled = True
+        self.start()
+        self._scheduler.join()
+
+scheduler = Scheduler()
+
+# Jobs
+
+@job('update-tag-counts', '7 * * * *')
+def update_tag_counts(progress):
+    """Recount the approved groups of every tag"""
+    from utils import update_tag_usage_counts
+
+    return update_tag_usage_counts()
+
+@job('cleanup-unused-tags')
+def cleanup_unused_tags(progress):
+    """Delete tags that no group uses"""
+    from models import Tag
+    from templating import card_cache
+
+    unused = Tag.query.filter(~Tag.groups.any()).all()
+    for done, tag in enumerate(unused, 1):
+        db.session.delete(tag)
+        progress(done, len(unused))
+    db.session.commit()
+    card_cache.clear()
+    return len(unused)
+
+@job('seed-data')
+def seed_data(progress):
+    """Create the default categories, countries and languages"""
+    from utils import seed_default_data
+
+    seed_default_data()
+
+@job('compute-rankings', '*/15 * * * *')
+def compute_rankings(progress):
+    """Rebuild trending and popularity scores"""
+    import ranking
+
+    return ranking.compute_rankings()['group']
+
+@job('refresh-images', '20 * * * *')
+def refresh_images(progress):
+    """Fetch missing group thumbnails and retry failed ones"""
+    from images import image_pipeline
+
+    attempted, stored = image_pipeline.refresh(int(os.environ.get('IMAGE_REFRESH_LIMIT', 500)))
+    progress(attempted, attempted, f'{stored} of {attempted} stored')
+    return stored
+
+@job('verify-links', '40 * * * *')
+def verify_links(progress):
+    """Re-check the invite links of approved groups, least recently checked first"""
+    from models import WhatsAppGroup, LinkCheck
+    from sqlite_mode import write_queue
+    from whatsapp_api import verify_invite_link
+
+    batch = int(os.environ.get('LINK_CHECK_BATCH', 200))
+    dead_after = int(os.environ.get('LINK_DEAD_AFTER', 3))
+    groups = db.session.query(WhatsAppGroup.id, WhatsAppGroup.invite_link)\
+        .outerjoin(LinkCheck, LinkCheck.group_id == WhatsAppGroup.id)\
+        .filter(WhatsAppGroup.status == 'approved')\
+        .order_by(LinkCheck.checked_at.isnot(None), LinkCheck.checked_at, WhatsAppGroup.id)\
+        .limit(batch).all()
+    db.session.remove()  # nothing to hold open during minutes of HTTP
+
+    valid = {}
+    with ThreadPoolExecutor(int(os.environ.get('LINK_CHECK_THREADS', 8))) as pool:
+        for done, (group_id, ok) in enumerate(zip((group_id for group_id, _ in groups),
+                                                  pool.map(verify_invite_link, (link for _, link in groups))), 1):
+            valid[group_id] = ok
+            progress(done, len(groups), f'{done - sum(valid.values())} failed')
+    # Our network being down says nothing about the links
+    if len(valid) >= 10 and not any(valid.values()):
+        raise RuntimeError(f'All {len(valid)} link checks failed; nothing recorded')
+
+    now = datetime.utcnow()
+    checks, group_table = LinkCheck.__table__, WhatsAppGroup.__table__
+
+    def record(connection):
+        existing = set(connection.execute(select(checks.c.group_id)
+                                          .where(checks.c.group_id.in_(list(valid)))).scalars())
+        new = [{'group_id': group_id, 'failures': 0} for group_id in valid if group_id not in existing]
+        if new:
+            connection.execute(checks.insert(), new)
+        verified = [group_id for group_id, ok in valid.items() if ok]
+        failed = [group_id for group_id, ok in valid.items() if not ok]
+        if verified:
+            connection.execute(checks.update().where(checks.c.group_id.in_(verified))
+                               .values(checked_at=now, failures=0, dead_since=None))
+            # Keep updated_at: a verification doesn't change what the group's pages show
+            connection.execute(group_table.update().where(group_table.c.id.in_(verified))
+                               .values(last_verified=now, updated_at=group_table.c.updated_at))
+        if failed:
+            connection.execute(checks.update().where(checks.c.group_id.in_(failed)).values(
+                checked_at=now, failures=checks.c.failures + 1,
+                dead_since=case((checks.c.dead_since.isnot(None), checks.c.dead_since),
+                                (checks.c.failures + 1 >= dead_after, now), else_=None)))
+        return connection.execute(select(func.count()).select_from(checks)
+                                  .where(checks.c.dead_since.isnot(None))).scalar()
+
+    dead = write_queue.run(record)
+    progress.message = f'{len(valid) - sum(valid.values())} of {len(valid)} failed; {dead} links dead in all'
+    return len(valid)
+
+@job('archive-groups', '30 4 * * *')
+def archive_groups(progress):
+    """Move old rejected groups and dead ones to the archive"""
+    import archive
+
+    rejected, dead = archive.archive_groups(progress=progress)
+    progress.message = f'{rejected} rejected and {dead} dead groups archived'
+    return rejected + dead
+
+@job('prune-job-history', '50 3 * * *')
+def prune_job_history(progress):
+    """Delete finished runs older than JOB_HISTORY_DAYS"""
+    from models import JobRun
+    from sqlite_mode import write_queue
+
+    runs = JobRun.__table__
+    cutoff = datetime.utcnow() - timedelta(days=int(os.environ.get('JOB_HISTORY_DAYS', 30)))
+    statement = runs.delete().where(runs.c.status.in_((SUCCEEDED, FAILED)), runs.c.finished_at < cutoff)
+    return write_queue.run(lambda connection: connection.execute(statement).rowcount)
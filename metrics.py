@@ -0,0 +1,404 @@
+"""Prometheus metrics and health checks.
+
+``GET /metrics`` serves the Prometheus text format:
+
+* ``http_request_duration_seconds{endpoint,method}`` (histogram) and
+  ``http_requests_total{endpoint,method,status}``, status as ``2xx``...
+* ``db_pool_size``, ``db_pool_checked_out`` and ``db_pool_overflow`` per engine
+* ``cache_hits_total``, ``cache_misses_total`` and ``cache_hit_ratio`` per
+  cache (group cards, group slugs, principals, compressed responses)
+* ``whatsapp_api_call_duration_seconds{call}`` (histogram) and
+  ``whatsapp_api_errors_total{call,kind}``, kind ``exception`` or ``status``
+* ``moderation_queue_depth`` and ``moderation_queue_oldest_seconds``: pending
+  groups, counted at most every ``METRICS_DB_INTERVAL`` seconds (default 30)
+
+Each worker counts for itself. With ``METRICS_DIR`` set, workers also write
+their numbers to a file there every ``METRICS_FLUSH_INTERVAL`` seconds
+(default 5) and a scrape adds up the files, so whichever worker answers
+speaks for the whole server; gauges keep a ``pid`` label and are dropped
+for workers that stopped writing. Set ``METRICS_TOKEN`` to require
+``Authorization: Bearer <token>``; without one only loopback and private
+addresses get an answer, checked for the connecting peer and for every
+address in ``X-Forwarded-For``/``X-Real-IP``, so a public client behind
+nginx is refused too.
+
+``/healthz`` answers as long as the worker serves requests; ``/readyz`` also
+runs ``SELECT 1`` on the primary (at most once a second per worker) and
+answers 503 while that fails, so a load balancer can route around it.
+"""
+import functools
+import glob
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, g, jsonify, request
+from sqlalchemy import func, select, text
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metric types
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self.values[labels] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+class Histogram:
+    """Per label set: the count in each bucket (plus one above the last) and the sum"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(entry)] for labels, entry in self.values.items()]
+
+class Collected:
+    """Read when collected: `collect()` returns {labels: value}, for numbers kept elsewhere"""
+
+    def __init__(self, kind, name, help, labels=(), collect=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def snapshot(self):
+        return [[list(labels), value] for labels, value in self.collect().items()]
+
+# Rendering
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def number(value):
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+def render(metric, samples):
+    lines = [f'# HELP {metric.name} {metric.help}', f'# TYPE {metric.name} {metric.kind}']
+    for labels, value in sorted(samples, key=lambda sample: sample[0]):
+        names = metric.labels + (('pid',) if len(labels) > len(metric.labels) else ())
+        if metric.kind != 'histogram':
+            lines.append(f'{metric.name}{label_text(names, labels)} {number(value)}')
+            continue
+        cumulative = 0
+        for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+            cumulative += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append(f'{metric.name}_bucket{label_text(names, labels, [("le", le)])} {cumulative}')
+        lines.append(f'{metric.name}_sum{label_text(names, labels)} {number(value[-1])}')
+        lines.append(f'{metric.name}_count{label_text(names, labels)} {cumulative}')
+    return lines
+
+def merge(metric, snapshots):
+    """One list of samples from several workers' snapshots [(pid, samples)]"""
+    if metric.kind == 'gauge':
+        return [[labels + [pid], value] for pid, samples in snapshots for labels, value in samples]
+    merged = {}
+    for _, samples in snapshots:
+        for labels, value in samples:
+            key = tuple(labels)
+            if metric.kind == 'counter':
+                merged[key] = merged.get(key, 0.0) + value
+            elif key in merged and len(merged[key]) == len(value):
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] = list(value)
+    return [[list(labels), value] for labels, value in merged.items()]
+
+# The registry
+
+class Metrics:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.directory = None
+        self.flush_interval = 5.0
+        self.db_interval = 30.0
+        self.token = None
+        self.local = []    # per worker; merged across workers with METRICS_DIR
+        self.shared = []   # the same from any worker (database counts)
+        self._writer = ProcessThread('metrics-writer', self._write_loop, setup=self._make_directory)
+
+        self.request_duration = self.add(Histogram(
+            'http_request_duration_seconds', 'Time to handle a request, up to the response leaving the app',
+            ('endpoint', 'method')))
+        self.requests = self.add(Counter(
+            'http_requests_total', 'Requests handled', ('endpoint', 'method', 'status')))
+        self.api_duration = self.add(Histogram(
+            'whatsapp_api_call_duration_seconds', 'Outbound calls to WhatsApp pages and images', ('call',),
+            buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+        self.api_errors = self.add(Counter(
+            'whatsapp_api_errors_total', 'Outbound calls that raised (exception) or got a non-200 (status)',
+            ('call', 'kind')))
+        for name, help in (('db_pool_size', 'Connections the pool keeps'),
+                           ('db_pool_checked_out', 'Connections in use'),
+                           ('db_pool_overflow', 'Connections open beyond the pool size')):
+            self.add(Collected('gauge', name, help, ('engine',), functools.partial(pool_gauge, name)))
+        self.add(Collected('counter', 'cache_hits_total', 'Cache lookups answered from memory', ('cache',),
+                           lambda: cache_counts(0)))
+        self.add(Collected('counter', 'cache_misses_total', 'Cache lookups that had to compute or query',
+                           ('cache',), lambda: cache_counts(1)))
+        self.add(Collected('gauge', 'moderation_queue_depth', 'Groups waiting for approval', (),
+                           lambda: {(): self.moderation()[0]}), shared=True)
+        self.add(Collected('gauge', 'moderation_queue_oldest_seconds',
+                           'Age of the oldest group waiting for approval', (),
+                           lambda: {(): self.moderation()[1]}), shared=True)
+        self._moderation = (0, 0.0, 0.0)  # depth, oldest age, read at
+
+    def add(self, metric, shared=False):
+        (self.shared if shared else self.local).append(metric)
+        return metric
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('METRICS_ENABLED', '1') == '1'
+        self.directory = os.environ.get('METRICS_DIR') or None
+        self.flush_interval = float(os.environ.get('METRICS_FLUSH_INTERVAL', self.flush_interval))
+        self.db_interval = float(os.environ.get('METRICS_DB_INTERVAL', self.db_interval))
+        self.token = os.environ.get('METRICS_TOKEN') or None
+        app.extensions['metrics'] = self
+        app.register_blueprint(ops)
+        if self.enabled:
+            app.before_request(self.start_request)
+            app.after_request(self.finish_request)
+
+    # Requests
+
+    def start_request(self):
+        g.metrics_started = time.perf_counter()
+        if self.directory:
+            self._writer.ensure()
+
+    def finish_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.url_rule.endpoint if request.url_rule is not None else 'unmatched'
+            self.request_duration.observe(time.perf_counter() - started, endpoint, request.method)
+            self.requests.inc(endpoint, request.method, f'{response.status_code // 100}xx')
+        return response
+
+    def timed(self, func):
+        """Decorator: time calls of `func` in whatsapp_api_call_duration_seconds"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.api_duration.observe(time.perf_counter() - started, func.__name__)
+        return wrapper
+
+    def api_error(self, call, kind):
+        self.api_errors.inc(call, kind)
+
+    # Database gauges
+
+    def moderation(self):
+        from models import WhatsAppGroup
+
+        depth, oldest, read_at = self._moderation
+        if time.monotonic() - read_at >= self.db_interval:
+            depth, first = db.session.execute(
+                select(func.count(), func.min(WhatsAppGroup.created_at))
+                .where(WhatsAppGroup.status == 'pending')).one()
+            oldest = (datetime.utcnow() - first).total_seconds() if first else 0.0
+            self._moderation = (depth, oldest, time.monotonic())
+        return depth, oldest
+
+    # Cross-worker files
+
+    def _make_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self.app.app_context():
+                    self.write()
+            except Exception as e:
+                logger.error(f"Writing metrics failed: {e}")
+
+    def write(self):
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as fh:
+            json.dump({metric.name: metric.snapshot() for metric in self.local}, fh, separators=(',', ':'))
+        os.replace(temporary, path)
+
+    def collect(self):
+        """{metric name: samples} for this worker, or for every worker writing to METRICS_DIR"""
+        if not self.directory:
+            return {metric.name: metric.snapshot() for metric in self.local + self.shared}
+        self.write()
+        fresh_after = time.time() - 3 * self.flush_interval
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as fh:
+                    data = json.load(fh)
+                fresh = os.path.getmtime(path) >= fresh_after
+            except (OSError, ValueError):
+                continue  # a worker replacing its file
+            snapshots.append((os.path.basename(path)[8:-5], data, fresh))
+        samples = {}
+        for metric in self.local:
+            # Counts of stopped workers still add up; their gauges don't
+            usable = [(pid, data.get(metric.name, [])) for pid, data, fresh in snapshots
+                      if fresh or metric.kind != 'gauge']
+            samples[metric.name] = merge(metric, usable)
+        for metric in self.shared:
+            samples[metric.name] = metric.snapshot()
+        return samples
+
+    def exposition(self):
+        samples = self.collect()
+        lines = []
+        for metric in self.local + self.shared:
+            lines.extend(render(metric, samples[metric.name]))
+        # Hit ratios from the merged counts
+        hits = {tuple(labels): value for labels, value in samples['cache_hits_total']}
+        misses = {tuple(labels): value for labels, value in samples['cache_misses_total']}
+        ratio = Collected('gauge', 'cache_hit_ratio', 'Hits over lookups since the workers started', ('cache',))
+        lines.extend(render(ratio, [[list(labels), hits[labels] / (hits[labels] + misses.get(labels, 0))]
+                                    for labels in hits if hits[labels] + misses.get(labels, 0)]))
+        return '\n'.join(lines) + '\n'
+
+POOL_COUNTS = {
+    'db_pool_size': lambda pool: pool.size(),
+    'db_pool_checked_out': lambda pool: pool.checkedout(),
+    # Counts up from -size while the pool fills
+    'db_pool_overflow': lambda pool: max(0, pool.overflow()),
+}
+
+def pool_gauge(name):
+    # StaticPool and friends (SQLite) don't count
+    return {(key or 'primary',): POOL_COUNTS[name](engine.pool)
+            for key, engine in db.engines.items() if hasattr(engine.pool, 'checkedout')}
+
+def cache_counts(index):
+    """{(cache,): hits} or misses, from the caches' own counters"""
+    from templating import card_cache
+    from slugs import slug_resolver
+    from principals import principal_cache
+    from compression import compressor
+
+    counts = {'group_cards': (card_cache.hits, card_cache.misses),
+              'group_slugs': (slug_resolver.hits, slug_resolver.misses),
+              'principals': (principal_cache.hits, principal_cache.misses),
+              'compressed_responses': (compressor.cache.hits, compressor.cache.misses)}
+    return {(cache,): values[index] for cache, values in counts.items()}
+
+metrics = Metrics()
+
+# Endpoints
+
+ops = Blueprint('ops', __name__)
+
+class Readiness:
+    """The result of the last database check, at most a second old"""
+
+    interval = 1.0
+
+    def __init__(self):
+        self.result = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.result is not None and time.monotonic() - self.checked_at < self.interval:
+            return self.result
+        with self._lock:
+            if self.result is None or time.monotonic() - self.checked_at >= self.interval:
+                started = time.perf_counter()
+                try:
+                    with db.engine.connect() as conn:
+                        conn.execute(text('SELECT 1'))
+                    self.result = (True, {'database_ms': round((time.perf_counter() - started) * 1000, 2)})
+                except Exception as e:
+                    logger.error(f"Readiness check failed: {e}")
+                    self.result = (False, {'database': 'unavailable'})
+                self.checked_at = time.monotonic()
+        return self.result
+
+readiness = Readiness()
+
+@ops.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+@ops.route('/readyz')
+def readyz():
+    ok, detail = readiness.check()
+    return jsonify(status='ok' if ok else 'unavailable', **detail), 200 if ok else 503
+
+def private_client():
+    """Whether the request and every proxy hop it passed come from loopback or a private network"""
+    addresses = [request.remote_addr or '']
+    for header in ('X-Forwarded-For', 'X-Real-IP'):
+        addresses += [address.strip() for address in request.headers.get(header, '').split(',') if address.strip()]
+    for address in addresses:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        if not (ip.is_loopback or ip.is_private):
+            return False
+    return True
+
+@ops.route('/metrics')
+def metrics_endpoint():
+    if metrics.token:
+        if request.headers.get('Authorization') != f'Bearer {metrics.token}':
+            abort(403)
+    elif not private_client():
+        abort(403)
+    return Response(metrics.exposition(), content_type=CONTENT_TYPE)
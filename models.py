@@ -3,7 +3,8 @@ from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Foreign
 from sqlalchemy.orm import relationship, backref
 from flask_login import UserMixin
 from datetime import datetime
-from slugify import slugify
+from principals import password_version, session_id
+from slugs import slugify
 import uuid
 
 # Association tables for many-to-many relationships
@@ -19,6 +20,10 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256))
     is_admin = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def get_id(self):
+        # Versioned, so a password change ends other sessions (see principals.py)
+        return session_id(self.id, password_version(self.password_hash))
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -81,7 +86,8 @@ class WhatsAppGroup(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     slug = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
+    # Text columns are loaded on access: listings use read models (readmodels.py)
+    description = db.deferred(db.Column(db.Text), group='text')
     invite_link = db.Column(db.String(500), nullable=False, unique=True)
     invite_code = db.Column(db.String(100), nullable=False, unique=True)
     image_url = db.Column(db.String(500))
@@ -95,11 +101,11 @@ class WhatsAppGroup(db.Model):
     # Status and moderation
     status = db.Column(db.String(20), default='pending')  # pending, approved, rejected
     featured = db.Column(db.Boolean, default=False)
-    admin_notes = db.Column(db.Text)
+    admin_notes = db.deferred(db.Column(db.Text), group='text')
     
     # SEO and metadata
     meta_title = db.Column(db.String(200))
-    meta_description = db.Column(db.Text)
+    meta_description = db.deferred(db.Column(db.Text), group='text')
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -109,6 +115,16 @@ class WhatsAppGroup(db.Model):
     # Relationships
     tags = db.relationship('Tag', secondary=group_tags, lazy='subquery',
                           backref=db.backref('groups', lazy=True))
+    image = db.relationship('GroupImage', uselist=False, lazy='joined', cascade='all, delete-orphan')
+    
+    # Facet index sync reads rows changed since its last pass; detail URLs
+    # look groups up by slug. AUTOINCREMENT so SQLite never hands an archived
+    # group's id to a new one (flask migrate-group-ids for older databases).
+    __table_args__ = (
+        db.Index('ix_whatsapp_group_updated_at', 'updated_at'),
+        db.Index('uq_whatsapp_group_slug', 'slug', unique=True),
+        {'sqlite_autoincrement': True},
+    )
     
     def __init__(self, name, invite_link, category_id, country_id, language_id, description=None):
         self.name = name
@@ -139,30 +155,139 @@ class WhatsAppGroup(db.Model):
             self.meta_description = f"Join {self.name} WhatsApp group. Connect with like-minded people and engage in interesting conversations."
     
     def get_related_groups(self, limit=6):
-        """Get related groups based on tags and category"""
+        """Get related groups based on tags and category, as GroupCards"""
+        from readmodels import group_cards
+
         if not self.tags:
             # If no tags, return groups from same category
-            return WhatsAppGroup.query.filter(
+            related = db.session.query(WhatsAppGroup.id).filter(
                 WhatsAppGroup.category_id == self.category_id,
                 WhatsAppGroup.id != self.id,
                 WhatsAppGroup.status == 'approved'
-            ).limit(limit).all()
+            ).limit(limit)
+            return group_cards([group_id for group_id, in related])
         
         # Get groups that share tags
         tag_ids = [tag.id for tag in self.tags]
-        related = db.session.query(WhatsAppGroup).join(group_tags).filter(
+        related = db.session.query(WhatsAppGroup.id).join(group_tags).filter(
             group_tags.c.tag_id.in_(tag_ids),
             WhatsAppGroup.id != self.id,
             WhatsAppGroup.status == 'approved'
-        ).distinct().limit(limit).all()
+        ).distinct().limit(limit)
         
-        return related
+        return group_cards([group_id for group_id, in related])
+
+class GroupStat(db.Model):
+    """Hourly and daily view/join counters per group (written in batches by analytics.py)"""
+    __tablename__ = 'group_stat'
+    group_id = db.Column(db.Integer, db.ForeignKey('whatsapp_group.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(5), primary_key=True)  # hour, day
+    bucket = db.Column(db.DateTime, primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    joins = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_group_stat_granularity_bucket', 'granularity', 'bucket'),
+    )
+
+class RankScore(db.Model):
+    """Materialized popularity scores, rebuilt periodically by ranking.py"""
+    __tablename__ = 'rank_score'
+    entity_type = db.Column(db.String(10), primary_key=True)  # group, category, tag
+    entity_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0.0)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_rank_score_type_score', 'entity_type', 'score'),
+    )
+
+class GroupImage(db.Model):
+    """Locally stored thumbnails of a group's image (written by images.py)"""
+    __tablename__ = 'group_image'
+    group_id = db.Column(db.Integer, db.ForeignKey('whatsapp_group.id', ondelete='CASCADE'), primary_key=True)
+    digest = db.Column(db.String(40))  # sha1 of the source image; null until one download succeeds
+    source_url = db.Column(db.String(500))
+    fetched_at = db.Column(db.DateTime)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, index=True)  # set while failing, null once stored
+
+class CacheInvalidation(db.Model):
+    """Changed entities, polled by the other workers to drop cached copies (see invalidation.py)"""
+    __tablename__ = 'cache_invalidation'
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(40), nullable=False)  # publishing worker
+    topic = db.Column(db.String(20), nullable=False)   # group, category, ..., user
+    entity_id = db.Column(db.Integer)
+    op = db.Column(db.String(6))                        # new, update, delete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class JobLease(db.Model):
+    """One row per background job: its next scheduled run and who holds it (see jobs.py)"""
+    __tablename__ = 'job_lease'
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(60))        # worker running it, null when idle
+    expires_at = db.Column(db.DateTime)     # renewed while it runs; past means the worker died
+    next_run_at = db.Column(db.DateTime)    # null for jobs without a schedule
+
+class JobRun(db.Model):
+    """A queued, running or finished run of a background job"""
+    __tablename__ = 'job_run'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, index=True)
+    trigger = db.Column(db.String(10), nullable=False)   # schedule, admin, cli
+    status = db.Column(db.String(10), nullable=False, index=True)  # queued, running, succeeded, failed
+    owner = db.Column(db.String(60))
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Float)
+    rows = db.Column(db.Integer)            # rows affected, as the job reports them
+    progress = db.Column(db.Integer)
+    total = db.Column(db.Integer)
+    message = db.Column(db.String(200))
+    error = db.Column(db.Text)
+
+class LinkCheck(db.Model):
+    """Last re-verification of a group's invite link (the verify-links job)"""
+    __tablename__ = 'link_check'
+    group_id = db.Column(db.Integer, db.ForeignKey('whatsapp_group.id', ondelete='CASCADE'), primary_key=True)
+    checked_at = db.Column(db.DateTime, index=True)
+    failures = db.Column(db.Integer, nullable=False, default=0)  # consecutive
+    dead_since = db.Column(db.DateTime, index=True)  # set after LINK_DEAD_AFTER failures, cleared by a success
+
+class ArchivedGroup(db.Model):
+    """A rejected or dead group moved out of whatsapp_group (see archive.py)"""
+    __tablename__ = 'archived_group'
+    id = db.Column(db.Integer, primary_key=True)
+    # The group's id, never handed to another group; restore puts it back under it
+    group_id = db.Column(db.Integer, nullable=False, index=True)
+    name = db.Column(db.String(200), nullable=False)
+    invite_code = db.Column(db.String(100), nullable=False, unique=True)  # blocks resubmission
+    status = db.Column(db.String(20), nullable=False)   # when archived
+    reason = db.Column(db.String(10), nullable=False)   # rejected, dead
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    data = db.Column(db.Text, nullable=False)           # every other column and the tag ids, as JSON
+
+class SlugHistory(db.Model):
+    """Slugs an entity used to have, so old URLs can 301 to the current one (see slugs.py)"""
+    __tablename__ = 'slug_history'
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # category, country, language, tag, page, post, group
+    old_slug = db.Column(db.String(200), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('entity_type', 'old_slug', name='uq_slug_history_type_slug'),
+    )
 
 class Page(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     slug = db.Column(db.String(200), nullable=False, unique=True)
-    content = db.Column(db.Text)
+    content = db.deferred(db.Column(db.Text))
     meta_title = db.Column(db.String(200))
     meta_description = db.Column(db.Text)
     is_published = db.Column(db.Boolean, default=True)
@@ -171,26 +296,14 @@ class Page(db.Model):
     
     def __init__(self, title, content=None):
         self.title = title
-        self.slug = self._generate_unique_slug(title)
+        self.slug = slugify(title)
         self.content = content
-    
-    def _generate_unique_slug(self, title):
-        """Generate a unique slug for the page"""
-        base_slug = slugify(title)
-        slug = base_slug
-        counter = 1
-        
-        while Page.query.filter_by(slug=slug).first():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        
-        return slug
 
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     slug = db.Column(db.String(200), nullable=False, unique=True)
-    content = db.Column(db.Text)
+    content = db.deferred(db.Column(db.Text))
     excerpt = db.Column(db.Text)
     featured_image = db.Column(db.String(500))
     meta_title = db.Column(db.String(200))
@@ -201,20 +314,8 @@ class Post(db.Model):
     
     def __init__(self, title, content=None):
         self.title = title
-        self.slug = self._generate_unique_slug(title)
+        self.slug = slugify(title)
         self.content = content
-    
-    def _generate_unique_slug(self, title):
-        """Generate a unique slug for the post"""
-        base_slug = slugify(title)
-        slug = base_slug
-        counter = 1
-        
-        while Post.query.filter_by(slug=slug).first():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        
-        return slug
 
 class SiteSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,110 @@
+"""Site-wide notification banners, scheduled in memory.
+
+A notification shows while it is active and the current time is inside its
+optional ``start_date``/``end_date`` window (naive UTC, like every other
+timestamp here). The schedule keeps the active notifications' windows in
+memory with the sorted list of their start/end boundaries, and recomputes
+the visible set only when the clock passes the next boundary, so a request
+costs one comparison.
+
+Notification commits reload it immediately, in other workers through the
+invalidation bus; without one they are picked up within
+``NOTIFICATION_REFRESH_INTERVAL`` seconds (default 600). ``active_notifications()`` is the one lookup per request that the
+index view and the global template context share.
+"""
+import bisect
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import g
+from sqlalchemy import event, select
+
+from app import db
+from invalidation import invalidation_bus
+
+# Immutable copy of a row, safe to share between request threads
+Banner = namedtuple('Banner', 'id title message notification_type start_date end_date')
+
+class NotificationSchedule:
+    def __init__(self):
+        self.refresh_interval = 600.0
+        self.banners = ()       # active rows, ordered by start
+        self.boundaries = []    # sorted start/end datetimes
+        self.visible = ()
+        self.valid_until = datetime.min  # next boundary or reload, whichever is sooner
+        self.reload_at = datetime.min
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.refresh_interval = float(os.environ.get('NOTIFICATION_REFRESH_INTERVAL', self.refresh_interval))
+        app.extensions['notifications'] = self
+        invalidation_bus.subscribe(('notification',), self._on_invalidation)
+        if not event.contains(db.session, 'after_flush', self._after_flush):
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def current(self, now=None):
+        """Notifications to show at `now`"""
+        now = now or datetime.utcnow()
+        if now < self.valid_until:
+            return self.visible
+        with self._lock:
+            if now >= self.reload_at:
+                self.load(now)
+            if now >= self.valid_until:
+                self._recompute(now)
+            return self.visible
+
+    def load(self, now):
+        from models import Notification
+
+        # Straight from the primary: a replica may not have an edit that just
+        # invalidated the schedule
+        columns = [getattr(Notification, field) for field in Banner._fields]
+        query = select(*columns).where(Notification.is_active.is_(True))\
+            .order_by(Notification.start_date, Notification.id)
+        with db.engine.connect() as connection:
+            self.banners = tuple(Banner(*row) for row in connection.execute(query))
+        self.boundaries = sorted({d for b in self.banners for d in (b.start_date, b.end_date) if d})
+        self.reload_at = now + timedelta(seconds=self.refresh_interval)
+        self.valid_until = now
+
+    def _recompute(self, now):
+        self.visible = tuple(b for b in self.banners
+                             if (b.start_date is None or b.start_date <= now)
+                             and (b.end_date is None or now < b.end_date))
+        index = bisect.bisect_right(self.boundaries, now)
+        next_boundary = self.boundaries[index] if index < len(self.boundaries) else datetime.max
+        self.valid_until = min(next_boundary, self.reload_at)
+
+    def invalidate(self):
+        self.reload_at = self.valid_until = datetime.min
+
+    def _on_invalidation(self, topic, entity_id, op):
+        self.invalidate()
+
+    # Session events
+
+    def _after_flush(self, session, flush_context):
+        from models import Notification
+
+        if any(isinstance(obj, Notification) for obj in (*session.new, *session.dirty, *session.deleted)):
+            session.info['notifications_changed'] = True
+
+    def _after_commit(self, session):
+        if session.info.pop('notifications_changed', False):
+            self.invalidate()
+
+    def _after_rollback(self, session):
+        session.info.pop('notifications_changed', None)
+
+def active_notifications():
+    """This request's notifications, looked up once"""
+    if 'notifications' not in g:
+        g.notifications = notification_schedule.current()
+    return g.notifications
+
+notification_schedule = NotificationSchedule()
@@ -0,0 +1,285 @@
+"""Static pre-rendering of the public site, for nginx ``try_files`` or a CDN.
+
+Public pages only change when an admin edits or moderates something, so
+``flask prerender`` renders them through the normal views into static files
+under ``PRERENDER_PATH`` (default ``build/site``): ``/category/music`` becomes
+``category/music/index.html``, next to a ``.gz`` (and ``.br`` with brotli
+installed) for nginx's ``gzip_static``. Rendering runs in a pool of
+``PRERENDER_WORKERS`` processes (default: one per core), each with its own
+app and database connections.
+
+Every page has a version: a hash of what it shows (the group's
+``updated_at``, a listing's approved count/latest update/id sum, a post's
+``updated_at``) and of the layout every page shares (site settings, the
+taxonomy in the navigation, visible notification banners). ``manifest.json``
+maps each rendered path to its version; a build renders only the paths
+whose version changed, deletes files for pages that are gone and writes the
+paths it touched to ``changes.txt`` for CDN purges. A summary of the
+database kept in ``build.json`` (row counts and latest updates) lets a run
+with nothing to do exit after a few indexed queries, so the command can run
+from cron every minute.
+
+Renaming a category or scheduling a banner changes the layout and so every
+page. Listing pages are rendered for their first page; related groups on
+group pages refresh when that group changes, or with ``--full``. Paginated,
+filtered and search URLs, and anything for logged-in users or with a
+flashed message (a session cookie), stay dynamic: see the nginx snippet in
+the README.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import func, select
+
+from app import db
+from compression import brotli, brotli_compress, gzip_compress
+
+MANIFEST = 'manifest.json'
+STATE = 'build.json'
+CHANGES = 'changes.txt'
+USER_AGENT = 'GroupLeft-prerender bot'  # matches analytics.BOT_PATTERN: renders are not views
+
+def digest(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+def page_file(path):
+    """File under the build root that nginx serves for `path`"""
+    return os.path.join(path.strip('/'), 'index.html')
+
+def _rows(connection, statement):
+    return [tuple(row) for row in connection.execute(statement)]
+
+def layout_version(connection):
+    """What every page's header and footer show"""
+    from models import SiteSettings, Category, Country, Language
+    from notifications import notification_schedule
+
+    return digest(
+        _rows(connection, select(SiteSettings.__table__).order_by(SiteSettings.id)),
+        *(_rows(connection, select(model.__table__).order_by(model.id)) for model in (Category, Country, Language)),
+        [tuple(banner) for banner in notification_schedule.current()],
+    )
+
+def listing_aggregates(connection):
+    """{facet: {id: (approved count, latest update, id sum)}} for the taxonomy listing pages"""
+    from models import WhatsAppGroup, group_tags
+
+    groups = WhatsAppGroup.__table__
+    summary = (func.count(), func.max(groups.c.updated_at), func.sum(groups.c.id))
+    aggregates = {}
+    for facet in ('category', 'country', 'language'):
+        column = groups.c[f'{facet}_id']
+        aggregates[facet] = {row[0]: tuple(row[1:]) for row in connection.execute(
+            select(column, *summary).where(groups.c.status == 'approved').group_by(column))}
+    aggregates['tag'] = {row[0]: tuple(row[1:]) for row in connection.execute(
+        select(group_tags.c.tag_id, *summary)
+        .join(groups, groups.c.id == group_tags.c.group_id)
+        .where(groups.c.status == 'approved')
+        .group_by(group_tags.c.tag_id))}
+    return aggregates
+
+def ranking_version(connection):
+    """Changes with every compute-rankings run (the homepage's popular sections)"""
+    from models import RankScore
+
+    return tuple(connection.execute(select(func.count(), func.max(RankScore.computed_at))).one())
+
+def database_state(connection, layout):
+    """Changes whenever any page could have; cheap enough to check every minute.
+
+    Group edits, moderation and tag deletes all bump ``updated_at``, and
+    deletes change the count, so this covers the listings too.
+    """
+    from models import WhatsAppGroup, Post, Page
+
+    summaries = [tuple(connection.execute(select(func.count(), func.max(model.updated_at))).one())
+                 for model in (WhatsAppGroup, Post, Page)]
+    return digest(layout, summaries, ranking_version(connection))
+
+def page_versions(connection, layout, aggregates):
+    """{path: version} for every pre-rendered page"""
+    from models import WhatsAppGroup, Category, Country, Language, Tag, Post, Page
+
+    listings = sorted((facet, sorted(rows.items())) for facet, rows in aggregates.items())
+    versions = {
+        '/': digest(layout, listings, ranking_version(connection)),
+        '/categories': digest(layout, sorted(aggregates['category'].items())),
+        '/countries': digest(layout, sorted(aggregates['country'].items())),
+        '/languages': digest(layout, sorted(aggregates['language'].items())),
+        '/tags': digest(layout, sorted(aggregates['tag'].items())),
+    }
+
+    # Taxonomy listings (first page); empty ones still render
+    for facet, model, prefix in (('category', Category, '/category/'), ('country', Country, '/country/'),
+                                 ('language', Language, '/language/'), ('tag', Tag, '/tags/')):
+        for entity_id, slug in connection.execute(select(model.id, model.slug)):
+            versions[prefix + slug] = digest(layout, aggregates[facet].get(entity_id))
+
+    posts = _rows(connection, select(Post.slug, Post.updated_at).where(Post.is_published == True))  # noqa: E712
+    versions['/blog'] = digest(layout, sorted(posts, key=str))
+    for slug, updated_at in posts:
+        versions[f'/blog/{slug}'] = digest(layout, updated_at)
+    for slug, updated_at in connection.execute(select(Page.slug, Page.updated_at).where(Page.is_published == True)):  # noqa: E712
+        versions[f'/page/{slug}'] = digest(layout, updated_at)
+
+    # Group pages, streamed: this is the million-row part
+    groups = connection.execution_options(yield_per=10_000).execute(
+        select(WhatsAppGroup.slug, Category.slug, WhatsAppGroup.updated_at)
+        .join(Category, WhatsAppGroup.category_id == Category.id)
+        .where(WhatsAppGroup.status == 'approved'))
+    for group_slug, category_slug, updated_at in groups:
+        versions[f'/group/{category_slug}/{group_slug}'] = digest(layout, updated_at)
+    return versions
+
+# Rendering, in the pool processes
+
+_worker_app = None
+
+def _init_worker(config):
+    global _worker_app
+    from app import create_app
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_app = create_app(config)
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as fh:
+        fh.write(data)
+    os.replace(path + '.tmp', path)
+
+def render_pages(target, base_url, paths):
+    """Render `paths` into `target`; returns the ones written (the rest were not pages anymore)"""
+    client = _worker_app.test_client()
+    written = []
+    for path in paths:
+        response = client.get(path, base_url=base_url, headers={'User-Agent': USER_AGENT})
+        if response.status_code != 200 or response.mimetype != 'text/html':
+            continue
+        body = response.get_data()
+        filename = os.path.join(target, page_file(path))
+        _write(filename, body)
+        _write(filename + '.gz', gzip_compress(body, 9))
+        if brotli is not None:
+            _write(filename + '.br', brotli_compress(body, 9))
+        written.append(path)
+    return written
+
+def remove_page(target, path):
+    filename = os.path.join(target, page_file(path))
+    for name in (filename, filename + '.gz', filename + '.br'):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+# Building
+
+class BuildInProgress(Exception):
+    pass
+
+class Prerenderer:
+    def __init__(self):
+        self.app = None
+        self.target = 'build/site'
+        self.base_url = None
+        self.workers = os.cpu_count() or 1
+        self.chunk_size = 200
+
+    def init_app(self, app):
+        self.app = app
+        self.target = os.path.join(app.root_path, os.environ.get('PRERENDER_PATH', self.target))
+        self.base_url = os.environ.get('PRERENDER_BASE_URL', self.base_url)
+        self.workers = int(os.environ.get('PRERENDER_WORKERS', self.workers))
+        self.chunk_size = int(os.environ.get('PRERENDER_CHUNK_SIZE', self.chunk_size))
+        app.extensions['prerender'] = self
+
+    def build(self, full=False, target=None, base_url=None, workers=None):
+        """Bring the static files up to date; returns a dict of counts and timings"""
+        target = target or self.target
+        base_url = (base_url or self.base_url or '').rstrip('/')
+        if not base_url:
+            raise ValueError('PRERENDER_BASE_URL must be set to the public site URL')
+        os.makedirs(target, exist_ok=True)
+        with open(os.path.join(target, '.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise BuildInProgress(f'another build is writing to {target}')
+            return self._build(full, target, base_url, workers or self.workers)
+
+    def _build(self, full, target, base_url, workers):
+        started = time.perf_counter()
+        # Versions come from the primary: a lagging replica would record new versions for old pages
+        with db.engine.connect() as connection:
+            layout = layout_version(connection)
+            state = database_state(connection, layout)
+            previous = self._load(target, STATE) or {}
+            if not full and previous.get('state') == state and previous.get('base_url') == base_url:
+                return {'pages': previous.get('pages', 0), 'rendered': 0, 'removed': 0,
+                        'seconds': round(time.perf_counter() - started, 3)}
+            versions = page_versions(connection, layout, listing_aggregates(connection))
+        scanned = time.perf_counter()
+
+        manifest = {} if full or previous.get('base_url') != base_url else (self._load(target, MANIFEST) or {})
+        todo = [path for path, version in versions.items() if manifest.get(path) != version]
+        gone = [path for path in manifest if path not in versions]
+
+        written = set(self._render(target, base_url, todo, workers))
+        failed = [path for path in todo if path not in written]
+        for path in gone + failed:
+            remove_page(target, path)
+            manifest.pop(path, None)
+        manifest.update((path, versions[path]) for path in written)
+
+        self._save(target, MANIFEST, manifest)
+        with open(os.path.join(target, CHANGES), 'w') as fh:
+            fh.writelines(f'{path}\n' for path in sorted(written.union(gone, failed)))
+        self._save(target, STATE, {'state': state, 'base_url': base_url, 'pages': len(manifest),
+                                   'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        return {
+            'pages': len(manifest),
+            'rendered': len(written),
+            'removed': len(gone) + len(failed),
+            'scan_seconds': round(scanned - started, 3),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+
+    def _render(self, target, base_url, paths, workers):
+        if not paths:
+            return []
+        chunks = [paths[i:i + self.chunk_size] for i in range(0, len(paths), self.chunk_size)]
+        workers = max(1, min(workers, len(chunks)))
+        config = {
+            'SQLALCHEMY_DATABASE_URI': self.app.config['SQLALCHEMY_DATABASE_URI'],
+            # Render from the primary, like the versions
+            'REPLICA_BLUEPRINTS': [],
+        }
+        written = []
+        # spawn: forking a process that runs request threads can copy held locks
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(config,)) as pool:
+            futures = [pool.submit(render_pages, target, base_url, chunk) for chunk in chunks]
+            for future in futures:
+                written.extend(future.result())
+        return written
+
+    def _load(self, target, name):
+        try:
+            with open(os.path.join(target, name)) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save(self, target, name, data):
+        path = os.path.join(target, name)
+        with open(path + '.tmp', 'w') as fh:
+            json.dump(data, fh, separators=(',', ':'), sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+prerenderer = Prerenderer()
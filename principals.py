@@ -0,0 +1,124 @@
+"""Logged-in user lookup without a query per request.
+
+Flask-Login calls the user loader on every request with a session cookie:
+admins browsing the public site, and the dashboard polling
+``/admin/api/pending-count``. The loader returns a ``Principal``, an
+immutable snapshot of the fields requests use (id, username, is_admin)
+kept per worker for ``PRINCIPAL_CACHE_SECONDS`` (default 300).
+
+Session ids carry a version derived from the password hash (``5:1a2b3c4d``),
+so changing a password ends that user's other sessions. A commit that
+changes a user's password, admin flag or deletes them drops the snapshot
+in this worker at once and in the others through the invalidation bus;
+changes it doesn't carry are seen within the TTL. Sessions from before
+versioned ids are checked against the database as before.
+
+Views that need the full row load ``User`` by ``current_user.id``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+
+from app import db
+from invalidation import invalidation_bus, ALL
+
+def password_version(password_hash):
+    return hashlib.blake2b((password_hash or '').encode(), digest_size=4).hexdigest()
+
+def session_id(user_id, version):
+    return f'{user_id}:{version}'
+
+class Principal(namedtuple('Principal', 'id username is_admin version')):
+    """What Flask-Login needs of a user, safe to share between requests"""
+    __slots__ = ()
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def get_id(self):
+        return session_id(self.id, self.version)
+
+class PrincipalCache:
+    def __init__(self):
+        self.ttl = 300.0
+        self._entries = {}  # user id -> (principal or None, expires at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app, login_manager):
+        self.ttl = float(os.environ.get('PRINCIPAL_CACHE_SECONDS', self.ttl))
+        login_manager.user_loader(self.load)
+        app.extensions['principals'] = self
+        invalidation_bus.subscribe(('user',), self._on_invalidation)
+        if not event.contains(db.session, 'after_flush', self._after_flush):
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def load(self, raw_id):
+        """Principal for a session's user id, or None to log the session out"""
+        user_id, _, version = raw_id.partition(':')
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return None
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] <= now:
+            self.misses += 1
+            entry = (self._fetch(user_id), now + self.ttl)
+            with self._lock:
+                self._entries[user_id] = entry
+        else:
+            self.hits += 1
+        principal = entry[0]
+        if principal is None or (version and version != principal.version):
+            return None
+        return principal
+
+    def _fetch(self, user_id):
+        from models import User
+
+        row = db.session.query(User.id, User.username, User.is_admin, User.password_hash)\
+            .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        return Principal(row.id, row.username, bool(row.is_admin), password_version(row.password_hash))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _on_invalidation(self, topic, user_id, op):
+        if topic == ALL:
+            with self._lock:
+                self._entries.clear()
+        else:
+            self.invalidate(user_id)
+
+    # Session events
+
+    def _after_flush(self, session, flush_context):
+        from models import User
+
+        changed = session.info.setdefault('principals_changed', set())
+        for obj in session.dirty:
+            if isinstance(obj, User):
+                state = inspect(obj)
+                if state.attrs.password_hash.history.has_changes() or state.attrs.is_admin.history.has_changes():
+                    changed.add(obj.id)
+        changed.update(obj.id for obj in session.deleted if isinstance(obj, User))
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('principals_changed', ()):
+            self.invalidate(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop('principals_changed', None)
+
+principal_cache = PrincipalCache()
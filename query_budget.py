@@ -0,0 +1,244 @@
+"""Per-request query budgets and statement timeouts.
+
+Every request gets a budget: at most ``QUERY_BUDGET_STATEMENTS`` statements
+(default 200) and ``QUERY_BUDGET_DB_MS`` milliseconds spent in the database
+(default 5000), and no single statement may run longer than
+``STATEMENT_TIMEOUT_MS`` (default 3000). The timeout is enforced by the
+server: ``SET LOCAL statement_timeout`` on Postgres, a progress handler that
+interrupts the statement on SQLite. Views tighten or relax their own budget
+with ``@query_budget(...)``; ``QUERY_BUDGETS`` overrides any endpoint:
+
+    QUERY_BUDGETS="public.search=timeout_ms:800;admin.dashboard=statements:400,db_ms:5000"
+
+A request over budget is logged once with the statement that tipped it over
+(or, for database time, the slowest one) and counted in
+``query_budget_violations_total``. With ``QUERY_BUDGET_MODE=enforce`` (the
+default) the statement raises ``QueryBudgetExceeded``, a 503 that views may
+catch to degrade (search falls back to a capped result); after that the
+request's remaining statements are only bound by the timeout, so the error
+page or the degraded response can still render. ``log`` only logs and
+``off`` installs nothing. Requests are the only thing budgeted: CLI
+commands, jobs and the SQLite write queue run unbounded.
+"""
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from werkzeug.exceptions import ServiceUnavailable
+
+from metrics import Counter, metrics
+
+logger = logging.getLogger(__name__)
+
+ENFORCE, LOG, OFF = 'enforce', 'log', 'off'
+LIMITS = ('statements', 'db_ms', 'timeout_ms')
+PROGRESS_STEPS = 1000  # SQLite VM instructions between deadline checks
+PG_QUERY_CANCELED = '57014'
+
+violations = metrics.add(Counter('query_budget_violations_total', 'Requests that went over their query budget',
+                                 ('endpoint', 'kind')))
+
+class QueryBudgetExceeded(ServiceUnavailable):
+    """The request went over its query budget; a 503 unless the view degrades"""
+
+    def __init__(self, kind):
+        super().__init__(description='This page took too long to load. Please try again in a moment.',
+                         retry_after=5)
+        self.kind = kind
+
+def query_budget(statements=None, db_ms=None, timeout_ms=None, exempt=False):
+    """Decorator: the query budget of a view, where it differs from the defaults"""
+    def decorate(view):
+        view.query_budget = None if exempt else {
+            name: value for name, value in zip(LIMITS, (statements, db_ms, timeout_ms)) if value is not None}
+        return view
+    return decorate
+
+def parse_overrides(value):
+    """{endpoint: {limit: number}} from QUERY_BUDGETS"""
+    overrides = {}
+    for entry in filter(None, (part.strip() for part in value.split(';'))):
+        endpoint, _, pairs = entry.partition('=')
+        limits = overrides[endpoint.strip()] = {}
+        for pair in filter(None, (part.strip() for part in pairs.split(','))):
+            name, _, number = pair.partition(':')
+            if name.strip() not in LIMITS:
+                raise ValueError(f'QUERY_BUDGETS: unknown limit {name.strip()!r} for {endpoint.strip()}')
+            limits[name.strip()] = float(number)
+    return overrides
+
+def one_line(statement, limit=1000):
+    return re.sub(r'\s+', ' ', statement).strip()[:limit]
+
+def is_timeout(error, dialect):
+    if dialect == 'sqlite':
+        return 'interrupted' in str(error)
+    return getattr(error, 'pgcode', None) == PG_QUERY_CANCELED
+
+class Budget:
+    """What one request may still spend, and what it has spent"""
+
+    __slots__ = ('endpoint', 'statements', 'db_ms', 'timeout_ms', 'enforce',
+                 'used_statements', 'used_ms', 'slowest', 'last', 'spent', 'logged')
+
+    def __init__(self, endpoint, limits, enforce):
+        self.endpoint = endpoint
+        self.statements = limits['statements']
+        self.db_ms = limits['db_ms']
+        self.timeout_ms = limits['timeout_ms']
+        self.enforce = enforce
+        self.used_statements = 0
+        self.used_ms = 0.0
+        self.slowest = (0.0, '')
+        self.last = ''
+        self.spent = False
+        self.logged = set()
+
+    def violation(self, kind, statement):
+        """Log and count the first violation of each kind; raise it when enforcing"""
+        if kind not in self.logged:
+            self.logged.add(kind)
+            violations.inc(self.endpoint, kind)
+            logger.warning(f"Query budget exceeded on {self.endpoint} ({kind}): {self.used_statements} statements, "
+                           f"{self.used_ms:.0f} ms in the database; SQL: {one_line(statement)}")
+        if self.enforce and not self.spent:
+            self.spent = True
+            raise QueryBudgetExceeded(kind)
+
+class QueryBudgets:
+    def __init__(self):
+        self.mode = ENFORCE
+        self.defaults = {'statements': 200, 'db_ms': 5000.0, 'timeout_ms': 3000.0}
+        self.overrides = {}
+        self._limits = {}  # endpoint -> limits or None
+        self._current = ContextVar('query_budget', default=None)
+
+    def init_app(self, app):
+        self.mode = os.environ.get('QUERY_BUDGET_MODE', ENFORCE)
+        self.defaults = {
+            'statements': int(os.environ.get('QUERY_BUDGET_STATEMENTS', self.defaults['statements'])),
+            'db_ms': float(os.environ.get('QUERY_BUDGET_DB_MS', self.defaults['db_ms'])),
+            'timeout_ms': float(os.environ.get('STATEMENT_TIMEOUT_MS', self.defaults['timeout_ms'])),
+        }
+        self.overrides = parse_overrides(os.environ.get('QUERY_BUDGETS', ''))
+        self._limits = {}
+        app.extensions['query_budget'] = self
+        if self.mode == OFF:
+            return
+        app.before_request(self.start_request)
+        app.teardown_request(self.end_request)
+        if not event.contains(Engine, 'before_cursor_execute', self._before_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            event.listen(Engine, 'handle_error', self._handle_error)
+            event.listen(Engine, 'commit', self._end_transaction)
+            event.listen(Engine, 'rollback', self._end_transaction)
+            event.listen(Pool, 'checkin', self._checkin)
+
+    def limits(self, endpoint):
+        """The limits for `endpoint`, or None when it is exempt"""
+        if endpoint not in self._limits:
+            view = current_app.view_functions.get(endpoint)
+            own = getattr(view, 'query_budget', {})
+            if own is None and endpoint not in self.overrides:
+                self._limits[endpoint] = None
+            else:
+                self._limits[endpoint] = {**self.defaults, **(own or {}), **self.overrides.get(endpoint, {})}
+        return self._limits[endpoint]
+
+    @property
+    def current(self):
+        return self._current.get()
+
+    # Requests
+
+    def start_request(self):
+        limits = self.limits(request.endpoint) if request.endpoint else self.defaults
+        if limits is not None:
+            self._current.set(Budget(request.endpoint or 'unmatched', limits, self.mode == ENFORCE))
+
+    def end_request(self, exc=None):
+        budget = self._current.get()
+        if budget is not None:
+            self._current.set(None)
+            # Over the time budget on the last statement: nothing left to stop, but still worth a log line
+            if budget.used_ms > budget.db_ms and 'db_time' not in budget.logged:
+                budget.enforce = False
+                budget.violation('db_time', budget.slowest[1])
+
+    # Engine events
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        budget = self._current.get()
+        if budget is None:
+            return
+        if not budget.spent:
+            if budget.used_statements >= budget.statements:
+                budget.violation('statements', statement)
+            elif budget.used_ms > budget.db_ms:
+                budget.violation('db_time', budget.slowest[1])
+        budget.used_statements += 1
+        budget.last = statement
+        info = conn.info
+        now = time.perf_counter()
+        if budget.enforce:
+            deadline = info.get('query_budget_deadline')
+            if deadline is not None:
+                deadline[0] = now + budget.timeout_ms / 1000
+            else:
+                self._arm_timeout(conn, cursor, info, budget.timeout_ms, now)
+        info.setdefault('query_budget_started', []).append(now)
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        budget = self._current.get()
+        if budget is None:
+            return
+        started = conn.info.get('query_budget_started')
+        if started:
+            elapsed = (time.perf_counter() - started.pop()) * 1000
+            budget.used_ms += elapsed
+            if elapsed > budget.slowest[0]:
+                budget.slowest = (elapsed, statement)
+
+    def _handle_error(self, context):
+        started = context.connection.info.get('query_budget_started') if context.connection is not None else None
+        budget = self._current.get()
+        if started:
+            elapsed = (time.perf_counter() - started.pop()) * 1000
+            if budget is not None:
+                budget.used_ms += elapsed
+        if budget is not None and is_timeout(context.original_exception, context.dialect.name):
+            budget.spent = False  # a timeout always raises: the statement has no result
+            # Interrupted while fetching, the error has no statement: it is most likely the last one
+            budget.violation('timeout', context.statement or budget.last)
+
+    def _arm_timeout(self, conn, cursor, info, timeout_ms, now):
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            # SET LOCAL lasts until the transaction ends (see _end_transaction)
+            if info.get('query_budget_timeout') != timeout_ms:
+                cursor.execute(f'SET LOCAL statement_timeout = {int(timeout_ms)}')
+                info['query_budget_timeout'] = timeout_ms
+        elif dialect == 'sqlite':
+            # One handler per connection until the pool takes it back; each statement moves
+            # its deadline. It runs every PROGRESS_STEPS instructions, fetching included.
+            deadline = info['query_budget_deadline'] = [now + timeout_ms / 1000]
+            conn.connection.driver_connection.set_progress_handler(lambda: time.perf_counter() > deadline[0],
+                                                                   PROGRESS_STEPS)
+
+    def _end_transaction(self, conn):
+        if conn.dialect.name == 'postgresql':
+            conn.info.pop('query_budget_timeout', None)
+
+    def _checkin(self, dbapi_connection, connection_record):
+        # The next user of this connection may have no budget at all (jobs, CLI)
+        if connection_record is not None and connection_record.info.pop('query_budget_deadline', None) is not None:
+            dbapi_connection.set_progress_handler(None, PROGRESS_STEPS)
+
+query_budgets = QueryBudgets()
@@ -0,0 +1,191 @@
+"""Trending and popularity ranking.
+
+``compute_rankings()`` scores every approved group from its member count,
+how recently it was added and its decayed join/view activity (analytics
+daily buckets), then rolls group scores up into categories and tags. The
+results are materialized into ``rank_score`` so ``?sort=trending`` and the
+homepage popular sections are indexed top-K reads instead of aggregations
+over all approved groups.
+
+Run it periodically (``flask compute-rankings``); until the first run the
+read helpers fall back to live aggregates.
+"""
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+GROUP = 'group'
+CATEGORY = 'category'
+TAG = 'tag'
+
+# Score weights; activity half-life and freshness half-life are in days
+WEIGHTS = {
+    'members': float(os.environ.get('RANK_WEIGHT_MEMBERS', 1.0)),
+    'joins': float(os.environ.get('RANK_WEIGHT_JOINS', 3.0)),
+    'views': float(os.environ.get('RANK_WEIGHT_VIEWS', 0.3)),
+    'fresh': float(os.environ.get('RANK_WEIGHT_FRESH', 4.0)),
+}
+ACTIVITY_HALF_LIFE = float(os.environ.get('RANK_ACTIVITY_HALF_LIFE', 3))
+FRESH_HALF_LIFE = float(os.environ.get('RANK_FRESH_HALF_LIFE', 14))
+ACTIVITY_WINDOW_DAYS = 30
+BATCH_SIZE = 10_000
+# Rewriting rank_score for a million groups takes a while
+WRITE_TIMEOUT = 600
+
+def decay(age_days, half_life):
+    return 0.5 ** (max(age_days, 0.0) / half_life)
+
+def group_score(member_count, created_at, activity, now):
+    """Decayed popularity score for one group; `activity` is its decayed (joins, views)"""
+    joins, views = activity
+    age_days = (now - created_at).total_seconds() / 86400 if created_at else ACTIVITY_WINDOW_DAYS
+    return (WEIGHTS['members'] * math.log1p(member_count or 0)
+            + WEIGHTS['joins'] * math.log1p(joins)
+            + WEIGHTS['views'] * math.log1p(views)
+            + WEIGHTS['fresh'] * decay(age_days, FRESH_HALF_LIFE))
+
+def decayed_activity(now):
+    """{group_id: (decayed joins, decayed views)} from the last ACTIVITY_WINDOW_DAYS"""
+    from models import GroupStat
+
+    activity = defaultdict(lambda: [0.0, 0.0])
+    rows = db.session.query(GroupStat.group_id, GroupStat.bucket, GroupStat.joins, GroupStat.views)\
+        .filter(GroupStat.granularity == 'day',
+                GroupStat.bucket >= now - timedelta(days=ACTIVITY_WINDOW_DAYS))\
+        .yield_per(BATCH_SIZE)
+    for group_id, bucket, joins, views in rows:
+        weight = decay((now - bucket).total_seconds() / 86400, ACTIVITY_HALF_LIFE)
+        activity[group_id][0] += joins * weight
+        activity[group_id][1] += views * weight
+    return activity
+
+def compute_rankings(now=None):
+    """Rebuild rank_score for groups, categories and tags; returns row counts"""
+    from models import WhatsAppGroup, RankScore, group_tags
+    from sqlite_mode import write_queue
+
+    now = now or datetime.utcnow()
+    activity = decayed_activity(now)
+
+    group_scores = {}
+    category_scores = defaultdict(float)
+    category_counts = defaultdict(int)
+    rows = db.session.query(WhatsAppGroup.id, WhatsAppGroup.category_id,
+                            WhatsAppGroup.member_count, WhatsAppGroup.created_at)\
+        .filter(WhatsAppGroup.status == 'approved').yield_per(BATCH_SIZE)
+    for group_id, category_id, member_count, created_at in rows:
+        score = group_score(member_count, created_at, activity.get(group_id, (0.0, 0.0)), now)
+        group_scores[group_id] = score
+        category_scores[category_id] += score
+        category_counts[category_id] += 1
+
+    tag_scores = defaultdict(float)
+    tag_counts = defaultdict(int)
+    links = db.session.query(group_tags.c.tag_id, group_tags.c.group_id).yield_per(BATCH_SIZE)
+    for tag_id, group_id in links:
+        score = group_scores.get(group_id)
+        if score is not None:
+            tag_scores[tag_id] += score
+            tag_counts[tag_id] += 1
+
+    table = RankScore.__table__
+
+    def rows_for(entity_type, scores, counts=None):
+        for entity_id, score in scores.items():
+            yield {
+                'entity_type': entity_type,
+                'entity_id': entity_id,
+                'score': score,
+                'approved_count': counts[entity_id] if counts is not None else 1,
+                'computed_at': now,
+            }
+
+    def replace(connection):
+        # One transaction, so readers never see a half-built table
+        connection.execute(table.delete())
+        for entity_type, scores, counts in ((GROUP, group_scores, None),
+                                            (CATEGORY, category_scores, category_counts),
+                                            (TAG, tag_scores, tag_counts)):
+            batch = []
+            for row in rows_for(entity_type, scores, counts):
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    connection.execute(table.insert(), batch)
+                    batch = []
+            if batch:
+                connection.execute(table.insert(), batch)
+
+    # Through the write queue, like the other bulk writes, so it never races
+    # the worker's SQLite writer for the lock
+    write_queue.run(replace, timeout=WRITE_TIMEOUT)
+
+    counts = {GROUP: len(group_scores), CATEGORY: len(category_scores), TAG: len(tag_scores)}
+    logger.info(f"Rankings computed: {counts}")
+    return counts
+
+# Reading
+
+def trending(query):
+    """(scored, unscored): a WhatsAppGroup query split into its scored groups, best first,
+    and the groups approved since the last run, newest first
+
+    The scored half is driven by the (entity_type, score) index and stops after
+    a page; listings read the unscored half only past the last scored group
+    (see ``readmodels.paginate_ranked``).
+    """
+    from models import WhatsAppGroup, RankScore
+
+    scored = query.join(RankScore, db.and_(RankScore.entity_type == GROUP,
+                                           RankScore.entity_id == WhatsAppGroup.id))\
+                  .order_by(RankScore.score.desc(), RankScore.entity_id.desc())
+    unscored = query.outerjoin(RankScore, db.and_(RankScore.entity_type == GROUP,
+                                                  RankScore.entity_id == WhatsAppGroup.id))\
+                    .filter(RankScore.entity_id.is_(None))\
+                    .order_by(WhatsAppGroup.created_at.desc(), WhatsAppGroup.id.desc())
+    return scored, unscored
+
+def _top(model, entity_type, limit):
+    from models import RankScore
+
+    return db.session.query(model, RankScore.approved_count)\
+        .join(RankScore, db.and_(RankScore.entity_type == entity_type,
+                                 RankScore.entity_id == model.id))\
+        .order_by(RankScore.score.desc())\
+        .limit(limit).all()
+
+def popular_categories(limit=8):
+    """[(category, approved group count)] by score; live aggregate before the first run"""
+    from models import Category, WhatsAppGroup
+
+    top = _top(Category, CATEGORY, limit)
+    if top:
+        return top
+    return db.session.query(Category, func.count(WhatsAppGroup.id))\
+        .join(WhatsAppGroup)\
+        .filter(WhatsAppGroup.status == 'approved')\
+        .group_by(Category.id)\
+        .order_by(func.count(WhatsAppGroup.id).desc())\
+        .limit(limit).all()
+
+def popular_tags(limit=15):
+    """[(tag, approved group count)] by score; live aggregate before the first run"""
+    from models import Tag, WhatsAppGroup, group_tags
+
+    top = _top(Tag, TAG, limit)
+    if top:
+        return top
+    return db.session.query(Tag, func.count(WhatsAppGroup.id))\
+        .join(group_tags)\
+        .join(WhatsAppGroup)\
+        .filter(WhatsAppGroup.status == 'approved')\
+        .group_by(Tag.id)\
+        .order_by(func.count(WhatsAppGroup.id).desc())\
+        .limit(limit).all()
@@ -0,0 +1,211 @@
+"""Per-client request rate limiting.
+
+Two kinds of limit, both keyed by (scope, client):
+
+* token buckets (``limit``/``check``): ``per_minute`` tokens refill
+  continuously up to ``burst``; a request takes one token, or ``cost``
+  tokens when priced by the view (search charges more for expensive
+  queries)
+* sliding windows (``window``): at most ``count`` requests in any
+  ``seconds``-long window, estimated from the current and previous fixed
+  window counters; used for rare, expensive actions like submissions
+
+A client is its address. Limits that accept API keys (``by_api_key``, the
+JSON API) count a registered key, one listed in ``API_KEYS``
+(comma-separated), on its own instead; any other key is ignored, so a
+made-up key per request doesn't get a fresh bucket.
+Over the limit the view is not run and the client gets a 429 with
+Retry-After.
+
+Counters live in this worker's memory unless ``RATELIMIT_STORAGE_URL``
+points at a Redis-compatible server (``redis://host:6379/0``, needs the
+``redis`` package), in which case all workers share them and each check is
+one round trip running a Lua script. If the store is unreachable requests
+are let through and the error logged. ``RATELIMIT_ENABLED=0`` turns
+limiting off.
+"""
+import functools
+import logging
+import math
+import os
+import threading
+import time
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+logger = logging.getLogger(__name__)
+
+class MemoryStore:
+    """In-process counters; the stand-in when no shared store is configured"""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, last refill, seconds to refill completely]
+        self._windows = {}  # key -> [window index, count, previous count]
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost, now):
+        """Seconds until `cost` tokens are available; 0.0 means they were taken"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._prune_buckets(now)
+                bucket = self._buckets[key] = [float(burst), now, burst / rate]
+            else:
+                bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (cost - bucket[0]) / rate
+
+    def hit(self, key, count, seconds, now):
+        """Seconds until the window has room; 0.0 means the hit was counted"""
+        index, offset = divmod(now, seconds)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                window = self._windows[key] = [index, 0, 0]
+            elif window[0] != index:
+                window[2] = window[1] if window[0] == index - 1 else 0
+                window[0], window[1] = index, 0
+            wait = window_wait(window[1], window[2], count, seconds, offset)
+            if not wait:
+                window[1] += 1
+            return wait
+
+    def _prune_buckets(self, now):
+        # A bucket that has refilled completely carries no state worth keeping
+        for key in [k for k, (_, stamp, full_after) in self._buckets.items() if now - stamp >= full_after]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+def window_wait(current, previous, count, seconds, offset):
+    """Sliding-window estimate: previous window weighted by how much of it still overlaps"""
+    weight = 1.0 - offset / seconds
+    if current + previous * weight + 1 <= count:
+        return 0.0
+    if current + 1 > count or not previous:
+        return seconds - offset
+    # Wait until enough of the previous window has slid out
+    return min(seconds - offset, (current + previous * weight + 1 - count) / previous * seconds)
+
+TAKE_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 't', 's')
+local tokens = tonumber(bucket[1]) or burst
+local stamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - stamp) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 't', tokens, 's', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+HIT_SCRIPT = """
+local count, seconds, offset = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local weight = 1 - offset / seconds
+if current + previous * weight + 1 <= count then
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], math.ceil(seconds * 2))
+    return '0'
+end
+if current + 1 > count or previous == 0 then return tostring(seconds - offset) end
+return tostring(math.min(seconds - offset, (current + previous * weight + 1 - count) / previous * seconds))
+"""
+
+class RedisStore:
+    """Counters shared by every worker through a Redis-compatible server"""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self._take = self.client.register_script(TAKE_SCRIPT)
+        self._hit = self.client.register_script(HIT_SCRIPT)
+
+    def take(self, key, rate, burst, cost, now):
+        return float(self._take(keys=[f'rl:b:{key}'], args=[rate, burst, cost, now]))
+
+    def hit(self, key, count, seconds, now):
+        index, offset = divmod(now, seconds)
+        keys = [f'rl:w:{key}:{int(index)}', f'rl:w:{key}:{int(index) - 1}']
+        return float(self._hit(keys=keys, args=[count, seconds, offset]))
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = False
+        self.store = MemoryStore()
+        self.api_keys = frozenset()
+
+    def init_app(self, app):
+        self.enabled = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+        self.api_keys = frozenset(filter(None, (key.strip() for key in os.environ.get('API_KEYS', '').split(','))))
+        url = os.environ.get('RATELIMIT_STORAGE_URL')
+        if url:
+            self.store = RedisStore(url)
+        app.extensions['ratelimit'] = self
+
+    def client_key(self, by_api_key=False):
+        """The client's address, or its API key when `by_api_key` and the key is registered"""
+        if by_api_key:
+            api_key = request.headers.get('X-API-Key')
+            if api_key and api_key in self.api_keys:
+                return f'key:{api_key}'
+        return f'ip:{request.remote_addr}'
+
+    def _check(self, take, by_api_key):
+        try:
+            wait = take(self.client_key(by_api_key), time.time())
+        except Exception as e:
+            logger.error(f"Rate limit store failed, allowing request: {e}")
+            return
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+    def check(self, scope, rate, burst, cost=1.0, by_api_key=False):
+        """Take `cost` tokens for the current client or raise 429 with Retry-After"""
+        if self.enabled:
+            self._check(lambda key, now: self.store.take(f'{scope}:{key}', rate, burst, cost, now), by_api_key)
+
+    def check_window(self, scope, count, seconds, by_api_key=False):
+        """Count a hit in the client's sliding window or raise 429 with Retry-After"""
+        if self.enabled:
+            self._check(lambda key, now: self.store.hit(f'{scope}:{key}', count, seconds, now), by_api_key)
+
+    def limit(self, scope, per_minute, burst=None, methods=None, by_api_key=False):
+        """Decorator: token bucket of `per_minute` refill and `burst` size per client
+
+        Views that price requests differently call ``check`` with a cost
+        themselves; `methods` limits only those HTTP methods and
+        `by_api_key` gives registered API keys their own bucket.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    self.check(scope, per_minute / 60.0, burst or per_minute, by_api_key=by_api_key)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def window(self, scope, count, seconds, methods=None):
+        """Decorator: at most `count` requests per client in any `seconds` window"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                if methods is None or request.method in methods:
+                    self.check_window(scope, count, seconds)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,181 @@
+"""Read models: listing rows as small immutable records instead of entities.
+
+A listing shows 12-20 group cards, and a card needs a few short columns,
+the names and slugs of its category, country, language and tags, and the
+first 120 characters of the description. Loading ``WhatsAppGroup`` entities
+for that drags every Text column through the identity map, plus a tag
+query per page. ``group_cards`` instead selects exactly the card's columns
+in one statement, with the tags folded into one string per group
+(``group_concat`` on SQLite, ``string_agg`` on Postgres), into
+``GroupCard`` objects with ``__slots__``. They look enough like entities
+(``group.category_ref.slug``, ``group.tags``, ``group.image.digest``) that
+the card macros and ``group_image_url`` render either.
+
+``paginate`` is ``query.paginate`` for listings: the query decides filters
+and order, and a loader turns the page into read models. The long Text
+columns (group descriptions, notes and meta descriptions, post and page
+bodies) are deferred on the models, so detail views ask for them
+explicitly (``undefer_group('text')``, ``undefer(Post.content)``).
+``capped`` is the degraded form of a listing: one unranked page and no
+count query. ``paginate_ranked`` pages through two queries back to back,
+a ranked one and the rows it doesn't rank, so a top-K read by index never
+sorts the whole listing.
+"""
+from collections import namedtuple
+
+from flask_sqlalchemy.pagination import QueryPagination
+from sqlalchemy import func, select
+
+from app import db
+
+# Cards truncate descriptions to at most 120 characters; one more tells the
+# truncate filter to add its ellipsis
+DESCRIPTION_PREFIX = 121
+# Enough body for a 150-character excerpt once the markup is stripped
+CONTENT_PREFIX = 2000
+FIELD_SEPARATOR = '\x1f'
+TAG_SEPARATOR = '\x1e'
+
+TaxonomyRef = namedtuple('TaxonomyRef', 'id slug name')
+TagRef = namedtuple('TagRef', 'slug name')
+ImageRef = namedtuple('ImageRef', 'digest')
+PostSummary = namedtuple('PostSummary', 'id slug title excerpt featured_image is_published '
+                                        'created_at updated_at content')
+
+class GroupCard:
+    """What a group card, related group or admin list row shows"""
+
+    __slots__ = ('id', 'slug', 'name', 'description', 'invite_code', 'image_url', 'member_count',
+                 'featured', 'status', 'created_at', 'updated_at',
+                 'category_ref', 'country_ref', 'language_ref', 'image', 'tags')
+
+    def __init__(self, row, refs):
+        (self.id, self.slug, self.name, self.description, self.invite_code, self.image_url,
+         self.member_count, self.featured, self.status, self.created_at, self.updated_at) = row[:11]
+        # One shared ref per taxonomy value on the page
+        self.category_ref = refs.setdefault(('category', row[11]), TaxonomyRef(*row[11:14]))
+        self.country_ref = refs.setdefault(('country', row[14]), TaxonomyRef(*row[14:17]))
+        self.language_ref = refs.setdefault(('language', row[17]), TaxonomyRef(*row[17:20]))
+        self.image = ImageRef(row[20]) if row[20] else None
+        self.tags = tuple(TagRef(*tag.split(FIELD_SEPARATOR, 1))
+                          for tag in row[21].split(TAG_SEPARATOR)) if row[21] else ()
+
+    def __repr__(self):
+        return f'<GroupCard {self.id} {self.slug}>'
+
+def group_card_statement(ids):
+    from models import WhatsAppGroup, Category, Country, Language, Tag, GroupImage, group_tags
+
+    groups = WhatsAppGroup.__table__
+    tags = select(func.aggregate_strings(Tag.slug + FIELD_SEPARATOR + Tag.name, TAG_SEPARATOR))\
+        .select_from(group_tags.join(Tag.__table__, Tag.id == group_tags.c.tag_id))\
+        .where(group_tags.c.group_id == groups.c.id)\
+        .scalar_subquery()
+    return select(groups.c.id, groups.c.slug, groups.c.name,
+                  func.substr(groups.c.description, 1, DESCRIPTION_PREFIX),
+                  groups.c.invite_code, groups.c.image_url, groups.c.member_count,
+                  groups.c.featured, groups.c.status, groups.c.created_at, groups.c.updated_at,
+                  Category.id, Category.slug, Category.name,
+                  Country.id, Country.slug, Country.name,
+                  Language.id, Language.slug, Language.name,
+                  GroupImage.digest, tags)\
+        .select_from(groups)\
+        .join(Category, Category.id == groups.c.category_id)\
+        .join(Country, Country.id == groups.c.country_id)\
+        .join(Language, Language.id == groups.c.language_id)\
+        .outerjoin(GroupImage, GroupImage.group_id == groups.c.id)\
+        .where(groups.c.id.in_(ids))
+
+def group_cards(ids):
+    """GroupCards for `ids` in that order; ids that no longer exist are left out"""
+    if not ids:
+        return []
+    refs = {}
+    cards = {row[0]: GroupCard(row, refs) for row in db.session.execute(group_card_statement(ids))}
+    return [cards[group_id] for group_id in ids if group_id in cards]
+
+def load_group_cards(query):
+    """GroupCards for the rows of a WhatsAppGroup query, keeping its order"""
+    from models import WhatsAppGroup
+
+    return group_cards([group_id for group_id, in query.with_entities(WhatsAppGroup.id)])
+
+def load_post_summaries(query):
+    """PostSummaries for the rows of a Post query, with the body cut to CONTENT_PREFIX"""
+    from models import Post
+
+    return [PostSummary(*row) for row in query.with_entities(
+        Post.id, Post.slug, Post.title, Post.excerpt, Post.featured_image, Post.is_published,
+        Post.created_at, Post.updated_at, func.substr(Post.content, 1, CONTENT_PREFIX))]
+
+def approved_counts(facet, ids=None):
+    """{value id: approved groups} for a facet, optionally only for value `ids`"""
+    from models import WhatsAppGroup, group_tags
+    from facets import facet_index, DIMENSIONS
+
+    if facet in DIMENSIONS:
+        # The facet index has these counts in memory once built
+        result = facet_index.search({})
+        if result is not None:
+            counts = result.counts[facet]
+            return {value: n for value, n in counts.items() if ids is None or value in ids}
+        column = getattr(WhatsAppGroup, f'{facet}_id')
+    else:
+        column = group_tags.c.tag_id
+    statement = select(column, func.count()).where(WhatsAppGroup.status == 'approved').group_by(column)
+    if facet not in DIMENSIONS:
+        statement = statement.join_from(group_tags, WhatsAppGroup, WhatsAppGroup.id == group_tags.c.group_id)
+    if ids is not None:
+        statement = statement.where(column.in_(ids))
+    return dict(db.session.execute(statement).all())
+
+# Pagination
+
+class ReadModelPagination(QueryPagination):
+    """Pagination over an entity query whose page is loaded by `load(query)`"""
+    capped = False
+
+    def _query_items(self):
+        query = self._query_args['query'].limit(self.per_page).offset(self._query_offset)
+        return self._query_args['load'](query)
+
+class CappedPagination(ReadModelPagination):
+    """The first `per_page` rows the database finds, unordered and uncounted, as a single page"""
+    capped = True
+
+    def _query_items(self):
+        # Without the ORDER BY the scan stops at the limit instead of sorting every match
+        query = self._query_args['query'].order_by(None).limit(self.per_page)
+        return self._query_args['load'](query)
+
+    def _query_count(self):
+        return len(self.items)
+
+class RankedPagination(ReadModelPagination):
+    """The rows of `ranked`, then those of `rest`, each in its own order; counted on `query`"""
+
+    def _query_items(self):
+        ranked, rest, load = self._query_args['ranked'], self._query_args['rest'], self._query_args['load']
+        offset = self._query_offset
+        items = load(ranked.limit(self.per_page).offset(offset))
+        if len(items) < self.per_page:
+            # Past the end of the ranked rows: count them only when the page doesn't show where they end
+            ranked_total = offset + len(items) if items or not offset else ranked.order_by(None).count()
+            items += load(rest.limit(self.per_page - len(items)).offset(max(0, offset - ranked_total)))
+        return items
+
+    def _query_count(self):
+        return self._query_args['query'].order_by(None).count()
+
+def paginate(query, page, per_page, load=load_group_cards):
+    """`query.paginate`, with the page's rows loaded as read models"""
+    return ReadModelPagination(query=query, load=load, page=page, per_page=per_page, error_out=False)
+
+def paginate_ranked(ranked, rest, query, page, per_page, load=load_group_cards):
+    """`paginate` over `ranked` followed by `rest`, which together are the rows of `query`"""
+    return RankedPagination(query=query, ranked=ranked, rest=rest, load=load, page=page, per_page=per_page,
+                            error_out=False)
+
+def capped(query, limit, load=load_group_cards):
+    """At most `limit` rows of `query` as one page: the cheap fallback when a listing is over its query budget"""
+    return CappedPagination(query=query, load=load, page=1, per_page=limit, error_out=False)
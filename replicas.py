@@ -0,0 +1,176 @@
+"""Optional read-replica routing.
+
+Set ``DATABASE_REPLICA_URLS`` to a comma separated list of database URLs and
+GET requests on the public blueprint will read from the replicas in
+round-robin order. Everything else stays on the primary:
+
+* any non-GET request (form submissions),
+* the admin blueprint and any logged-in user,
+* a visitor's requests for ``REPLICA_STICKY_SECONDS`` after they POSTed
+  something, so they see their own writes,
+* ORM flushes, which always go to the primary even inside a replica request.
+
+Replicas are health checked lazily (at most every ``REPLICA_HEALTH_INTERVAL``
+seconds per worker) with ``SELECT 1`` and, on Postgres, a replay lag probe.
+A replica that is down, lagging more than ``REPLICA_MAX_LAG`` seconds or that
+raised a connection error during a request is skipped until its next check.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+PG_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica chosen for the current request"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            key = g.get('db_replica')
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+class ReplicaRouter:
+    """Round-robin replica selection with cached health checks"""
+
+    def __init__(self, keys, max_lag=5.0, health_interval=10.0):
+        self.keys = list(keys)
+        self.max_lag = max_lag
+        self.health_interval = health_interval
+        self._cycle = itertools.cycle(self.keys)
+        self._health = {}  # key -> (healthy, checked_at)
+        self._lock = threading.Lock()
+
+    def choose(self, engines):
+        """Next healthy replica bind key, or None to use the primary"""
+        for _ in range(len(self.keys)):
+            with self._lock:
+                key = next(self._cycle)
+            if self.is_healthy(key, engines[key]):
+                return key
+        return None
+
+    def is_healthy(self, key, engine):
+        healthy, checked_at = self._health.get(key, (True, 0.0))
+        if time.monotonic() - checked_at < self.health_interval:
+            return healthy
+        healthy = self.check(engine)
+        self._health[key] = (healthy, time.monotonic())
+        if not healthy:
+            logger.warning(f"Read replica {key} is unavailable or lagging; using primary")
+        return healthy
+
+    def check(self, engine):
+        try:
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    lag = conn.execute(PG_LAG_SQL).scalar() or 0
+                    return float(lag) <= self.max_lag
+                conn.execute(text('SELECT 1'))
+                return True
+        except DBAPIError as e:
+            logger.warning(f"Replica health check failed: {e}")
+            return False
+
+    def mark_down(self, key):
+        self._health[key] = (False, time.monotonic())
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma separated list of replica URLs"""
+    return {
+        f'{REPLICA_BIND_PREFIX}{i}': url.strip()
+        for i, url in enumerate(urls.split(',')) if url.strip()
+    }
+
+def init_app(app, db):
+    """Configure replica binds and the per-request routing hooks"""
+    urls = app.config.get('DATABASE_REPLICA_URLS') or os.environ.get('DATABASE_REPLICA_URLS')
+    if not urls:
+        return None
+
+    binds = replica_binds(urls)
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).update(binds)
+    app.config.setdefault('REPLICA_BLUEPRINTS', ['public'])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', int(os.environ.get('REPLICA_STICKY_SECONDS', 10)))
+
+    router = ReplicaRouter(
+        binds,
+        max_lag=float(os.environ.get('REPLICA_MAX_LAG', 5)),
+        health_interval=float(os.environ.get('REPLICA_HEALTH_INTERVAL', 10)),
+    )
+    app.extensions['replica_router'] = router
+
+    @app.before_request
+    def route_reads_to_replica():
+        if not use_replica(app):
+            return
+        g.db_replica = router.choose(db.engines)
+
+    @app.after_request
+    def stick_to_primary_after_write(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            session['_primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+    @app.teardown_request
+    def mark_failed_replica(exc):
+        key = g.pop('db_replica', None)
+        if key is not None and isinstance(exc, OperationalError):
+            router.mark_down(key)
+
+    return router
+
+def use_replica(app):
+    """Whether the current request may read from a replica"""
+    from flask_login import current_user
+
+    if request.method != 'GET':
+        return False
+    if request.blueprint not in app.config['REPLICA_BLUEPRINTS']:
+        return False
+    if session.get('_primary_until', 0) > time.time():
+        return False
+    if '_user_id' in session and current_user.is_authenticated:
+        return False
+    return True
+
+def sync_sqlite_replicas(app, db):
+    """Copy a SQLite primary into each SQLite replica (local testing only)"""
+    import sqlite3
+
+    primary = db.engines[None]
+    if primary.dialect.name != 'sqlite':
+        raise RuntimeError('Replica sync is only supported for SQLite databases')
+
+    copied = []
+    for key in app.config.get('SQLALCHEMY_BINDS', {}):
+        if not key.startswith(REPLICA_BIND_PREFIX):
+            continue
+        engine = db.engines[key]
+        if engine.dialect.name != 'sqlite':
+            continue
+        source = sqlite3.connect(primary.url.database)
+        target = sqlite3.connect(engine.url.database)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        copied.append(engine.url.database)
+    return copied
@@ -1,85 +1,154 @@
-from flask import render_template, request, redirect, url_for, flash, abort, jsonify, Response
-from app import app, db
-from models import WhatsAppGroup, Category, Country, Language, Tag, Page, Post, SiteSettings, Notification
-from forms import GroupSubmissionForm
+import os
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, jsonify, Response, current_app, stream_with_context
+from app import db
+from models import WhatsAppGroup, Category, Country, Language, Tag, Page, Post, SiteSettings
 from utils import process_tags, get_site_settings
 from datetime import datetime, timezone
 from whatsapp_api import get_group_info, fetch_group_image
+from analytics import analytics, order_by_popularity
+import ranking
+from facets import facet_index, FacetPagination
+import slugs
+from slugs import slug_resolver
+from ratelimit import rate_limiter
+from notifications import active_notifications
+from images import image_pipeline
+import archive
+import readmodels
+from query_budget import query_budget, QueryBudgetExceeded
 from sqlalchemy import or_, and_
+from sqlalchemy.orm import undefer, undefer_group
+
+# Public site blueprint
+public = Blueprint('public', __name__)
+
+# Abuse limits: submissions scrape WhatsApp, searches run unindexed LIKE queries
+SUBMIT_LIMIT_PER_HOUR = int(os.environ.get('SUBMIT_LIMIT_PER_HOUR', 5))
+SEARCH_RATE_PER_MINUTE = int(os.environ.get('SEARCH_RATE_PER_MINUTE', 30))
+SEARCH_MIN_LENGTH = int(os.environ.get('SEARCH_MIN_LENGTH', 2))
+# Query budget of /search, and how many unranked matches it shows when a search goes over it
+SEARCH_TIMEOUT_MS = int(os.environ.get('SEARCH_TIMEOUT_MS', 1000))
+SEARCH_CAPPED_RESULTS = int(os.environ.get('SEARCH_CAPPED_RESULTS', 12))
+
+def search_cost(query, page):
+    """Tokens a text search costs: short terms match most rows, deep pages scan past them"""
+    cost = 1.0 + min(page - 1, 10) * 0.5
+    if len(query) < 4:
+        cost += 2
+    return cost
+
+def throttle_search(query, page):
+    """False if the term is too short to run; raises 429 when the client is out of tokens"""
+    if len(query) < SEARCH_MIN_LENGTH:
+        flash(f'Please search for at least {SEARCH_MIN_LENGTH} characters.', 'warning')
+        return False
+    rate_limiter.check('search', SEARCH_RATE_PER_MINUTE / 60.0, SEARCH_RATE_PER_MINUTE,
+                       search_cost(query, page))
+    return True
+
+def paginate_search(query, page, per_page, sort=None):
+    """A page of search results, or the first matches unranked when the search goes over its query budget"""
+    try:
+        return paginate_listing(query, sort, page, per_page)
+    except QueryBudgetExceeded:
+        db.session.rollback()
+        return readmodels.capped(query, SEARCH_CAPPED_RESULTS)
+
+def apply_sort(query, sort):
+    """Apply the listing order selected by the ?sort= parameter (trending pages through paginate_listing)"""
+    if sort == 'popular':
+        return order_by_popularity(query)
+    return query.order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())
 
-@app.route('/')
+def paginate_listing(query, sort, page, per_page):
+    """A page of an unordered group query in the ?sort= order, as read models"""
+    if sort == 'trending':
+        # Top-K by the rank_score index, then the groups approved since the last ranking run
+        scored, unscored = ranking.trending(query)
+        return readmodels.paginate_ranked(scored, unscored, query, page, per_page)
+    return readmodels.paginate(apply_sort(query, sort), page, per_page)
+
+def approved_groups(filters):
+    """Approved groups narrowed by {facet: id} filters; unset facets are ignored"""
+    query = WhatsAppGroup.query.filter_by(status='approved')
+    for facet in ('category', 'country', 'language'):
+        if filters.get(facet):
+            query = query.filter_by(**{f'{facet}_id': filters[facet]})
+    if filters.get('tag'):
+        query = query.filter(WhatsAppGroup.tags.any(Tag.id == filters['tag']))
+    return query
+
+@public.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
     category_filter = request.args.get('category')
     country_filter = request.args.get('country') 
     language_filter = request.args.get('language')
-    search_query = request.args.get('q', '')
-    
-    # Base query - only approved groups
-    query = WhatsAppGroup.query.filter_by(status='approved')
-    
-    # Apply filters
-    if category_filter and category_filter != 'Any Category':
-        category = Category.query.filter_by(slug=category_filter).first()
-        if category:
-            query = query.filter_by(category_id=category.id)
-    
-    if country_filter and country_filter != 'Any Country':
-        country = Country.query.filter_by(slug=country_filter).first()
-        if country:
-            query = query.filter_by(country_id=country.id)
+    tag_filter = request.args.get('tag')
+    search_query = request.args.get('q', '').strip()
+    sort = request.args.get('sort')
+    if search_query and not throttle_search(search_query, page):
+        search_query = ''
+    
+    # Resolve filter slugs to ids (in memory once the facet index is built)
+    filters = {
+        'category': facet_index.resolve('category', category_filter),
+        'country': facet_index.resolve('country', country_filter),
+        'language': facet_index.resolve('language', language_filter),
+        'tag': facet_index.resolve('tag', tag_filter),
+    }
     
-    if language_filter and language_filter != 'Any Language':
-        language = Language.query.filter_by(slug=language_filter).first()
-        if language:
-            query = query.filter_by(language_id=language.id)
+    # Plain browsing is answered by the facet bitmaps, including per-facet counts;
+    # text search and popularity sorts still go to the database
+    facets = None if search_query else facet_index.search(filters)
     
-    if search_query:
-        query = query.filter(
-            or_(
-                WhatsAppGroup.name.contains(search_query),
-                WhatsAppGroup.description.contains(search_query)
+    if facets is not None and sort not in ('popular', 'trending'):
+        groups = FacetPagination(result=facets, index=facet_index, page=page, per_page=20, error_out=False)
+    else:
+        query = approved_groups(filters)
+        
+        if search_query:
+            query = query.filter(
+                or_(
+                    WhatsAppGroup.name.contains(search_query),
+                    WhatsAppGroup.description.contains(search_query)
+                )
             )
-        )
-    
-    # Order by featured first, then by creation date
-    query = query.order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())
-    
-    # Paginate results
-    groups = query.paginate(page=page, per_page=20, error_out=False)
+        
+        # Order by featured first, then by creation date; ?sort=popular is most joined
+        # this week, ?sort=trending the materialized ranking score. A search that is
+        # too broad to rank in budget shows its first matches
+        groups = paginate_search(query, page, 20, sort) if search_query else paginate_listing(query, sort, page, 20)
     
     # Get filter options
     categories = Category.query.order_by(Category.name).all()
     countries = Country.query.order_by(Country.name).all()
     languages = Language.query.order_by(Language.name).all()
     
-    # Get popular categories (with most groups) for homepage
+    # Most common tags within the current results, for the "refine by tag" chips
+    facet_tags = []
+    if facets is not None:
+        tag_counts = {tag_id: n for tag_id, n in facets.counts['tag'].items() if n}
+        if tag_counts:
+            tags_by_id = {t.id: t for t in Tag.query.filter(Tag.id.in_(tag_counts))}
+            facet_tags = sorted(((tags_by_id[tag_id], n) for tag_id, n in tag_counts.items() if tag_id in tags_by_id),
+                                key=lambda pair: pair[1], reverse=True)[:12]
+    
+    # Popular categories and tags for homepage (materialized by ranking.py)
     try:
-        popular_categories = db.session.query(Category)\
-            .join(WhatsAppGroup)\
-            .filter(WhatsAppGroup.status == 'approved')\
-            .group_by(Category.id)\
-            .order_by(db.func.count(WhatsAppGroup.id).desc())\
-            .limit(8).all()
+        popular_categories = ranking.popular_categories(limit=8)
     except Exception:
-        popular_categories = Category.query.limit(8).all()
+        popular_categories = [(category, None) for category in Category.query.limit(8).all()]
     
-    # Get popular tags for homepage
     try:
-        from models import group_tags
-        popular_tags = db.session.query(Tag)\
-            .join(group_tags)\
-            .join(WhatsAppGroup)\
-            .filter(WhatsAppGroup.status == 'approved')\
-            .group_by(Tag.id)\
-            .order_by(db.func.count(WhatsAppGroup.id).desc())\
-            .limit(15).all()
+        popular_tags = ranking.popular_tags(limit=15)
     except Exception:
-        popular_tags = Tag.query.limit(15).all()
+        popular_tags = [(tag, None) for tag in Tag.query.limit(15).all()]
     
     # Get site settings and notifications
     settings = get_site_settings()
-    notifications = Notification.query.filter_by(is_active=True).all()
+    notifications = active_notifications()
     
     return render_template('index.html', 
                          groups=groups, 
@@ -91,21 +160,35 @@ def index():
                          current_category=category_filter,
                          current_country=country_filter,
                          current_language=language_filter,
+                         current_tag=tag_filter,
+                         facet_counts=facets.counts if facets is not None else None,
+                         facet_tags=facet_tags,
                          search_query=search_query,
+                         current_sort=sort,
                          settings=settings,
                          notifications=notifications)
 
-@app.route('/group/<group_slug>')
-@app.route('/group/<category_slug>/<group_slug>')
+@public.route('/group/<group_slug>')
+@public.route('/group/<category_slug>/<group_slug>')
 def group_detail(group_slug, category_slug=None):
     """Handle both /group/slug and /group/category/slug URL patterns"""
-    if category_slug:
-        # Traditional category/group URL pattern
-        category = Category.query.filter_by(slug=category_slug).first_or_404()
-        group = WhatsAppGroup.query.filter_by(slug=group_slug, category_id=category.id, status='approved').first_or_404()
-    else:
-        # Direct group URL pattern - find group by slug only
-        group = WhatsAppGroup.query.filter_by(slug=group_slug, status='approved').first_or_404()
+    group_id, moved = slug_resolver.resolve(slugs.GROUP, group_slug)
+    group = db.session.get(WhatsAppGroup, group_id, options=[undefer_group('text')]) if group_id is not None else None
+    if group_id is not None and group is None:
+        # Cached for a group deleted since; the slug may belong to another one now
+        slug_resolver.forget(slugs.GROUP, group_slug)
+        group_id, moved = slug_resolver.resolve(slugs.GROUP, group_slug)
+        group = db.session.get(WhatsAppGroup, group_id, options=[undefer_group('text')]) if group_id is not None else None
+    if group is None or group.status != 'approved':
+        abort(404)
+    
+    # Old group slug or wrong/renamed category: send to the canonical URL
+    if category_slug and (moved or slug_resolver.resolve('category', category_slug) != (group.category_id, False)):
+        slugs.redirect_to_current(category_slug=group.category_ref.slug, group_slug=group.slug)
+    if moved:
+        slugs.redirect_to_current(group_slug=group.slug)
+    
+    analytics.record_view(group.id)
     
     # Get related groups
     related_groups = group.get_related_groups()
@@ -114,13 +197,15 @@ def group_detail(group_slug, category_slug=None):
     
     return render_template('group_detail.html', group=group, related_groups=related_groups, settings=settings)
 
-@app.route('/group/join/<invite_code>')
+@public.route('/group/join/<invite_code>')
 def group_join(invite_code):
-    group = WhatsAppGroup.query.filter_by(invite_code=invite_code, status='approved').first_or_404()
+    group = WhatsAppGroup.query.filter_by(invite_code=invite_code, status='approved')\
+                               .options(undefer_group('text')).first_or_404()
+    analytics.record_join(group.id)
     settings = get_site_settings()
     return render_template('group_join.html', group=group, settings=settings)
 
-@app.route('/api/tags')
+@public.route('/api/tags')
 def get_tags():
     """API endpoint to get existing tags for suggestions"""
     try:
@@ -129,11 +214,15 @@ def get_tags():
         tag_list = [tag[0] for tag in tags]
         return jsonify({'tags': tag_list})
     except Exception as e:
-        app.logger.error(f"Error fetching tags: {e}")
+        current_app.logger.error(f"Error fetching tags: {e}")
         return jsonify({'tags': []})
 
-@app.route('/submit-group', methods=['GET', 'POST'])
+@public.route('/submit-group', methods=['GET', 'POST'])
+@rate_limiter.window('submit', SUBMIT_LIMIT_PER_HOUR, 3600, methods=('POST',))
 def submit_group():
+    # WTForms is loaded by the first submission, not at startup
+    from forms import GroupSubmissionForm
+
     form = GroupSubmissionForm()
     
     # Populate form choices
@@ -142,11 +231,11 @@ def submit_group():
     form.language_id.choices = [(l.id, l.name) for l in Language.query.order_by(Language.name).all()]
     
     if form.validate_on_submit():
-        # Check if group already exists
+        # Check if group already exists, or was archived (rejected or dead)
         existing_group = WhatsAppGroup.query.filter_by(invite_link=form.invite_link.data).first()
-        if existing_group:
+        if existing_group or archive.is_archived(form.invite_link.data):
             flash('This WhatsApp group has already been submitted.', 'warning')
-            return redirect(url_for('submit_group'))
+            return redirect(url_for('public.submit_group'))
         
         # Create new group
         group = WhatsAppGroup(
@@ -171,117 +260,117 @@ def submit_group():
                 if group_info.get('member_count'):
                     group.member_count = group_info['member_count']
         except Exception as e:
-            app.logger.warning(f"Could not fetch group info: {e}")
+            current_app.logger.warning(f"Could not fetch group info: {e}")
         
         try:
-            db.session.add(group)
+            slugs.save_with_slug(group, group.name, allocate=True)
             db.session.commit()
+            image_pipeline.enqueue(group.id)
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f"Database error during group submission: {e}")
+            current_app.logger.error(f"Database error during group submission: {e}")
             flash('There was an error submitting your group. Please try again.', 'error')
             return render_template('submit_group.html', form=form, settings=get_site_settings())
         
         flash('Your group has been submitted for review. It will be published after approval.', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('public.index'))
     
     settings = get_site_settings()
     return render_template('submit_group.html', form=form, settings=settings)
 
-@app.route('/category/<category_slug>')
+@public.route('/category/<category_slug>')
 def category_groups(category_slug):
-    category = Category.query.filter_by(slug=category_slug).first_or_404()
+    category = slugs.get_or_404('category', category_slug, 'category_slug')
     page = request.args.get('page', 1, type=int)
     
-    groups = WhatsAppGroup.query.filter_by(category_id=category.id, status='approved')\
-                                .order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())\
-                                .paginate(page=page, per_page=12, error_out=False)
+    query = approved_groups({'category': category.id})
+    groups = paginate_listing(query, request.args.get('sort'), page, 12)
     
     settings = get_site_settings()
-    return render_template('category.html', category=category, groups=groups, settings=settings)
+    return render_template('category.html', category=category, groups=groups, settings=settings,
+                           group_counts=readmodels.approved_counts('category'))
 
-@app.route('/categories')
+@public.route('/categories')
 def all_categories():
     """Display all categories in a grid layout"""
     categories = Category.query.order_by(Category.name.asc()).all()
     settings = get_site_settings()
-    return render_template('categories.html', categories=categories, settings=settings)
+    return render_template('categories.html', categories=categories, settings=settings,
+                           group_counts=readmodels.approved_counts('category'))
 
-@app.route('/tags')
+@public.route('/tags')
 def all_tags():
     """Display all tags in a grid layout with pagination"""
     page = request.args.get('page', 1, type=int)
     # Get tags with their approved group counts
-    tags = Tag.query.outerjoin(Tag.groups.and_(WhatsAppGroup.status == 'approved'))\
-                   .group_by(Tag.id)\
-                   .order_by(Tag.name.asc())\
-                   .paginate(page=page, per_page=24, error_out=False)
+    tags = Tag.query.order_by(Tag.name.asc()).paginate(page=page, per_page=24, error_out=False)
+    group_counts = readmodels.approved_counts('tag', [tag.id for tag in tags.items])
     settings = get_site_settings()
-    return render_template('tags.html', tags=tags, settings=settings)
+    return render_template('tags.html', tags=tags, settings=settings, group_counts=group_counts)
 
-@app.route('/languages')
+@public.route('/languages')
 def all_languages():
     """Display all languages in a grid layout with pagination"""
     page = request.args.get('page', 1, type=int)
     languages = Language.query.order_by(Language.name.asc()).paginate(page=page, per_page=24, error_out=False)
     settings = get_site_settings()
-    return render_template('languages.html', languages=languages, settings=settings)
+    return render_template('languages.html', languages=languages, settings=settings,
+                           group_counts=readmodels.approved_counts('language'))
 
-@app.route('/countries')
+@public.route('/countries')
 def all_countries():
     """Display all countries in a grid layout with pagination"""
     page = request.args.get('page', 1, type=int)
     countries = Country.query.order_by(Country.name.asc()).paginate(page=page, per_page=24, error_out=False)
     settings = get_site_settings()
-    return render_template('countries.html', countries=countries, settings=settings)
+    return render_template('countries.html', countries=countries, settings=settings,
+                           group_counts=readmodels.approved_counts('country'))
 
-@app.route('/country/<country_slug>')
+@public.route('/country/<country_slug>')
 def country_groups(country_slug):
-    country = Country.query.filter_by(slug=country_slug).first_or_404()
+    country = slugs.get_or_404('country', country_slug, 'country_slug')
     page = request.args.get('page', 1, type=int)
     
-    groups = WhatsAppGroup.query.filter_by(country_id=country.id, status='approved')\
-                                .order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())\
-                                .paginate(page=page, per_page=12, error_out=False)
+    query = approved_groups({'country': country.id})
+    groups = paginate_listing(query, request.args.get('sort'), page, 12)
     
     settings = get_site_settings()
     return render_template('country.html', country=country, groups=groups, settings=settings)
 
-@app.route('/language/<language_slug>')
+@public.route('/language/<language_slug>')
 def language_groups(language_slug):
-    language = Language.query.filter_by(slug=language_slug).first_or_404()
+    language = slugs.get_or_404('language', language_slug, 'language_slug')
     page = request.args.get('page', 1, type=int)
     
-    groups = WhatsAppGroup.query.filter_by(language_id=language.id, status='approved')\
-                                .order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())\
-                                .paginate(page=page, per_page=12, error_out=False)
+    query = approved_groups({'language': language.id})
+    groups = paginate_listing(query, request.args.get('sort'), page, 12)
     
     settings = get_site_settings()
     return render_template('language.html', language=language, groups=groups, settings=settings)
 
-@app.route('/tags/<tag_slug>')
+@public.route('/tags/<tag_slug>')
 def tag_groups(tag_slug):
-    tag = Tag.query.filter_by(slug=tag_slug).first_or_404()
+    tag = slugs.get_or_404('tag', tag_slug, 'tag_slug')
     page = request.args.get('page', 1, type=int)
     
-    groups = db.session.query(WhatsAppGroup).join(WhatsAppGroup.tags)\
-                      .filter(Tag.id == tag.id, WhatsAppGroup.status == 'approved')\
-                      .order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())\
-                      .paginate(page=page, per_page=12, error_out=False)
+    query = db.session.query(WhatsAppGroup).join(WhatsAppGroup.tags)\
+                      .filter(Tag.id == tag.id, WhatsAppGroup.status == 'approved')
+    groups = paginate_listing(query, request.args.get('sort'), page, 12)
     
     settings = get_site_settings()
     return render_template('tag.html', tag=tag, groups=groups, settings=settings)
 
-@app.route('/search')
+@public.route('/search')
+@query_budget(timeout_ms=SEARCH_TIMEOUT_MS, db_ms=SEARCH_TIMEOUT_MS)
 def search():
-    query = request.args.get('q', '')
+    query = request.args.get('q', '').strip()
     page = request.args.get('page', 1, type=int)
     
-    if not query:
-        return redirect(url_for('index'))
+    if not query or not throttle_search(query, page):
+        return redirect(url_for('public.index'))
     
     # Search in groups, tags
-    groups = WhatsAppGroup.query.filter(
+    groups = paginate_search(WhatsAppGroup.query.filter(
         and_(
             WhatsAppGroup.status == 'approved',
             or_(
@@ -289,203 +378,135 @@ def search():
                 WhatsAppGroup.description.contains(query)
             )
         )
-    ).order_by(WhatsAppGroup.featured.desc(), WhatsAppGroup.created_at.desc())\
-     .paginate(page=page, per_page=12, error_out=False)
+    ), page, 12)
     
     settings = get_site_settings()
     return render_template('search.html', groups=groups, query=query, settings=settings)
 
-@app.route('/page/<page_slug>')
+@public.route('/page/<page_slug>')
 def page_detail(page_slug):
-    page = Page.query.filter_by(slug=page_slug, is_published=True).first_or_404()
+    page = slugs.get_or_404('page', page_slug, 'page_slug', options=[undefer(Page.content)])
+    if not page.is_published:
+        abort(404)
     settings = get_site_settings()
     return render_template('page_detail.html', page=page, settings=settings)
 
-@app.route('/blog')
+@public.route('/blog')
 def blog():
     page_num = request.args.get('page', 1, type=int)
-    posts = Post.query.filter_by(is_published=True)\
-                     .order_by(Post.created_at.desc())\
-                     .paginate(page=page_num, per_page=6, error_out=False)
+    posts = readmodels.paginate(Post.query.filter_by(is_published=True).order_by(Post.created_at.desc()),
+                                page_num, 6, load=readmodels.load_post_summaries)
     
     settings = get_site_settings()
     return render_template('blog.html', posts=posts, settings=settings)
 
-@app.route('/blog/<post_slug>')
+@public.route('/blog/<post_slug>')
 def post_detail(post_slug):
-    post = Post.query.filter_by(slug=post_slug, is_published=True).first_or_404()
+    post = slugs.get_or_404('post', post_slug, 'post_slug', options=[undefer(Post.content)])
+    if not post.is_published:
+        abort(404)
     settings = get_site_settings()
     return render_template('post_detail.html', post=post, settings=settings)
 
-@app.route('/sitemap.xml')
+@public.route('/sitemap.xml')
+@query_budget(exempt=True)  # one long streaming statement over every approved group
 def sitemap():
-    """Generate XML sitemap for search engines"""
-    # Get the current domain from the request
-    from urllib.parse import urljoin
+    """Generate XML sitemap for search engines, streamed as it is built"""
     base_url = request.url_root.rstrip('/')
+    today = datetime.now().strftime('%Y-%m-%d')
     
     def format_date(dt):
         """Format datetime for sitemap"""
         if dt:
             return dt.strftime('%Y-%m-%d')
-        return datetime.now().strftime('%Y-%m-%d')
-    
-    # Start building sitemap XML
-    xml_content = ['<?xml version="1.0" encoding="UTF-8"?>']
-    xml_content.append('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
-    
-    # Static pages with high priority
-    static_pages = [
-        ('/', '1.0', 'daily'),
-        ('/submit-group', '0.8', 'weekly'),
-        ('/categories', '0.9', 'weekly'),
-        ('/tags', '0.9', 'weekly'),
-        ('/languages', '0.8', 'weekly'),
-        ('/countries', '0.8', 'weekly'),
-        ('/blog', '0.7', 'daily'),
-        ('/search', '0.6', 'monthly'),
-    ]
-    
-    for url, priority, changefreq in static_pages:
-        xml_content.append(f'  <url>')
-        xml_content.append(f'    <loc>{base_url}{url}</loc>')
-        xml_content.append(f'    <lastmod>{format_date(None)}</lastmod>')
-        xml_content.append(f'    <changefreq>{changefreq}</changefreq>')
-        xml_content.append(f'    <priority>{priority}</priority>')
-        xml_content.append(f'  </url>')
-    
-    # Category pages
-    try:
-        categories = Category.query.all()
-        for category in categories:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/category/{category.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(None)}</lastmod>')
-            xml_content.append(f'    <changefreq>weekly</changefreq>')
-            xml_content.append(f'    <priority>0.8</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Country pages
-    try:
-        countries = Country.query.all()
-        for country in countries:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/country/{country.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(None)}</lastmod>')
-            xml_content.append(f'    <changefreq>weekly</changefreq>')
-            xml_content.append(f'    <priority>0.7</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Language pages
-    try:
-        languages = Language.query.all()
-        for language in languages:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/language/{language.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(None)}</lastmod>')
-            xml_content.append(f'    <changefreq>weekly</changefreq>')
-            xml_content.append(f'    <priority>0.7</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Tag pages
-    try:
-        tags = Tag.query.all()
-        for tag in tags:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/tags/{tag.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(getattr(tag, "created_at", None))}</lastmod>')
-            xml_content.append(f'    <changefreq>weekly</changefreq>')
-            xml_content.append(f'    <priority>0.6</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Published blog posts
-    try:
-        posts = Post.query.filter_by(is_published=True).all()
-        for post in posts:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/blog/{post.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(getattr(post, "updated_at", None))}</lastmod>')
-            xml_content.append(f'    <changefreq>monthly</changefreq>')
-            xml_content.append(f'    <priority>0.6</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Published static pages
-    try:
-        pages = Page.query.filter_by(is_published=True).all()
-        for page in pages:
-            xml_content.append(f'  <url>')
-            xml_content.append(f'    <loc>{base_url}/page/{page.slug}</loc>')
-            xml_content.append(f'    <lastmod>{format_date(getattr(page, "updated_at", None))}</lastmod>')
-            xml_content.append(f'    <changefreq>monthly</changefreq>')
-            xml_content.append(f'    <priority>0.5</priority>')
-            xml_content.append(f'  </url>')
-    except Exception:
-        pass
-    
-    # Approved WhatsApp groups - detail pages
-    try:
-        groups = WhatsAppGroup.query.filter_by(status='approved').all()
-        for group in groups:
-            try:
-                # Group detail page
-                if group.category and group.slug:
-                    xml_content.append(f'  <url>')
-                    xml_content.append(f'    <loc>{base_url}/group/{group.category.slug}/{group.slug}</loc>')
-                    xml_content.append(f'    <lastmod>{format_date(getattr(group, "updated_at", None))}</lastmod>')
-                    xml_content.append(f'    <changefreq>weekly</changefreq>')
-                    xml_content.append(f'    <priority>0.8</priority>')
-                    xml_content.append(f'  </url>')
-                
-                # Group join page
-                if getattr(group, 'invite_code', None):
-                    xml_content.append(f'  <url>')
-                    xml_content.append(f'    <loc>{base_url}/join/{group.invite_code}</loc>')
-                    xml_content.append(f'    <lastmod>{format_date(getattr(group, "updated_at", None))}</lastmod>')
-                    xml_content.append(f'    <changefreq>monthly</changefreq>')
-                    xml_content.append(f'    <priority>0.9</priority>')
-                    xml_content.append(f'  </url>')
-            except Exception:
-                continue
-    except Exception:
-        pass
-    
-    xml_content.append('</urlset>')
-    
-    # Return XML response with proper content type
-    return Response('\n'.join(xml_content), mimetype='application/xml')
+        return today
+    
+    def entry(path, lastmod, changefreq, priority):
+        return (f'  <url>\n'
+                f'    <loc>{base_url}{path}</loc>\n'
+                f'    <lastmod>{format_date(lastmod)}</lastmod>\n'
+                f'    <changefreq>{changefreq}</changefreq>\n'
+                f'    <priority>{priority}</priority>\n'
+                f'  </url>\n')
+    
+    def generate():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        
+        # Static pages with high priority
+        static_pages = [
+            ('/', '1.0', 'daily'),
+            ('/submit-group', '0.8', 'weekly'),
+            ('/categories', '0.9', 'weekly'),
+            ('/tags', '0.9', 'weekly'),
+            ('/languages', '0.8', 'weekly'),
+            ('/countries', '0.8', 'weekly'),
+            ('/blog', '0.7', 'daily'),
+            ('/search', '0.6', 'monthly'),
+        ]
+        yield ''.join(entry(url, None, changefreq, priority) for url, priority, changefreq in static_pages)
+        
+        # Taxonomy pages
+        yield ''.join(entry(f'/category/{c.slug}', None, 'weekly', '0.8') for c in Category.query.all())
+        yield ''.join(entry(f'/country/{c.slug}', None, 'weekly', '0.7') for c in Country.query.all())
+        yield ''.join(entry(f'/language/{l.slug}', None, 'weekly', '0.7') for l in Language.query.all())
+        yield ''.join(entry(f'/tags/{t.slug}', t.created_at, 'weekly', '0.6') for t in Tag.query.all())
+        
+        # Published blog posts and static pages
+        yield ''.join(entry(f'/blog/{p.slug}', p.updated_at, 'monthly', '0.6')
+                      for p in Post.query.filter_by(is_published=True).all())
+        yield ''.join(entry(f'/page/{p.slug}', p.updated_at, 'monthly', '0.5')
+                      for p in Page.query.filter_by(is_published=True).all())
+        
+        # Approved groups: detail and join pages, in chunks rather than one
+        # list of every group. Groups without a category only get a join page.
+        rows = db.session.query(WhatsAppGroup.slug, Category.slug, WhatsAppGroup.invite_code,
+                                WhatsAppGroup.updated_at)\
+            .outerjoin(Category, WhatsAppGroup.category_id == Category.id)\
+            .filter(WhatsAppGroup.status == 'approved')\
+            .execution_options(yield_per=1000)
+        chunk = []
+        for group_slug, category_slug, invite_code, updated_at in rows:
+            if category_slug and group_slug:
+                chunk.append(entry(f'/group/{category_slug}/{group_slug}', updated_at, 'weekly', '0.8'))
+            chunk.append(entry(f'/group/join/{invite_code}', updated_at, 'monthly', '0.9'))
+            if len(chunk) >= 1000:
+                yield ''.join(chunk)
+                chunk = []
+        yield ''.join(chunk)
+        yield '</urlset>\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/xml')
 
 
 # Error handlers
-@app.errorhandler(404)
+@public.app_errorhandler(404)
 def not_found_error(error):
     settings = get_site_settings()
     return render_template('404.html', settings=settings), 404
 
-@app.errorhandler(500)
+@public.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     settings = get_site_settings()
     return render_template('500.html', settings=settings), 500
 
+@public.app_errorhandler(503)
+def unavailable_error(error):
+    db.session.rollback()
+    settings = get_site_settings()
+    headers = [(name, value) for name, value in error.get_headers() if name.lower() != 'content-type']
+    return render_template('503.html', settings=settings, error=error), 503, headers
+
 # Template filters
-@app.template_filter('truncate')
+@public.app_template_filter('truncate')
 def truncate_filter(text, length=100):
     if text and len(text) > length:
         return text[:length-3] + '...'
     return text or ''
 
 # Context processors
-@app.context_processor
+@public.app_context_processor
 def inject_globals():
     return {
         'site_settings': get_site_settings(),
@@ -493,5 +514,5 @@ def inject_globals():
         'categories': Category.query.order_by(Category.name).all(),
         'countries': Country.query.order_by(Country.name).all(),
         'languages': Language.query.order_by(Language.name).all(),
-        'notifications': Notification.query.filter_by(is_active=True).all()
+        'notifications': active_notifications()
     }
@@ -0,0 +1,193 @@
+"""Production serving profiles.
+
+Generates gunicorn / uvicorn settings from the machine's core count and sizes
+the SQLAlchemy connection pool per worker so that the whole deployment never
+opens more than ``DB_MAX_CONNECTIONS`` database connections. The profiles
+run side by side, so each gets its own part of that budget (``DB_SHARES``,
+or ``DB_MAX_CONNECTIONS_WEB`` / ``DB_MAX_CONNECTIONS_SUBMIT``), split again
+between its workers; what is left is for ``flask run-jobs`` and other CLI
+commands. Generating a config fails if the profiles together could open
+more than the limit.
+
+Two profiles are provided:
+
+* ``web``    - the main site. Threaded (gthread) workers, 2 * cores + 1.
+* ``submit`` - a separate pool for ``/submit-group``, whose POSTs block on
+  outbound scrapes of chat.whatsapp.com. Uses gevent workers when gevent is
+  installed (thread workers otherwise) so slow upstream calls don't tie up
+  the main pool. Route it with the nginx snippet from ``nginx_snippet()``.
+
+Neither runs background jobs: the generated configs set ``JOBS_ENABLED=0``
+so web workers don't each start a scheduler, and the jobs run in one
+``flask run-jobs`` process next to them.
+"""
+import os
+
+PROFILES = {
+    'web': {
+        'bind': '127.0.0.1:8000',
+        'worker_class': 'gthread',
+        'threads': 4,
+        'timeout': 30,
+    },
+    'submit': {
+        'bind': '127.0.0.1:8001',
+        'worker_class': 'gevent',
+        'worker_connections': 100,
+        'threads': 1,
+        'timeout': 60,
+    },
+}
+
+# Part of DB_MAX_CONNECTIONS each profile's workers share; the rest is left for
+# flask run-jobs and CLI commands
+DB_SHARES = {'web': 0.7, 'submit': 0.2}
+
+# Paths sent to the submit pool by the nginx snippet
+SUBMIT_PATHS = ['/submit-group']
+
+# Blueprints a profile's workers never serve, left out to start them faster
+PROFILE_ENV = {'submit': ['ADMIN_ENABLED=0', 'API_ENABLED=0']}
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def worker_count(cores=None):
+    """Default gunicorn worker count: 2 * cores + 1, overridable with WEB_WORKERS"""
+    if os.environ.get('WEB_WORKERS'):
+        return max(1, int(os.environ['WEB_WORKERS']))
+    return 2 * (cores or cpu_count()) + 1
+
+def gevent_available():
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def build_profile(name='web', cores=None):
+    """Resolve a profile into concrete gunicorn settings"""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown serving profile: {name}")
+
+    profile = dict(PROFILES[name])
+    cores = cores or cpu_count()
+
+    if name == 'submit':
+        # IO bound: a couple of processes is enough, concurrency comes from greenlets
+        profile['workers'] = max(2, cores // 2)
+        if not gevent_available():
+            profile['worker_class'] = 'gthread'
+            profile['threads'] = 16
+            profile.pop('worker_connections', None)
+    else:
+        profile['workers'] = worker_count(cores)
+        profile['threads'] = int(os.environ.get('WEB_THREADS', profile['threads']))
+
+    if os.environ.get('WEB_BIND'):
+        profile['bind'] = os.environ['WEB_BIND']
+
+    profile['max_requests'] = 2000
+    profile['max_requests_jitter'] = 200
+    profile['graceful_timeout'] = 30
+    profile['keepalive'] = 5
+    profile['preload_app'] = True
+    return profile
+
+def concurrency_per_worker(profile):
+    """How many requests one worker process can hold open at once"""
+    if profile['worker_class'] == 'gevent':
+        return profile.get('worker_connections', 1000)
+    return profile.get('threads', 1)
+
+def max_connections():
+    return int(os.environ.get('DB_MAX_CONNECTIONS', 100))
+
+def connection_budget(name):
+    """Connections the workers of profile `name` may open between them"""
+    override = os.environ.get(f'DB_MAX_CONNECTIONS_{name.upper()}')
+    if override:
+        return int(override)
+    return max(1, int(max_connections() * DB_SHARES[name]))
+
+def pool_options(workers=None, concurrency=None, max_connections=None):
+    """SQLAlchemy pool settings for one worker process.
+
+    Every worker gets its own engine, so the connection budget
+    (`max_connections`, a profile's budget) has to be split between them:
+    pool_size covers the worker's steady-state concurrency, max_overflow
+    takes the remainder of its share.
+    """
+    workers = workers or int(os.environ.get('WEB_WORKERS') or worker_count())
+    concurrency = concurrency or int(os.environ.get('WEB_THREADS', 1))
+    max_connections = max_connections or int(os.environ.get('DB_MAX_CONNECTIONS', 100))
+
+    share = max(1, max_connections // workers)
+    pool_size = max(1, min(concurrency, share))
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max(0, share - pool_size),
+    }
+
+def profile_pool(name, cores=None):
+    """(profile, pool options) for profile `name`"""
+    profile = build_profile(name, cores)
+    return profile, pool_options(profile['workers'], concurrency_per_worker(profile), connection_budget(name))
+
+def check_connection_budget(cores=None):
+    """Raise ValueError if every profile's workers together could open more than DB_MAX_CONNECTIONS"""
+    total = 0
+    for name in PROFILES:
+        profile, pool = profile_pool(name, cores)
+        total += profile['workers'] * (pool['pool_size'] + pool['max_overflow'])
+    if total > max_connections():
+        raise ValueError(f"The serving profiles could open {total} database connections, more than "
+                         f"DB_MAX_CONNECTIONS={max_connections()}: lower WEB_WORKERS or the "
+                         f"DB_MAX_CONNECTIONS_<PROFILE> overrides")
+    return total
+
+def gunicorn_config(name='web', cores=None):
+    """Return the text of a gunicorn.conf.py for the given profile"""
+    check_connection_budget(cores)
+    profile, pool = profile_pool(name, cores)
+    lines = [f'# Generated by `flask serve-config --profile {name}`']
+    for key in sorted(profile):
+        lines.append(f'{key} = {profile[key]!r}')
+
+    # Workers read these back in create_app() to size their pools
+    lines.append('raw_env = [')
+    lines.append(f"    'WEB_WORKERS={profile['workers']}',")
+    lines.append(f"    'WEB_THREADS={concurrency_per_worker(profile)}',")
+    lines.append(f"    'DB_POOL_SIZE={pool['pool_size']}',")
+    lines.append(f"    'DB_MAX_OVERFLOW={pool['max_overflow']}',")
+    # Jobs run in `flask run-jobs`, not in every web worker
+    lines.append("    'JOBS_ENABLED=0',")
+    for setting in PROFILE_ENV.get(name, []):
+        lines.append(f"    '{setting}',")
+    lines.append(']')
+    lines.append("wsgi_app = 'main:app'")
+    return '\n'.join(lines) + '\n'
+
+def uvicorn_command(name='web', cores=None):
+    """uvicorn equivalent of the profile (WSGI interface, no threads)"""
+    profile = build_profile(name, cores)
+    host, port = profile['bind'].rsplit(':', 1)
+    env = ' '.join(['JOBS_ENABLED=0'] + PROFILE_ENV.get(name, []))
+    return (f"{env} uvicorn main:app --interface wsgi --host {host} --port {port} "
+            f"--workers {profile['workers']} --timeout-keep-alive {profile['keepalive']}")
+
+def nginx_snippet():
+    """nginx locations that send the submission path to the submit pool"""
+    web = build_profile('web')['bind']
+    submit = build_profile('submit')['bind']
+    lines = [
+        f'upstream groupleft_app {{ server {web}; }}',
+        f'upstream groupleft_submit {{ server {submit}; }}',
+    ]
+    for path in SUBMIT_PATHS:
+        lines.append(f'location = {path} {{ proxy_pass http://groupleft_submit; }}')
+    lines.append('location / { proxy_pass http://groupleft_app; }')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,429 @@
+"""Slug resolution with redirect history.
+
+Public URLs name entities by slug. ``SlugResolver`` keeps slug -> id maps
+in memory for the small entity types (categories, countries, languages,
+tags, pages, posts) and a bounded LRU for groups, which fall back to their
+unique slug index on a miss.
+
+Changing a slug records the old one in ``slug_history`` in the same
+transaction (from a ``before_flush`` hook), so old URLs answer with a 301
+instead of a 404. The history is held in memory as well; resolving a slug,
+current or old, never queries for the small types.
+
+Commits made in this worker are applied as they happen. Changes from other
+workers are picked up by a check, run when the invalidation bus reports one
+and at least every ``SLUG_REFRESH_INTERVAL`` seconds (default 60): one
+round trip comparing row counts and max ids per type and the newest history
+id, reloading only what moved. Cached group slugs are dropped as soon as
+the bus reports their group edited or deleted, and on a miss (the cached
+id no longer exists) before the slug is looked up again.
+
+New slugs come from ``allocate_slugs``: one ``LIKE 'base%'`` query finds
+whether the base and which ``base-N`` are in use, so a collision costs
+nothing extra and a batch of thousands of names needs one query per few
+hundred distinct bases. Model constructors only slugify; the views and
+seeding allocate, and ``save_with_slug`` flushes inside a savepoint and
+re-allocates if a concurrent writer took the slug first.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, redirect, request, url_for
+from sqlalchemy import delete, event, func, inspect, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from invalidation import invalidation_bus, ALL, NEW
+
+logger = logging.getLogger(__name__)
+
+def slugify(text, **kwargs):
+    """python-slugify's slugify; its transliteration tables load on first use, not at startup"""
+    from slugify import slugify
+    return slugify(text, **kwargs)
+
+GROUP = 'group'
+PRELOADED = ('category', 'country', 'language', 'tag', 'page', 'post')
+
+SUFFIX = re.compile(r'-(\d+)$')
+LIKE_BATCH = 200
+SAVE_ATTEMPTS = 3
+
+def entity_models():
+    from models import Category, Country, Language, Tag, Page, Post, WhatsAppGroup
+
+    return {'category': Category, 'country': Country, 'language': Language, 'tag': Tag,
+            'page': Page, 'post': Post, GROUP: WhatsAppGroup}
+
+class SlugMap:
+    """slug <-> id for one entity type"""
+
+    def __init__(self):
+        self.ids = {}
+        self.slugs = {}
+        self.max_id = 0
+
+    def set(self, entity_id, slug):
+        self.discard(entity_id)
+        self.ids[slug] = entity_id
+        self.slugs[entity_id] = slug
+        self.max_id = max(self.max_id, entity_id)
+
+    def discard(self, entity_id):
+        slug = self.slugs.pop(entity_id, None)
+        if slug is not None and self.ids.get(slug) == entity_id:
+            del self.ids[slug]
+
+class SlugResolver:
+    def __init__(self):
+        self.app = None
+        self.refresh_interval = 60.0
+        self.group_cache_size = 50_000
+        self.maps = None
+        self.history = {}  # entity type -> {old slug: id}
+        self.history_max_id = 0
+        self.groups = OrderedDict()  # LRU of current group slug -> id
+        self.group_slugs = {}  # id -> its slug in `groups`, to drop it by id
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._last_refresh = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.refresh_interval = float(os.environ.get('SLUG_REFRESH_INTERVAL', self.refresh_interval))
+        self.group_cache_size = int(os.environ.get('SLUG_GROUP_CACHE_SIZE', self.group_cache_size))
+        app.extensions['slugs'] = self
+        invalidation_bus.subscribe(PRELOADED + (GROUP,), self._on_invalidation)
+        if not event.contains(db.session, 'before_flush', self._before_flush):
+            event.listen(db.session, 'before_flush', self._before_flush)
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    # Resolving
+
+    def resolve(self, entity_type, slug):
+        """(id, moved) for a slug; moved means it is an old slug of that id. (None, False) if unknown"""
+        self._ensure_loaded()
+        if entity_type == GROUP:
+            entity_id = self._group_id(slug)
+        else:
+            entity_id = self.maps[entity_type].ids.get(slug)
+        if entity_id is not None:
+            return entity_id, False
+        entity_id = self.history.get(entity_type, {}).get(slug)
+        return entity_id, entity_id is not None
+
+    def forget(self, entity_type, slug):
+        """Drop a slug that turned out to point at a deleted entity"""
+        with self._lock:
+            if entity_type == GROUP:
+                self._pop_group(slug)
+            else:
+                self.history.get(entity_type, {}).pop(slug, None)
+
+    def _group_id(self, slug):
+        with self._lock:
+            entity_id = self.groups.get(slug)
+            if entity_id is not None:
+                self.groups.move_to_end(slug)
+                self.hits += 1
+                return entity_id
+            self.misses += 1
+        from models import WhatsAppGroup
+
+        entity_id = db.session.query(WhatsAppGroup.id).filter_by(slug=slug).scalar()
+        if entity_id is not None:
+            self._cache_group(slug, entity_id)
+        return entity_id
+
+    def _cache_group(self, slug, entity_id):
+        with self._lock:
+            self._drop_group(entity_id)
+            self._pop_group(slug)
+            self.groups[slug] = entity_id
+            self.group_slugs[entity_id] = slug
+            while len(self.groups) > self.group_cache_size:
+                self._pop_group(next(iter(self.groups)))
+
+    def _pop_group(self, slug):
+        entity_id = self.groups.pop(slug, None)
+        if entity_id is not None and self.group_slugs.get(entity_id) == slug:
+            del self.group_slugs[entity_id]
+
+    def _drop_group(self, entity_id):
+        slug = self.group_slugs.pop(entity_id, None)
+        if slug is not None and self.groups.get(slug) == entity_id:
+            del self.groups[slug]
+
+    # Loading and refreshing
+
+    def _ensure_loaded(self):
+        if self.maps is None:
+            with self._lock:
+                if self.maps is None:
+                    self.load()
+        elif time.monotonic() - self._last_refresh > self.refresh_interval:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Slug refresh failed: {e}")
+                finally:
+                    self._lock.release()
+
+    def load(self):
+        """Read every slug map and the whole history from the primary"""
+        from models import SlugHistory
+
+        models = entity_models()
+        maps = {}
+        history = {}
+        with db.engine.connect() as conn:
+            for entity_type in PRELOADED:
+                maps[entity_type] = self._read_map(conn, models[entity_type].__table__)
+            table = SlugHistory.__table__
+            history_max_id = 0
+            for row_id, entity_type, old_slug, entity_id in conn.execute(
+                    select(table.c.id, table.c.entity_type, table.c.old_slug, table.c.entity_id)):
+                history.setdefault(entity_type, {})[old_slug] = entity_id
+                history_max_id = max(history_max_id, row_id)
+        with self._lock:
+            self.maps = maps
+            self.history = history
+            self.history_max_id = history_max_id
+            self._last_refresh = time.monotonic()
+
+    def _read_map(self, conn, table, after_id=0, slug_map=None):
+        slug_map = slug_map or SlugMap()
+        for entity_id, slug in conn.execute(
+                select(table.c.id, table.c.slug).where(table.c.id > after_id)):
+            slug_map.set(entity_id, slug)
+        return slug_map
+
+    def refresh(self):
+        """Pick up slugs created, renamed or deleted by other workers"""
+        from models import SlugHistory
+
+        self._last_refresh = time.monotonic()
+        models = entity_models()
+        tables = [models[entity_type].__table__ for entity_type in PRELOADED]
+        history = SlugHistory.__table__
+        probes = []
+        for table in tables:
+            probes.append(select(func.count()).select_from(table).scalar_subquery())
+            probes.append(select(func.max(table.c.id)).scalar_subquery())
+        probes.append(select(func.max(history.c.id)).scalar_subquery())
+
+        with db.engine.connect() as conn:
+            row = conn.execute(select(*probes)).one()
+            renamed = set()
+            if (row[-1] or 0) > self.history_max_id:
+                for row_id, entity_type, old_slug, entity_id in conn.execute(
+                        select(history.c.id, history.c.entity_type, history.c.old_slug, history.c.entity_id)
+                        .where(history.c.id > self.history_max_id)):
+                    self.history.setdefault(entity_type, {})[old_slug] = entity_id
+                    self.history_max_id = max(self.history_max_id, row_id)
+                    if entity_type == GROUP:
+                        self._pop_group(old_slug)
+                    else:
+                        renamed.add(entity_type)
+            for i, (entity_type, table) in enumerate(zip(PRELOADED, tables)):
+                count, max_id = row[2 * i], row[2 * i + 1] or 0
+                slug_map = self.maps[entity_type]
+                if entity_type in renamed:
+                    self.maps[entity_type] = self._read_map(conn, table)
+                    continue
+                if max_id > slug_map.max_id:
+                    self._read_map(conn, table, slug_map.max_id, slug_map)
+                if count != len(slug_map.slugs):
+                    self.maps[entity_type] = self._read_map(conn, table)
+
+    def _on_invalidation(self, topic, entity_id, op):
+        # New groups need nothing: their slugs are looked up on a miss. A deleted
+        # or edited group may have freed its slug for another one.
+        if topic == GROUP and op != NEW:
+            with self._lock:
+                self._drop_group(entity_id)
+        elif topic == ALL:
+            with self._lock:
+                self.groups.clear()
+                self.group_slugs.clear()
+        if topic != GROUP or op != NEW:
+            self._last_refresh = float('-inf')
+
+    # Change tracking
+
+    def _changed_slugs(self, session):
+        """(type, entity, new slug, old slug) for pending slug changes; new is None for deletes"""
+        types = {model: entity_type for entity_type, model in entity_models().items()}
+        for obj in session.new:
+            entity_type = types.get(type(obj))
+            if entity_type:
+                yield entity_type, obj, obj.slug, None
+        for obj in session.dirty:
+            entity_type = types.get(type(obj))
+            if entity_type:
+                added, _, deleted = inspect(obj).attrs.slug.history
+                if added and deleted and added[0] != deleted[0]:
+                    yield entity_type, obj, added[0], deleted[0]
+        for obj in session.deleted:
+            entity_type = types.get(type(obj))
+            if entity_type:
+                yield entity_type, obj, None, obj.slug
+
+    def _before_flush(self, session, flush_context, instances):
+        from models import SlugHistory
+
+        table = SlugHistory.__table__
+        for entity_type, obj, slug, old_slug in list(self._changed_slugs(session)):
+            if slug is None:
+                if obj.id in self.history.get(entity_type, {}).values():
+                    session.execute(delete(table).where(table.c.entity_type == entity_type,
+                                                        table.c.entity_id == obj.id))
+                continue
+            if slug in self.history.get(entity_type, ()):
+                # Slug taken over as a live one: stop redirecting it
+                session.execute(delete(table).where(table.c.entity_type == entity_type,
+                                                    table.c.old_slug == slug))
+            if old_slug is not None:
+                session.execute(delete(table).where(table.c.entity_type == entity_type,
+                                                    table.c.old_slug == old_slug))
+                session.add(SlugHistory(entity_type=entity_type, old_slug=old_slug, entity_id=obj.id))
+
+    def _after_flush(self, session, flush_context):
+        changes = session.info.setdefault('slug_changes', [])
+        for entity_type, obj, slug, old_slug in self._changed_slugs(session):
+            changes.append((entity_type, obj.id, slug, old_slug))
+
+    def _after_commit(self, session):
+        # Released savepoints (save_with_slug) fire this too; wait for the real commit
+        if session.in_nested_transaction():
+            return
+        changes = session.info.pop('slug_changes', None)
+        if not changes or self.maps is None:
+            return
+        with self._lock:
+            for entity_type, entity_id, slug, old_slug in changes:
+                history = self.history.setdefault(entity_type, {})
+                if entity_type == GROUP:
+                    self._pop_group(old_slug)
+                    if slug is None:
+                        self._drop_group(entity_id)
+                    else:
+                        self._cache_group(slug, entity_id)
+                elif slug is None:
+                    self.maps[entity_type].discard(entity_id)
+                else:
+                    self.maps[entity_type].set(entity_id, slug)
+                if slug is None:
+                    for stale in [s for s, i in history.items() if i == entity_id]:
+                        del history[stale]
+                    continue
+                history.pop(slug, None)
+                if old_slug is not None:
+                    history[old_slug] = entity_id
+
+    def _after_rollback(self, session):
+        # A savepoint rolls back on a failed flush, which recorded nothing; keep the outer changes
+        if not session.in_nested_transaction():
+            session.info.pop('slug_changes', None)
+
+# Allocating
+
+def allocate_slugs(model, texts, exclude_id=None):
+    """Free slugs on `model` for each of `texts`, in order
+
+    A base that is free is used as is, even when some ``base-N`` exists;
+    a taken one gets the next suffix after the highest ``base-N`` taken.
+    Repeats within the batch get consecutive suffixes. `exclude_id` ignores
+    that row's own slug.
+    """
+    column = model.__table__.c.slug
+    max_length = column.type.length - 6  # room for a suffix
+    fallback = model.__tablename__.replace('_', '-')
+    bases = [slugify(text, max_length=max_length) or fallback for text in texts]
+
+    taken = set()  # bases in use as they are
+    highest = {}  # base -> highest suffix taken
+    distinct = list(dict.fromkeys(bases))
+    for start in range(0, len(distinct), LIKE_BATCH):
+        chunk = set(distinct[start:start + LIKE_BATCH])
+        query = db.session.query(column).filter(or_(*[column.like(f'{base}%') for base in chunk]))
+        if exclude_id is not None:
+            query = query.filter(model.__table__.c.id != exclude_id)
+        for (slug,) in query:
+            if slug in chunk:
+                taken.add(slug)
+            match = SUFFIX.search(slug)
+            if match and slug[:match.start()] in chunk:
+                base = slug[:match.start()]
+                highest[base] = max(highest.get(base, 0), int(match.group(1)))
+
+    slugs = []
+    allocated = set()  # "a" and "a-1" in one batch can both land on "a-1"
+    for base in bases:
+        if base not in taken and base not in allocated:
+            slug = base
+        else:
+            suffix = highest.get(base, 0) + 1
+            slug = f'{base}-{suffix}'
+            while slug in allocated:
+                suffix += 1
+                slug = f'{base}-{suffix}'
+            highest[base] = suffix
+        allocated.add(slug)
+        slugs.append(slug)
+    return slugs
+
+def allocate_slug(model, text, exclude_id=None):
+    """Free slug on `model` for `text` (one query)"""
+    return allocate_slugs(model, [text], exclude_id)[0]
+
+def save_with_slug(obj, text, allocate=False):
+    """Flush `obj` in a savepoint, allocating a new slug for `text` if asked or if a concurrent writer took its slug"""
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            with db.session.begin_nested():
+                if allocate or attempt:
+                    obj.slug = allocate_slug(type(obj), text, exclude_id=obj.id)
+                db.session.add(obj)
+                db.session.flush()
+            return obj.slug
+        except IntegrityError:
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
+            logger.info(f"Slug for {type(obj).__name__} taken concurrently, retrying")
+
+# Views
+
+def redirect_to_current(**view_args):
+    """Abort with a 301 to this endpoint with `view_args` swapped in, keeping the query string"""
+    args = request.args.to_dict()
+    args.update(request.view_args, **view_args)
+    abort(redirect(url_for(request.endpoint, **args), 301))
+
+def get_or_404(entity_type, slug, view_arg, options=()):
+    """Entity for a URL slug (loaded with `options`); an old slug redirects to the URL with the current one"""
+    entity_id, moved = slug_resolver.resolve(entity_type, slug)
+    if entity_id is None:
+        abort(404)
+    entity = db.session.get(entity_models()[entity_type], entity_id, options=options)
+    if entity is None:
+        # Cached for an entity deleted since; the slug may belong to another one now
+        slug_resolver.forget(entity_type, slug)
+        entity_id, moved = slug_resolver.resolve(entity_type, slug)
+        entity = db.session.get(entity_models()[entity_type], entity_id, options=options) \
+            if entity_id is not None else None
+        if entity is None:
+            abort(404)
+    if moved:
+        redirect_to_current(**{view_arg: entity.slug})
+    return entity
+
+slug_resolver = SlugResolver()
@@ -0,0 +1,157 @@
+"""SQLite production mode: pragmas, engine profile and a serialized write queue.
+
+Most small installs run on the SQLite file ``app.wsgi`` defaults to. For a
+file database ``create_app`` swaps the Postgres-style pool settings for a
+SQLite profile and sets on every connection:
+
+* ``journal_mode=WAL``: readers no longer block the writer or each other
+* ``synchronous=NORMAL``: durable at checkpoints, no fsync per commit
+* ``busy_timeout`` (``SQLITE_BUSY_TIMEOUT_MS``, default 5000): a writer waits
+  for the lock instead of failing with "database is locked"
+* ``cache_size`` (``SQLITE_CACHE_KB``, default 65536) and ``mmap_size``
+  (``SQLITE_MMAP_MB``, default 256)
+
+Background writes (analytics flushes, prunes, tag usage counts) go through
+``write_queue``: one writer thread per worker holding the worker's single
+writer connection, which takes the write lock up front (``BEGIN
+IMMEDIATE``) and commits whatever jobs are queued, up to
+``SQLITE_WRITE_BATCH`` (default 50), in one transaction, each job in its
+own savepoint. Request writes keep using the session; WAL and the busy
+timeout are what keep concurrent submissions from failing.
+
+Jobs are functions of a Core connection. On other databases, or with
+``SQLITE_MODE=0``, they run inline in their own transaction.
+"""
+import logging
+import os
+import queue
+from concurrent.futures import Future
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from app import db
+from background import ProcessThread
+
+logger = logging.getLogger(__name__)
+
+def is_sqlite_file(url):
+    return bool(url) and url.startswith('sqlite') and ':memory:' not in url and url.rstrip('/') != 'sqlite:'
+
+def enabled(url):
+    return is_sqlite_file(url) and os.environ.get('SQLITE_MODE', '1') == '1'
+
+def busy_timeout_ms():
+    return int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+def engine_options(options):
+    """`options` with the pool settings that only matter for network databases replaced"""
+    options = {k: v for k, v in options.items() if k not in ('pool_recycle', 'pool_pre_ping')}
+    options['connect_args'] = {'timeout': busy_timeout_ms() / 1000.0}
+    return options
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={busy_timeout_ms()}')
+    cursor.execute(f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KB', 65536))}")
+    cursor.execute(f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_MB', 256)) * 1024 * 1024}")
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+def install_pragmas(app):
+    """Set the pragmas on each SQLite file engine's new connections"""
+    with app.app_context():
+        for engine in db.engines.values():
+            if is_sqlite_file(str(engine.url)) and not event.contains(engine, 'connect', set_pragmas):
+                event.listen(engine, 'connect', set_pragmas)
+
+def writer_engine(url):
+    """One connection, with transactions the driver doesn't begin for us"""
+    engine = create_engine(url, poolclass=StaticPool,
+                           connect_args={'check_same_thread': False, 'isolation_level': None,
+                                         'timeout': busy_timeout_ms() / 1000.0})
+    event.listen(engine, 'connect', set_pragmas)
+
+    @event.listens_for(engine, 'begin')
+    def begin_immediate(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return engine
+
+class WriteQueue:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.max_batch = 50
+        self.url = None
+        self._queue = queue.Queue()
+        self._writer = ProcessThread('sqlite-writer', self._run, setup=self._open_writer)
+        self._engine = None
+
+    def init_app(self, app):
+        self.app = app
+        self.url = app.config['SQLALCHEMY_DATABASE_URI']
+        self.enabled = enabled(self.url)
+        self.max_batch = int(os.environ.get('SQLITE_WRITE_BATCH', self.max_batch))
+        app.extensions['write_queue'] = self
+
+    def submit(self, job):
+        """Future for `job(connection)`, run in the next batch (inline when the queue is off)"""
+        future = Future()
+        if not self.enabled:
+            try:
+                with db.engine.begin() as connection:
+                    future.set_result(job(connection))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._writer.ensure()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job, timeout=60):
+        """Run `job(connection)` and return its result"""
+        return self.submit(job).result(timeout)
+
+    def _open_writer(self):
+        # Connections don't survive a fork either, so each worker opens its own
+        self._engine = writer_engine(self.url)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._execute(batch)
+
+    def _execute(self, batch):
+        outcomes = []
+        try:
+            with self._engine.begin() as connection:
+                for job, future in batch:
+                    savepoint = connection.begin_nested()
+                    try:
+                        result = job(connection)
+                    except Exception as e:
+                        savepoint.rollback()
+                        outcomes.append((future, None, e))
+                    else:
+                        savepoint.commit()
+                        outcomes.append((future, result, None))
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+write_queue = WriteQueue()
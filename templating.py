@@ -0,0 +1,100 @@
+"""Template helpers: group card fragment cache and precompiled templates.
+
+Group cards are the bulk of every listing page. ``render_group_card`` renders
+the shared macros in ``_group_card.html`` once per (group.id, updated_at,
+options) and keeps the HTML in a per-worker LRU, so a page of 20 cards costs
+20 dict lookups once warm. Anything that changes a card without touching the
+group row (taxonomy renames, tag deletes) must call ``card_cache.clear()``;
+other workers clear theirs when the invalidation bus reports the change.
+
+``flask compile-templates`` compiles every template to Python modules at
+build time; when ``TEMPLATE_MODULES_PATH`` points at that directory, workers
+load the compiled modules instead of parsing the sources on first hit.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import ChoiceLoader, ModuleLoader
+from markupsafe import Markup
+
+CARD_TEMPLATE = '_group_card.html'
+CARD_MACROS = {
+    'full': 'group_card',
+    'compact': 'group_card_compact',
+}
+
+class FragmentCache:
+    """Small thread-safe LRU for rendered HTML fragments"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+card_cache = FragmentCache()
+
+def render_group_card(group, variant='full', **options):
+    """Rendered card HTML for `group`, served from the fragment cache when possible"""
+    key = (variant, group.id, group.updated_at, tuple(sorted(options.items())))
+    html = card_cache.get(key)
+    if html is None:
+        template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+        macro = getattr(template.module, CARD_MACROS[variant])
+        html = Markup(str(macro(group, **options)))
+        card_cache.set(key, html)
+    return html
+
+def compile_templates(app, target):
+    """Compile all templates of `app` into Python modules under `target`"""
+    os.makedirs(target, exist_ok=True)
+    app.jinja_env.compile_templates(target, zip=None, ignore_errors=False)
+    return len(app.jinja_env.list_templates())
+
+def _on_taxonomy_change(topic, entity_id, op):
+    if op != 'new':
+        card_cache.clear()
+
+def init_app(app):
+    from invalidation import invalidation_bus
+
+    card_cache.max_entries = int(os.environ.get('CARD_CACHE_SIZE', card_cache.max_entries))
+    invalidation_bus.subscribe(('category', 'country', 'language', 'tag'), _on_taxonomy_change)
+    app.jinja_env.globals['render_group_card'] = render_group_card
+
+    modules_path = app.config.get('TEMPLATE_MODULES_PATH') or os.environ.get('TEMPLATE_MODULES_PATH')
+    if modules_path and os.path.isdir(modules_path):
+        # Compiled modules first; sources remain as fallback for anything new
+        app.jinja_env.loader = ChoiceLoader([
+            ModuleLoader(modules_path),
+            app.create_global_jinja_loader(),
+        ])
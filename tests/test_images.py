@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from images import backoff, MAX_BACKOFF_HOURS
+
+def test_backoff_doubles_per_failure():
+    assert [backoff(n) for n in (1, 2, 3)] == [timedelta(hours=2), timedelta(hours=4), timedelta(hours=8)]
+
+def test_backoff_is_capped():
+    assert backoff(8) == timedelta(hours=MAX_BACKOFF_HOURS)
+
+def test_backoff_survives_large_failure_counts():
+    # timedelta(hours=2 ** 35) overflows; the exponent is capped first
+    for failures in (35, 64, 10_000):
+        assert backoff(failures) == timedelta(hours=MAX_BACKOFF_HOURS)
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import startup
+
+def test_cold_start_within_baseline():
+    # overhead is relative to the framework import in the same interpreter,
+    # so the committed baseline holds on machines other than the one that recorded it
+    results = startup.run(5)
+    assert startup.regressions(results, startup.load_baseline()) == [], results
+
+def test_optional_modules_are_not_imported_at_startup(tmp_path):
+    script = ("import sys; from main import app; "
+              "print(' '.join(sorted({'flask_ckeditor', 'flask_mail', 'flask_wtf', 'wtforms', "
+              "'slugify', 'multiprocessing', 'prerender'} & set(sys.modules))))")
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=startup.ROOT, env=startup._env(f"sqlite:///{tmp_path / 'startup.db'}"),
+        check=True, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == ''
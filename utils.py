@@ -1,5 +1,5 @@
-from slugify import slugify
 from models import Tag, db
+from slugs import allocate_slugs, save_with_slug
 import re
 
 def create_or_get_tag(tag_name):
@@ -11,8 +11,7 @@ def create_or_get_tag(tag_name):
     tag = Tag.query.filter_by(name=tag_name).first()
     if not tag:
         tag = Tag(name=tag_name)
-        db.session.add(tag)
-        db.session.flush()  # To get the ID
+        save_with_slug(tag, tag_name, allocate=True)  # also gets the ID
     
     return tag
 
@@ -55,18 +54,17 @@ def truncate_text(text, length=160):
 def update_tag_usage_counts():
     """Update usage_count for all tags based on approved groups"""
     from models import Tag, WhatsAppGroup, group_tags
-    from app import db
-    
-    tags = Tag.query.all()
-    for tag in tags:
-        approved_count = db.session.query(WhatsAppGroup)\
-                                  .join(group_tags)\
-                                  .filter(group_tags.c.tag_id == tag.id,
-                                         WhatsAppGroup.status == 'approved')\
-                                  .count()
-        tag.usage_count = approved_count
+    from sqlite_mode import write_queue
+    from sqlalchemy import func, select
     
-    db.session.commit()
+    # One statement through the write queue instead of a count query per tag
+    tags = Tag.__table__
+    groups = WhatsAppGroup.__table__
+    approved = select(func.count()).select_from(group_tags.join(groups, groups.c.id == group_tags.c.group_id))\
+        .where(group_tags.c.tag_id == tags.c.id, groups.c.status == 'approved')\
+        .scalar_subquery()
+    stmt = tags.update().values(usage_count=approved)
+    return write_queue.run(lambda connection: connection.execute(stmt).rowcount)
 
 def get_site_settings():
     """Get site settings or create default ones"""
@@ -78,3 +76,68 @@ def get_site_settings():
         db.session.add(settings)
         db.session.commit()
     return settings
+
+def _add_missing(model, names, slug_text=lambda name: name):
+    """Add a `model` row for each of `names` not in the table yet, slugs allocated in one batch"""
+    existing = {name for (name,) in db.session.query(model.name)}
+    missing = [name for name in names if name not in existing]
+    for name, slug in zip(missing, allocate_slugs(model, [slug_text(name) for name in missing])):
+        obj = model(name=name)
+        obj.slug = slug
+        db.session.add(obj)
+
+def seed_default_data():
+    """Create the default categories, countries and languages if missing"""
+    from models import Category, Country, Language
+    from app import db
+    
+    # Categories
+    categories_data = [
+        'Adult/18+/Hot', 'Art/Design/Photography', 'Auto/Vehicle', 'Business/Advertising/Marketing',
+        'Comedy/Funny', 'Dating/Flirting/Chatting', 'Education/School', 'Entertainment/Masti',
+        'Family/Relationships', 'Fan Club/Celebrities', 'Fashion/Style/Clothing', 'Film/Animation',
+        'Food/Drinks', 'Gaming/Apps', 'Health/Beauty/Fitness', 'Jobs/Career', 'Money/Earning',
+        'Music/Audio/Songs', 'News/Magazines/Politics', 'Pets/Animals/Nature', 'Roleplay/Comics',
+        'Science/Technology', 'Shopping/Buy/Sell', 'Social/Friendship/Community', 'Spiritual/Devotional',
+        'Sports/Games', 'Thoughts/Quotes/Jokes', 'Travel/Local/Place'
+    ]
+    
+    _add_missing(Category, categories_data)
+    
+    # Countries
+    countries_data = [
+        'Algeria', 'Argentina', 'Australia', 'Austria', 'Azerbaijan', 'Bahrain', 'Bangladesh',
+        'Belarus', 'Belgium', 'Bolivia', 'Bosnia and Herzegovina', 'Brazil', 'Bulgaria',
+        'Canada', 'Chile', 'China', 'Colombia', 'Croatia', 'Czechia', 'Denmark', 'Egypt',
+        'Estonia', 'Ethiopia', 'Finland', 'France', 'Georgia', 'Germany', 'Ghana', 'Greece',
+        'Hong Kong', 'Hungary', 'Iceland', 'India', 'Indonesia', 'Iraq', 'Ireland', 'Israel',
+        'Italy', 'Jamaica', 'Japan', 'Jordan', 'Kazakhstan', 'Kenya', 'Kuwait', 'Latvia',
+        'Lebanon', 'Libya', 'Lithuania', 'Luxembourg', 'Macedonia', 'Malawi', 'Malaysia',
+        'Mexico', 'Montenegro', 'Morocco', 'Mozambique', 'Nepal', 'Netherlands', 'New Zealand',
+        'Nigeria', 'Norway', 'Oman', 'Pakistan', 'Panama', 'Peru', 'Philippines', 'Poland',
+        'Portugal', 'Puerto Rico', 'Qatar', 'Romania', 'Russia', 'Saudi Arabia', 'Senegal',
+        'Serbia', 'Singapore', 'Slovakia', 'Slovenia', 'South Africa', 'South Korea', 'Spain',
+        'Sri Lanka', 'Sweden', 'Switzerland', 'Taiwan', 'Tanzania', 'Thailand', 'Togo',
+        'Tunisia', 'Turkey', 'Uganda', 'Ukraine', 'United Arab Emirates', 'United Kingdom',
+        'United States', 'Venezuela', 'Vietnam', 'Yemen', 'Zimbabwe'
+    ]
+    
+    _add_missing(Country, countries_data, lambda name: name.replace(' ', '_'))
+    
+    # Languages
+    languages_data = [
+        'Afrikaans', 'Albanian', 'Amharic', 'Arabic', 'Armenian', 'Azerbaijani', 'Bangla',
+        'Basque', 'Belarusian', 'Bosnian', 'Bulgarian', 'Catalan', 'Chinese', 'Croatian',
+        'Czech', 'Danish', 'Dutch', 'English', 'Estonian', 'Filipino', 'Finnish', 'French',
+        'Galician', 'Georgian', 'German', 'Greek', 'Gujarati', 'Hebrew', 'Hindi', 'Hungarian',
+        'Icelandic', 'Indonesian', 'Italian', 'Japanese', 'Kannada', 'Kazakh', 'Khmer',
+        'Korean', 'Kyrgyz', 'Lao', 'Latvian', 'Lithuanian', 'Macedonian', 'Malay',
+        'Malayalam', 'Marathi', 'Mongolian', 'Myanmar', 'Nepali', 'Norwegian', 'Persian',
+        'Polish', 'Portuguese', 'Punjabi', 'Romanian', 'Russian', 'Serbian', 'Sinhala',
+        'Slovak', 'Slovenian', 'Spanish', 'Swahili', 'Swedish', 'Tamil', 'Telugu', 'Thai',
+        'Turkish', 'Ukrainian', 'Urdu', 'Uzbek', 'Vietnamese', 'Zulu'
+    ]
+    
+    _add_missing(Language, languages_data)
+    
+    db.session.commit()
@@ -1,22 +1,31 @@
-import requests
-from bs4 import BeautifulSoup
 import re
 import logging
 
+from metrics import metrics
+
+# requests and BeautifulSoup are imported inside the functions below: they are
+# only needed on the submission/verification paths and are slow to import.
+
 logger = logging.getLogger(__name__)
 
+@metrics.timed
 def fetch_group_image(invite_link):
     """
     Fetch WhatsApp group image from invite link
     Returns the image URL or None if not found
     """
+    import requests
+    from bs4 import BeautifulSoup
+    
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         
         response = requests.get(invite_link, headers=headers, timeout=10)
-        if response.status_code == 200:
+        if response.status_code != 200:
+            metrics.api_error('fetch_group_image', 'status')
+        else:
             soup = BeautifulSoup(response.content, 'html.parser')
             
             # Look for Open Graph image
@@ -40,14 +49,19 @@ def fetch_group_image(invite_link):
         return None
         
     except Exception as e:
+        metrics.api_error('fetch_group_image', 'exception')
         logger.error(f"Error fetching group image from {invite_link}: {str(e)}")
         return None
 
+@metrics.timed
 def get_group_info(invite_link):
     """
     Get basic group information from WhatsApp invite link
     Returns dict with name, description, image_url, member_count
     """
+    import requests
+    from bs4 import BeautifulSoup
+    
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -55,6 +69,7 @@ def get_group_info(invite_link):
         
         response = requests.get(invite_link, headers=headers, timeout=10)
         if response.status_code != 200:
+            metrics.api_error('get_group_info', 'status')
             return None
         
         soup = BeautifulSoup(response.content, 'html.parser')
@@ -89,22 +104,57 @@ def get_group_info(invite_link):
         }
         
     except Exception as e:
+        metrics.api_error('get_group_info', 'exception')
         logger.error(f"Error getting group info from {invite_link}: {str(e)}")
         return None
 
+@metrics.timed
+def download_image(url, max_bytes):
+    """
+    Download an image, at most max_bytes of it
+    Returns the bytes or None if it is missing, too large or not an image
+    """
+    import requests
+    
+    try:
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        
+        with requests.get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code != 200:
+                metrics.api_error('download_image', 'status')
+                return None
+            if not response.headers.get('Content-Type', '').startswith('image/'):
+                return None
+            data = response.raw.read(max_bytes + 1, decode_content=True)
+        return data if len(data) <= max_bytes else None
+        
+    except Exception as e:
+        metrics.api_error('download_image', 'exception')
+        logger.error(f"Error downloading image {url}: {str(e)}")
+        return None
+
+@metrics.timed
 def verify_invite_link(invite_link):
     """
     Verify if a WhatsApp invite link is valid and active
     Returns True if valid, False otherwise
     """
+    import requests
+    
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
         
         response = requests.head(invite_link, headers=headers, timeout=10, allow_redirects=True)
-        return response.status_code == 200
+        if response.status_code != 200:
+            metrics.api_error('verify_invite_link', 'status')
+            return False
+        return True
         
     except Exception as e:
+        metrics.api_error('verify_invite_link', 'exception')
         logger.error(f"Error verifying invite link {invite_link}: {str(e)}")
         return False